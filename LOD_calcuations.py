@@ -1,6 +1,6 @@
 #######
 #  Author: Agosh Saini
-# Contact: contact@agoshsaini.com   
+# Contact: contact@agoshsaini.com
 #######
 # This file is a class for LOD calculations
 #######
@@ -11,20 +11,219 @@ import numpy as np
 import os
 import re
 
+import json_db
+
+from array_utils import pad_ragged, group_sums
+from feature_extraction import baseline_stats, peak_change
+
+###### CONSTANTS ######
+
+# Keys identifying one calibration curve
+GROUP_KEYS = ['Analyte', 'Material', 'Sensor Type']
+
 ###### CLASS DEFINITION ######
 
 class LOD_calculations:
-    def __init__(self, data_folder):
+    def __init__(self, data_folder, baseline_fraction=0.2, sigma_factor=3):
+        """
+        Computes the limit of detection (LOD) of every sensor from the formatted entries of a
+        json_folder. The entries are loaded once and stacked into padded arrays, and the baseline
+        noise, responses, calibration slopes and LODs of all sensors are computed together.
+
+        The baseline and noise of a cycle come from the end of its "Off" data, see
+        feature_extraction.baseline_stats. The response is the largest relative change from the
+        baseline during the "On" data, computed as in feature_extraction.extract_features.
+
+        Parameters:
+            data_folder (str): The json_folder holding the formatted entries.
+            baseline_fraction (float): Fraction of the end of each "Off" array used as the baseline.
+            sigma_factor (float): LOD = sigma_factor * noise / slope, 3 by default.
+        """
         self.data_folder = data_folder
+        self.baseline_fraction = baseline_fraction
+        self.sigma_factor = sigma_factor
+
+        self.db = json_db.json_db(data_folder)
+
+        # Cycle metadata and padded arrays, filled by load
+        self.cycles = None
+        self.on = None
+        self.off = None
+        self.on_lengths = None
+        self.off_lengths = None
+        self.features = None
+
+    def load(self, filters=None):
+        """
+        Loads the entries matching the filters and stacks their ON and OFF arrays.
+
+        Parameters:
+            filters (dict): json_db.query filters, e.g. {'Analyte': 'EtOH'}. All entries if not provided.
+
+        Returns:
+            DataFrame: One row per cycle with its Analyte, Material, Sensor Type, ppm and path.
+        """
+        records = self.db.query(filters)
+
+        if not records:
+            raise ValueError(f"No entries found in {self.data_folder}.")
+
+        entries = [self.db.load_record(record) for record in records]
+
+        self.cycles = pd.DataFrame({
+            'Analyte': [', '.join(entry['Analyte']) for entry in entries],
+            'Material': [', '.join(entry['Material']) for entry in entries],
+            'Sensor Type': [entry['Sensor Type'] for entry in entries],
+            'ppm': [float(entry['ppm']) for entry in entries],
+            'path': [record['path'] for record in records],
+        })
+
+        self.on, self.on_lengths = pad_ragged([entry['ON'] for entry in entries])
+        self.off, self.off_lengths = pad_ragged([entry['OFF'] for entry in entries])
+        self.features = None
+
+        return self.cycles
+
+    def cycle_features(self):
+        """
+        Computes the baseline resistance, relative baseline noise and relative response of every
+        loaded cycle at once.
+
+        Returns:
+            DataFrame: The cycle metadata with 'baseline', 'noise' and 'response' columns.
+        """
+        if self.features is not None:
+            return self.features
+
+        if self.cycles is None:
+            self.load()
+
+        baseline, noise = baseline_stats(self.off, self.off_lengths, self.baseline_fraction)
+        response = np.abs(peak_change(self.on, self.on_lengths, baseline)[2])
+
+        features = self.cycles.copy()
+        features['baseline'] = baseline
+        features['noise'] = noise
+        features['response'] = response
+
+        self.features = features
+
+        return features
+
+    def select_values(self, analyte, concentration=None):
+        """
+        Returns the mask of the loaded cycles of an analyte, and of a concentration if given.
+
+        Parameters:
+            analyte (str): The analyte.
+            concentration (float): The concentration in ppm (optional).
+        """
+        if self.cycles is None:
+            self.load()
 
-    def select_values(self, analyte, concentration):
-        pass
+        mask = (self.cycles['Analyte'] == analyte).to_numpy()
+
+        if concentration is not None:
+            mask &= (self.cycles['ppm'] == float(concentration)).to_numpy()
+
+        return mask
 
     def get_baseline_data(self, analyte):
-        pass
+        """
+        Returns the baseline resistance and relative noise of every cycle of an analyte.
+
+        Parameters:
+            analyte (str): The analyte.
+        """
+        features = self.cycle_features()
+
+        return features.loc[self.select_values(analyte), GROUP_KEYS + ['ppm', 'baseline', 'noise']]
 
     def get_sensor_data(self, concentration):
-        pass
+        """
+        Returns the responses of every sensor to a concentration, for all analytes.
+
+        Parameters:
+            concentration (float): The concentration in ppm.
+        """
+        features = self.cycle_features()
+        mask = (features['ppm'] == float(concentration)).to_numpy()
+
+        return features.loc[mask, GROUP_KEYS + ['ppm', 'baseline', 'response']]
+
+    def calculate_lod(self, analyte=None):
+        """
+        Fits the response against ppm for every analyte, material and sensor at once and returns
+        the LODs. With a single concentration, the calibration line goes through the origin.
+
+        Parameters:
+            analyte (str): The analyte. All analytes if not provided.
+
+        Returns:
+            DataFrame: One row per calibration curve with 'cycles', 'concentrations', 'slope',
+                       'intercept', 'r2', 'noise' and 'lod_ppm' columns.
+        """
+        features = self.cycle_features()
+
+        if analyte is not None:
+            features = features[self.select_values(analyte)]
+
+        features = features.dropna(subset=['ppm', 'noise', 'response'])
+
+        if features.empty:
+            raise ValueError(f"No usable cycles for analyte '{analyte}'.")
+
+        # Groups are numbered in order of first appearance, matching drop_duplicates. Missing keys
+        # such as a None 'Sensor Type' form their own group instead of a NaN id
+        groups = features.groupby(GROUP_KEYS, sort=False, dropna=False).ngroup().to_numpy()
+        keys = features[GROUP_KEYS].drop_duplicates()
+        n_groups = len(keys)
+
+        x = features['ppm'].to_numpy()
+        y = features['response'].to_numpy()
+
+        count, sum_x, sum_y, sum_xx, sum_xy, sum_yy, sum_noise = group_sums(
+            groups, n_groups, np.ones_like(x), x, y, x * x, x * y, y * y, features['noise'].to_numpy())
+
+        # Number of distinct concentrations of each group
+        pairs = np.unique(np.stack([groups, x]), axis=1)
+        concentrations = np.bincount(pairs[0].astype(int), minlength=n_groups)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sxx = sum_xx - sum_x ** 2 / count
+            sxy = sum_xy - sum_x * sum_y / count
+            syy = sum_yy - sum_y ** 2 / count
+
+            # Least squares line, or a line through the origin for a single concentration
+            single = concentrations < 2
+            slope = np.where(single, sum_xy / sum_xx, sxy / sxx)
+            intercept = np.where(single, 0.0, (sum_y - slope * sum_x) / count)
+            r2 = np.where(single, np.nan, sxy ** 2 / (sxx * syy))
+
+            noise = sum_noise / count
+            lod = self.sigma_factor * noise / np.abs(slope)
+
+        results = keys.reset_index(drop=True)
+        results['cycles'] = count.astype(int)
+        results['concentrations'] = concentrations
+        results['slope'] = slope
+        results['intercept'] = intercept
+        results['r2'] = r2
+        results['noise'] = noise
+        results['lod_ppm'] = lod
+
+        return results.sort_values(GROUP_KEYS, ignore_index=True)
+
+
+###### MAIN ######
+if __name__ == "__main__":
+    data_folder = input("Enter the folder with the formatted entries (default json_folder): ") or 'json_folder'
+
+    calculator = LOD_calculations(data_folder)
+    results = calculator.calculate_lod()
+
+    print(results.to_string(index=False))
 
-    def calculate_lod(self, analyte):
-        pass
+    output_path = 'lod_results.csv'
+    results.to_csv(output_path, index=False)
+    print(f"LOD results saved at: {output_path}")
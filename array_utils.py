@@ -0,0 +1,76 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file has helpers for batch operations on the ragged ON/OFF arrays of many entries.
+
+##### IMPORTS #####
+
+import numpy as np
+
+##### FUNCTIONS #####
+
+def pad_ragged(arrays, fill=np.nan, dtype=float):
+    """
+    Stacks arrays of different lengths into one 2-D array, one row per array, padding the end
+    of the shorter rows.
+
+    Parameters:
+        arrays (list): The 1-D arrays.
+        fill (float): Value of the padding.
+        dtype: dtype of the stacked array.
+
+    Returns:
+        tuple: (2-D array of shape (len(arrays), longest length), lengths array)
+    """
+    lengths = np.fromiter((len(array) for array in arrays), dtype=int, count=len(arrays))
+    padded = np.full((len(arrays), lengths.max(initial=0)), fill, dtype=dtype)
+
+    # The valid cells in row-major order match the order of the concatenated arrays
+    if lengths.sum():
+        padded[valid_mask(lengths, padded.shape[1])] = np.concatenate([np.asarray(array, dtype=dtype) for array in arrays])
+
+    return padded, lengths
+
+
+def valid_mask(lengths, width):
+    """
+    Returns the mask of the cells holding data in an array padded by pad_ragged.
+
+    Parameters:
+        lengths (array): Length of each row.
+        width (int): Width of the padded array.
+    """
+    return np.arange(width) < np.asarray(lengths)[:, None]
+
+
+def window_mask(lengths, width, start, stop):
+    """
+    Returns a mask selecting columns start to stop of each row of a padded array, where start
+    and stop are given per row.
+
+    Parameters:
+        lengths (array): Length of each row.
+        width (int): Width of the padded array.
+        start (array or int): First column of each row.
+        stop (array or int): Column after the last one of each row, clipped to the row length.
+    """
+    columns = np.arange(width)
+    stop = np.minimum(stop, lengths)
+
+    return (columns >= np.reshape(start, (-1, 1))) & (columns < np.reshape(stop, (-1, 1)))
+
+
+def group_sums(groups, n_groups, *values):
+    """
+    Returns the sum of each value array within each group.
+
+    Parameters:
+        groups (array): Group number of each element, from 0 to n_groups - 1.
+        n_groups (int): Number of groups.
+        values (array): Arrays to sum, NaN elements count as zero.
+
+    Returns:
+        list: One array of n_groups sums per value array.
+    """
+    return [np.bincount(groups, weights=np.nan_to_num(value), minlength=n_groups) for value in values]
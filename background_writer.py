@@ -0,0 +1,177 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a class for writing output files in background threads while the pipeline
+# keeps processing.
+
+##### IMPORTS #####
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+##### FUNCTIONS #####
+
+def write_file(path, payload, message=None):
+    """
+    Writes bytes to a file and prints a message once it is written.
+
+    Parameters:
+        path (str): Output path.
+        payload (bytes): File content.
+        message (str): Printed after the file is written (optional).
+    """
+    with open(path, 'wb') as output_file:
+        output_file.write(payload)
+
+    # One write with the newline, so the messages of concurrent writer threads stay on their own lines
+    if message is not None:
+        print(message + '\n', end='')
+
+
+def save_csv(frame, path, writer=None, columns=None):
+    """
+    Saves a DataFrame as CSV without its index, in the background if a writer is given.
+
+    Parameters:
+        frame (DataFrame): The data.
+        path (str): Output path.
+        writer (background_writer): Writer the file is submitted to. Written immediately if not provided.
+        columns (list): Columns to save. Defaults to all columns.
+
+    Returns:
+        int: Number of bytes of the file.
+    """
+    # Formatting the CSV holds the GIL, only the file write is left to the writer threads
+    payload = frame.to_csv(index=False, columns=columns).encode('utf-8')
+    message = f"File {path} has been saved."
+
+    if writer is None:
+        write_file(path, payload, message)
+    else:
+        writer.write(path, payload, message)
+
+    return len(payload)
+
+##### CLASS DEFINITION #####
+
+class background_writer:
+
+    def __init__(self, workers=4, max_pending=32):
+        """
+        Runs file writes in a pool of threads so the processing loop does not wait on the disk.
+        At most max_pending writes are queued, submit blocks once the queue is full. The first
+        error of a write is raised by the next submit or flush.
+
+        Callers format their output before submitting it: the threads overlap the disk writes
+        with the processing, the formatting itself would only compete for the GIL.
+
+        Parameters:
+            workers (int): Number of writer threads. 0 runs every write immediately in the caller.
+            max_pending (int): Largest number of queued and running writes.
+        """
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='writer') if workers > 0 else None
+        self.submitted = 0
+        self.blocked_seconds = 0.0
+
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = []
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a write, waiting for a free slot if max_pending writes are queued.
+
+        Parameters:
+            func (callable): The write function.
+            args, kwargs: Arguments of the function.
+
+        Returns:
+            Future: The future of the write, None if it ran immediately.
+        """
+        self.raise_errors()
+        self.submitted += 1
+
+        if self.executor is None:
+            func(*args, **kwargs)
+            return None
+
+        start = time.perf_counter()
+        self._slots.acquire()
+        self.blocked_seconds += time.perf_counter() - start
+
+        try:
+            future = self.executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._pending.add(future)
+
+        future.add_done_callback(self._done)
+
+        return future
+
+    def write(self, path, payload, message=None):
+        """
+        Queues writing bytes to a file, see write_file.
+        """
+        return self.submit(write_file, path, payload, message)
+
+    def _done(self, future):
+        """
+        Frees the slot of a finished write and keeps its error.
+        """
+        with self._lock:
+            self._pending.discard(future)
+
+            if not future.cancelled() and future.exception() is not None:
+                self._errors.append(future.exception())
+
+        self._slots.release()
+
+    def raise_errors(self):
+        """
+        Raises the first error of the finished writes, if any.
+        """
+        with self._lock:
+            errors, self._errors = self._errors, []
+
+        if errors:
+            if len(errors) > 1:
+                print(f"{len(errors) - 1} more background writes failed.")
+
+            raise errors[0]
+
+    def flush(self):
+        """
+        Waits for the queued writes and raises the first error of a failed write.
+        """
+        with self._lock:
+            pending = list(self._pending)
+
+        wait(pending)
+        self.raise_errors()
+
+    def close(self):
+        """
+        Waits for the queued writes and stops the threads. Errors are not raised, call flush first.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
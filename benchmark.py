@@ -0,0 +1,312 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file benchmarks each processing stage and the whole pipeline on synthetic relay logs.
+
+##### IMPORTS #####
+
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from shutil import rmtree
+
+import main
+import json_db
+import synthetic_data
+
+from csv_loader import load_raw_csv
+from repeat_splitter import cycle_data_formatter
+from split_relay_data import SplitRelayData
+from gas_data_formatting import multi_sensor_format
+
+##### CONSTANTS #####
+
+STAGES = ('load', 'repeat_split', 'relay_split', 'format', 'save', 'pipeline')
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+##### FUNCTIONS #####
+
+def measure(func, *args, quiet=True, **kwargs):
+    """
+    Runs a function and measures its wall time and peak traced memory.
+
+    Parameters:
+        func (callable): The function to run.
+        quiet (bool): If True, the output printed by the function is discarded.
+        args, kwargs: Arguments of the function.
+
+    Returns:
+        tuple: (result, seconds, peak bytes)
+    """
+    tracemalloc.reset_peak()
+    start_current, _ = tracemalloc.get_traced_memory()
+
+    with open(os.devnull, 'w') as devnull:
+        redirect = contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext()
+
+        with redirect:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+
+    _, peak = tracemalloc.get_traced_memory()
+
+    return result, elapsed, max(peak - start_current, 0)
+
+
+def count_rows(filepath, block_size=1 << 20):
+    """
+    Returns the number of data rows of a CSV file, counted in blocks without parsing.
+
+    Parameters:
+        filepath (str): Path to the CSV file.
+        block_size (int): Number of bytes read at a time.
+    """
+    with open(filepath, 'rb') as f:
+        lines = sum(block.count(b'\n') for block in iter(lambda: f.read(block_size), b''))
+
+    return lines - 1
+
+
+def split_relays(repeats, formatter):
+    """
+    Splits every repeat per relay, as main.process_repeat does for the relay CSV files and plots.
+
+    Returns:
+        list: (relay base name, relay DataFrame) tuples.
+    """
+    relay_frames = []
+
+    for repeat_num, repeat_data in repeats.items():
+        file_name = formatter.repeat_name(repeat_num)
+        frames = SplitRelayData(file_name, repeat_data, output_dir=None).generate_files(graph=False)
+        relay_frames.extend((f"{file_name}_{sensor}", frame) for sensor, frame in frames.items())
+
+    return relay_frames
+
+
+def format_repeats(repeats, formatter):
+    """
+    Formats all the relays of every repeat at once, as main.process_repeat does. The sensor
+    label of each relay is its sensor name, e.g. PN1.3.
+
+    Returns:
+        list: The formatted entries.
+    """
+    entries = []
+
+    for repeat_num, repeat_data in repeats.items():
+        file_name = formatter.repeat_name(repeat_num)
+        spliter = SplitRelayData(file_name, repeat_data, output_dir=None)
+
+        if not spliter.relays:
+            continue
+
+        repeat_formatter = multi_sensor_format(filepath=f"{file_name}.csv", data=repeat_data, analytes=main.ANALYTES,
+                                               materials=main.MATERIALS,
+                                               columns=[f'Relay {relay} Resistance' for relay in spliter.relays],
+                                               sensor_types=spliter.sensor_names,
+                                               from_files=[f"{file_name}_{sensor}.csv" for sensor in spliter.sensor_names])
+        entries.extend(repeat_formatter.format())
+
+    return entries
+
+
+def save_formatted(entries, json_folder, storage_backend, storage_encoding=None):
+    """
+    Saves the formatted entries into a new json_db folder.
+
+    Returns:
+        list: Paths of the saved entries.
+    """
+    db_json = json_db.json_db(json_folder, backend=storage_backend, encoding=storage_encoding)
+
+    saved = main.save_entries(entries, "benchmark", json_folder, db_json)
+    db_json.close()
+
+    return saved
+
+
+def benchmark_file(filepath, stages=STAGES, storage_backend='json', chunksize=None, quiet=True, storage_encoding=None):
+    """
+    Times the stages on one raw file. Each stage runs on the output of an earlier one, so the
+    'repeat_split' to 'save' stages need the 'load' stage. The 'relay_split' and 'format'
+    stages both start from the repeats, as the relay split is only kept for the relay CSV files
+    and plots.
+
+    Parameters:
+        filepath (str): Path to the raw file.
+        stages (tuple): Stages to run, see STAGES.
+        storage_backend (str): json_db storage backend of the 'save' and 'pipeline' stages.
+        chunksize (int): If set, the 'pipeline' stage streams the file in chunks of this many rows.
+        quiet (bool): If True, the output printed by the stages is discarded.
+        storage_encoding (str): json_db encoding of the ON and OFF arrays of the 'save' and 'pipeline' stages.
+
+    Returns:
+        list: One result dictionary per stage.
+    """
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+
+    def record(stage, rows, seconds, peak):
+        results.append({
+            'file': os.path.basename(filepath),
+            'stage': stage,
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_s': rows / max(seconds, 1e-9),
+            'peak_mb': peak / 1e6,
+        })
+
+    tracemalloc.start()
+
+    try:
+        if 'load' in stages:
+            data, seconds, peak = measure(load_raw_csv, filepath, report=False, quiet=quiet)
+            rows = len(data)
+            record('load', rows, seconds, peak)
+
+            formatter = cycle_data_formatter(filepath=filepath, data=data, output_dir=None)
+
+            if 'repeat_split' in stages:
+                repeats, seconds, peak = measure(formatter.process_cycles, quiet=quiet)
+                record('repeat_split', rows, seconds, peak)
+
+                if 'relay_split' in stages:
+                    relay_frames, seconds, peak = measure(split_relays, repeats, formatter, quiet=quiet)
+                    record('relay_split', rows, seconds, peak)
+
+                if 'format' in stages:
+                    entries, seconds, peak = measure(format_repeats, repeats, formatter, quiet=quiet)
+                    record('format', rows, seconds, peak)
+
+                    if 'save' in stages:
+                        json_folder = os.path.join(work_dir, 'save')
+                        _, seconds, peak = measure(save_formatted, entries, json_folder, storage_backend,
+                                                   storage_encoding, quiet=quiet)
+                        record('save', rows, seconds, peak)
+
+            # Release the stage outputs before the pipeline run
+            data = formatter = repeats = relay_frames = entries = None
+
+        if 'pipeline' in stages:
+            rows = count_rows(filepath)
+            pipeline_dir = os.path.join(work_dir, 'pipeline')
+            _, seconds, peak = measure(main.main, filepath, work_dir=pipeline_dir, storage_backend=storage_backend,
+                                       storage_encoding=storage_encoding, chunksize=chunksize, plots='off', quiet=quiet)
+            record('pipeline', rows, seconds, peak)
+
+    finally:
+        tracemalloc.stop()
+        rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=STAGES, storage_backend='json', chunksize=None, data_dir=None,
+                   quiet=True, storage_encoding=None, **generator_args):
+    """
+    Generates a synthetic log for each size and times the stages on it.
+
+    Parameters:
+        sizes (tuple): Approximate number of rows of each log.
+        stages (tuple): Stages to run, see STAGES.
+        storage_backend (str): json_db storage backend of the 'save' and 'pipeline' stages.
+        chunksize (int): If set, the 'pipeline' stage streams the file in chunks of this many rows.
+        data_dir (str): Directory for the generated logs, kept after the run. A temporary directory
+                        is used and removed if not provided.
+        quiet (bool): If True, the output printed by the stages is discarded.
+        storage_encoding (str): json_db encoding of the ON and OFF arrays of the 'save' and 'pipeline' stages.
+        generator_args: Other synthetic_data.iter_relay_log parameters.
+
+    Returns:
+        list: One result dictionary per size and stage.
+    """
+    keep_data = data_dir is not None
+    data_dir = data_dir or tempfile.mkdtemp(prefix='benchmark_data_')
+
+    results = []
+
+    try:
+        for size in sizes:
+            repeats = synthetic_data.rows_to_repeats(size, **{
+                key: value for key, value in generator_args.items()
+                if key in ('ppm', 'sample_rate', 'pre_duration', 'on_duration', 'off_duration')
+            })
+
+            print(f"Generating a log of about {size} rows ({repeats} repeats)...")
+            filepath = synthetic_data.write_relay_log(data_dir, date="20240101", repeats=repeats, **generator_args)
+
+            file_results = benchmark_file(filepath, stages, storage_backend, chunksize, quiet, storage_encoding)
+            print_results(file_results)
+            results.extend(file_results)
+
+            if not keep_data:
+                os.remove(filepath)
+    finally:
+        if not keep_data:
+            rmtree(data_dir, ignore_errors=True)
+
+    return results
+
+
+def print_results(results):
+    """
+    Prints the benchmark results as a table.
+
+    Parameters:
+        results (list): Results returned by benchmark_file.
+    """
+    print(f"{'stage':<14}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'peak MB':>10}")
+
+    for result in results:
+        print(f"{result['stage']:<14}{result['rows']:>12}{result['seconds']:>10.3f}"
+              f"{result['rows_per_s']:>14,.0f}{result['peak_mb']:>10.1f}")
+
+
+def save_results(results, path):
+    """
+    Saves the benchmark results as JSON, for comparing runs across changes.
+
+    Parameters:
+        results (list): Results returned by run_benchmarks.
+        path (str): Output path.
+    """
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=4)
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic relay logs.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Approximate number of rows of each log, e.g. 10000 1000000 100000000.")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help="Stages to run.")
+    parser.add_argument('--relays', type=int, default=8, help="Number of relays.")
+    parser.add_argument('--ppm', type=int, nargs='+', default=[1250], help="Concentrations of the cycles.")
+    parser.add_argument('--sample-rate', type=float, default=2.0, help="Samples per second.")
+    parser.add_argument('--noise', type=float, default=0.002, help="Relative noise level.")
+    parser.add_argument('--backend', default='json', help="json_db storage backend.")
+    parser.add_argument('--encoding', choices=json_db.ENCODINGS, default=None,
+                        help="Encoding of the ON and OFF arrays for the json and ndjson backends.")
+    parser.add_argument('--chunksize', type=int, default=None, help="Stream the pipeline stage in chunks.")
+    parser.add_argument('--data-dir', default=None, help="Keep the generated logs in this directory.")
+    parser.add_argument('--output', default=None, help="Save the results as JSON.")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the stages.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, tuple(args.stages), args.backend, args.chunksize, args.data_dir,
+                             quiet=not args.verbose, storage_encoding=args.encoding, n_relays=args.relays, ppm=tuple(args.ppm),
+                             sample_rate=args.sample_rate, noise=args.noise)
+
+    if args.output:
+        save_results(results, args.output)
+        print(f"Results saved at: {args.output}")
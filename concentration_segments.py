@@ -0,0 +1,192 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file assigns the concentration of each cycle of multi-ppm repeat and cascade files.
+
+##### IMPORTS #####
+
+import re
+import numpy as np
+
+from cycle_codes import get_phase, get_repeat, PHASE_ON, PHASE_OFF
+from csv_loader import RELAY_COLUMNS
+
+##### FUNCTIONS #####
+
+def parse_ppm(name):
+    """
+    Returns the concentrations written in a file name, in order, e.g. [1250, 2500] for
+    20241105_PN1_CuOxSnOx_H2_1250ppm_2500ppm_rep=3.
+
+    Parameters:
+        name (str): The file name.
+    """
+    return [int(match) for match in re.findall(r'(\d+)ppm', name)]
+
+
+def parse_repeats(name):
+    """
+    Returns the number of repeats written in a file name ('rep=N'), 1 if there is none.
+
+    Parameters:
+        name (str): The file name.
+    """
+    match = re.search(r'rep=(\d+)', name)
+
+    return int(match.group(1)) if match else 1
+
+
+def label_segments(ordinals, n_concentrations, repeats=1, rep_method='C', n_cycles=None):
+    """
+    Returns the concentration index of cycles from their position in the file.
+
+    Cascade files ('C') hold each concentration for its repeats before stepping to the next:
+    with 3 concentrations and 2 repeats, the cycles are 0 0 1 1 2 2. Repeat files ('R') run
+    the whole concentration sequence once per repeat: 0 1 2 0 1 2. A file with exactly one
+    cycle per concentration gives 0 1 2 with both methods.
+
+    Parameters:
+        ordinals (array): Position of each cycle in the file, from 0.
+        n_concentrations (int): Number of concentrations.
+        repeats (int): Number of repeats of each concentration.
+        rep_method (str): 'C' for cascade files, 'R' for repeat files.
+        n_cycles (int): Number of cycles in the file, if known.
+
+    Returns:
+        array: Concentration index of each cycle, -1 for cycles past the last concentration.
+    """
+    ordinals = np.asarray(ordinals)
+
+    if n_concentrations <= 1:
+        return np.where(ordinals >= 0, 0, -1)
+
+    if n_cycles == n_concentrations:
+        repeats = 1
+
+    if rep_method == 'C':
+        index = ordinals // max(repeats, 1)
+    else:
+        index = ordinals % n_concentrations
+
+    return np.where((index >= 0) & (index < n_concentrations), index, -1)
+
+
+def cycle_responses(data, columns=None):
+    """
+    Returns the mean relative response of each repeat, averaged over the resistance columns,
+    computed for all repeats in one pass.
+
+    Parameters:
+        data (DataFrame): Data with a 'Cycle' or 'Phase' and 'Repeat' columns.
+        columns (list): Resistance columns. Defaults to the relay columns present in the data.
+
+    Returns:
+        tuple: (sorted repeat numbers, response of each repeat)
+    """
+    if columns is None:
+        columns = [column for column in RELAY_COLUMNS if column in data.columns]
+
+    phase = get_phase(data)
+    repeat = get_repeat(data)
+
+    keep = (repeat >= 0) & ((phase == PHASE_ON) | (phase == PHASE_OFF))
+    repeats, group = np.unique(repeat[keep], return_inverse=True)
+    is_on = phase[keep] == PHASE_ON
+
+    values = data[columns].to_numpy(dtype=float)[keep]
+    finite = np.isfinite(values)
+    values = np.where(finite, values, 0.0)
+
+    # Mean resistance of each repeat and column during "On" and "Off"
+    n_repeats = len(repeats)
+    bins = group * 2 + (~is_on)
+    sums = np.column_stack([np.bincount(bins, weights=values[:, i], minlength=n_repeats * 2) for i in range(len(columns))])
+    counts = np.column_stack([np.bincount(bins, weights=finite[:, i], minlength=n_repeats * 2) for i in range(len(columns))])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).reshape(n_repeats, 2, len(columns))
+        relative = np.abs(means[:, 0] - means[:, 1]) / np.abs(means[:, 1])
+        responses = np.nanmean(relative, axis=1) if len(columns) else np.full(n_repeats, np.nan)
+
+    return repeats, responses
+
+
+def step_segments(responses, n_concentrations):
+    """
+    Splits a sequence of cycle responses into n_concentrations contiguous steps, with the
+    boundaries at the largest jumps between consecutive cycles.
+
+    Parameters:
+        responses (array): Response of each cycle, in file order.
+        n_concentrations (int): Number of steps.
+
+    Returns:
+        array: Step index of each cycle.
+    """
+    responses = np.asarray(responses, dtype=float)
+    jumps = np.abs(np.diff(np.nan_to_num(responses)))
+
+    # Boundary after each of the n_concentrations - 1 largest jumps
+    boundaries = np.zeros(len(responses), dtype=int)
+    largest = np.argsort(jumps, kind='stable')[::-1][:n_concentrations - 1]
+    boundaries[largest + 1] = 1
+
+    return np.cumsum(boundaries)
+
+
+def segment_concentrations(data, n_concentrations, repeats=1, rep_method='C', columns=None):
+    """
+    Assigns a concentration index to every repeat of a file. The cycle labels are used when the
+    number of repeats matches the file name, one cycle per concentration or `repeats` cycles per
+    concentration. Otherwise cascade files are split at the largest steps of the response.
+
+    Parameters:
+        data (DataFrame): Data with a 'Cycle' column, or decoded 'Phase' and 'Repeat' columns.
+        n_concentrations (int): Number of concentrations in the file name.
+        repeats (int): Number of repeats in the file name.
+        rep_method (str): 'C' for cascade files, 'R' for repeat files.
+        columns (list): Resistance columns used for step detection.
+
+    Returns:
+        tuple: (sorted repeat numbers, concentration index of each repeat)
+    """
+    repeat = get_repeat(data)
+    repeat_numbers = np.unique(repeat[repeat >= 0])
+    n_cycles = len(repeat_numbers)
+
+    if n_concentrations <= 1:
+        return repeat_numbers, np.zeros(n_cycles, dtype=int)
+
+    if rep_method != 'C' or n_cycles in (n_concentrations, n_concentrations * repeats):
+        return repeat_numbers, label_segments(np.arange(n_cycles), n_concentrations, repeats, rep_method, n_cycles)
+
+    print(f"Found {n_cycles} cycles for {n_concentrations} concentrations and {repeats} repeats, "
+          f"splitting the cycles at the response steps.")
+
+    repeat_numbers, responses = cycle_responses(data, columns)
+
+    return repeat_numbers, step_segments(responses, n_concentrations)
+
+
+def row_concentrations(repeat, repeat_numbers, index):
+    """
+    Maps the repeat number of every row to its concentration index.
+
+    Parameters:
+        repeat (array): Repeat number of each row.
+        repeat_numbers (array): Sorted repeat numbers, see segment_concentrations.
+        index (array): Concentration index of each repeat.
+
+    Returns:
+        array: Concentration index of each row, -1 for rows outside the repeats.
+    """
+    repeat = np.asarray(repeat)
+
+    if len(repeat_numbers) == 0:
+        return np.full(len(repeat), -1)
+
+    position = np.clip(np.searchsorted(repeat_numbers, repeat), 0, len(repeat_numbers) - 1)
+    found = repeat_numbers[position] == repeat
+
+    return np.where(found, np.asarray(index)[position], -1)
@@ -0,0 +1,167 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file has the shared loader for raw acquisition CSV files.
+
+##### IMPORTS #####
+
+import os
+import time
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+##### CONSTANTS #####
+
+TIME_COLUMN = 'Elapsed Time (s)'
+CYCLE_COLUMN = 'Cycle'
+RELAY_COLUMNS = [f'Relay {i} Resistance' for i in range(1, 9)]
+
+# Columns of the raw acquisition files and their types
+RAW_SCHEMA = {
+    TIME_COLUMN: 'float',
+    CYCLE_COLUMN: 'category',
+    **{column: 'float' for column in RELAY_COLUMNS},
+}
+
+##### FUNCTIONS #####
+
+def read_header(filepath):
+    """
+    Returns the column names of a CSV file without reading its rows.
+
+    Parameters:
+        filepath (str): Path to the CSV file.
+    """
+    return pd.read_csv(filepath, nrows=0).columns.tolist()
+
+
+def raw_dtypes(columns, float_dtype='float64'):
+    """
+    Returns the explicit dtypes of the known raw columns among the given columns.
+
+    Parameters:
+        columns (list): Column names.
+        float_dtype (str): dtype of the time and resistance columns, 'float64' or 'float32'.
+    """
+    return {
+        column: float_dtype if RAW_SCHEMA[column] == 'float' else RAW_SCHEMA[column]
+        for column in columns if column in RAW_SCHEMA
+    }
+
+
+def select_columns(filepath, columns=None):
+    """
+    Returns the columns to read from a raw file.
+
+    Parameters:
+        filepath (str): Path to the CSV file.
+        columns (list or str): Columns to read. None reads the raw schema columns present in the
+                               file, 'all' reads every column.
+    """
+    header = read_header(filepath)
+
+    if columns is None:
+        return [column for column in header if column in RAW_SCHEMA]
+    if columns == 'all':
+        return header
+
+    return [column for column in header if column in columns]
+
+
+def load_raw_csv(filepath, columns=None, float_dtype='float64', engine='auto', report=True):
+    """
+    Loads a raw acquisition CSV with explicit dtypes, reading only the needed columns. The
+    multithreaded pyarrow parser is used when it is installed.
+
+    The parse throughput is stored in data.attrs['parse_report'].
+
+    Parameters:
+        filepath (str): Path to the CSV file.
+        columns (list or str): Columns to read, see select_columns.
+        float_dtype (str): dtype of the time and resistance columns, 'float64' or 'float32'.
+        engine (str): 'auto', 'pyarrow' or 'c'.
+        report (bool): If True, the parse throughput is printed.
+
+    Returns:
+        DataFrame: The loaded data.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"File not found: {filepath}")
+
+    if engine == 'auto':
+        engine = 'pyarrow' if pyarrow is not None else 'c'
+
+    usecols = select_columns(filepath, columns)
+
+    start = time.perf_counter()
+    data = pd.read_csv(filepath, usecols=usecols, dtype=raw_dtypes(usecols, float_dtype), engine=engine)
+    elapsed = time.perf_counter() - start
+
+    data.attrs['parse_report'] = parse_report(filepath, len(data), elapsed, engine)
+
+    if report:
+        print_report(data.attrs['parse_report'])
+
+    return data
+
+
+def iter_raw_csv(filepath, chunksize, columns=None, float_dtype='float64'):
+    """
+    Reads a raw acquisition CSV in chunks with explicit dtypes, reading only the needed columns.
+    Chunked reading uses the C parser.
+
+    Parameters:
+        filepath (str): Path to the CSV file.
+        chunksize (int): Number of rows per chunk.
+        columns (list or str): Columns to read, see select_columns.
+        float_dtype (str): dtype of the time and resistance columns, 'float64' or 'float32'.
+
+    Yields:
+        DataFrame: The next chunk.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"File not found: {filepath}")
+
+    usecols = select_columns(filepath, columns)
+
+    yield from pd.read_csv(filepath, usecols=usecols, dtype=raw_dtypes(usecols, float_dtype), chunksize=chunksize)
+
+
+def parse_report(filepath, rows, elapsed, engine):
+    """
+    Returns the parse throughput of a load.
+
+    Parameters:
+        filepath (str): Path to the loaded file.
+        rows (int): Number of rows read.
+        elapsed (float): Parse time in seconds.
+        engine (str): The parser engine.
+    """
+    size = os.path.getsize(filepath)
+    elapsed = max(elapsed, 1e-9)
+
+    return {
+        'file': filepath,
+        'engine': engine,
+        'rows': rows,
+        'bytes': size,
+        'seconds': elapsed,
+        'rows_per_s': rows / elapsed,
+        'mb_per_s': size / elapsed / 1e6,
+    }
+
+
+def print_report(report):
+    """
+    Prints a parse report.
+
+    Parameters:
+        report (dict): Report returned by parse_report.
+    """
+    print(f"Parsed {report['rows']} rows ({report['bytes'] / 1e6:.1f} MB) in {report['seconds']:.2f} s "
+          f"with the {report['engine']} engine: {report['rows_per_s']:,.0f} rows/s, {report['mb_per_s']:.1f} MB/s")
@@ -0,0 +1,159 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file decodes the 'Cycle' labels into integer phase codes and repeat numbers.
+
+##### IMPORTS #####
+
+import re
+import numpy as np
+import pandas as pd
+
+##### CONSTANTS #####
+
+# Phase codes, PHASE_NONE marks rows without a recognised label
+PHASE_NONE = -1
+PHASE_PRE = 0
+PHASE_ON = 1
+PHASE_OFF = 2
+
+PHASE_LABELS = {PHASE_PRE: "Pre", PHASE_ON: "On", PHASE_OFF: "Off"}
+
+# Repeat number used for rows that do not belong to a repeat
+NO_REPEAT = -1
+
+# Columns added by add_cycle_codes, they are not written to the repeat and relay CSV files
+CODE_COLUMNS = ('Phase', 'Repeat')
+
+# Patterns of the labelled repeat cycles
+ON_PATTERN = re.compile(r"Run-On Cycle \(Repeat (\d+)\)", re.IGNORECASE)
+OFF_PATTERN = re.compile(r"Off Cycle \(Repeat (\d+)\)", re.IGNORECASE)
+
+##### FUNCTIONS #####
+
+def decode_label(label):
+    """
+    Decodes a single 'Cycle' label into its phase code and repeat number.
+
+    "Run-On Cycle (Repeat N)" and "Off Cycle (Repeat N)" give the On/Off phase and repeat N.
+    Other labels are classified by containing 'off', 'pre' or 'on' (case-insensitive) and
+    have no repeat number.
+
+    Parameters:
+        label (str): The 'Cycle' label.
+
+    Returns:
+        tuple: (phase code, repeat number)
+    """
+    if not isinstance(label, str):
+        return PHASE_NONE, NO_REPEAT
+
+    on_match = ON_PATTERN.search(label)
+    if on_match:
+        return PHASE_ON, int(on_match.group(1))
+
+    off_match = OFF_PATTERN.search(label)
+    if off_match:
+        return PHASE_OFF, int(off_match.group(1))
+
+    lowered = label.lower()
+
+    if 'off' in lowered:
+        return PHASE_OFF, NO_REPEAT
+    if 'pre' in lowered:
+        return PHASE_PRE, NO_REPEAT
+    if 'on' in lowered:
+        return PHASE_ON, NO_REPEAT
+
+    return PHASE_NONE, NO_REPEAT
+
+
+def decode_cycles(cycle):
+    """
+    Decodes a 'Cycle' column into phase codes and repeat numbers. Only the unique labels
+    are parsed, the rows are then mapped with a single lookup.
+
+    Parameters:
+        cycle (Series or array): The 'Cycle' labels, categorical columns are used as-is.
+
+    Returns:
+        tuple: (phase codes as int8 array, repeat numbers as int32 array)
+    """
+    if not isinstance(cycle, pd.Series):
+        cycle = pd.Series(cycle)
+
+    if isinstance(cycle.dtype, pd.CategoricalDtype):
+        codes = cycle.cat.codes.to_numpy()
+        uniques = cycle.cat.categories
+    else:
+        codes, uniques = pd.factorize(cycle)
+
+    decoded = [decode_label(label) for label in uniques]
+
+    # The trailing entry is picked by the missing value code -1
+    phase_table = np.array([phase for phase, _ in decoded] + [PHASE_NONE], dtype=np.int8)
+    repeat_table = np.array([repeat for _, repeat in decoded] + [NO_REPEAT], dtype=np.int32)
+
+    return phase_table[codes], repeat_table[codes]
+
+
+def add_cycle_codes(data):
+    """
+    Returns the data with 'Phase' and 'Repeat' columns decoded from the 'Cycle' column. The
+    columns are added to a shallow copy, the given DataFrame is not modified and no data is
+    copied. Data that already has both columns is returned unchanged so the labels are only
+    parsed once.
+
+    Parameters:
+        data (DataFrame): DataFrame with a 'Cycle' column.
+
+    Returns:
+        DataFrame: The data with 'Phase' and 'Repeat' columns.
+    """
+    if all(column in data.columns for column in CODE_COLUMNS):
+        return data
+
+    phase, repeat = decode_cycles(data['Cycle'])
+
+    data = data.copy(deep=False)
+    data['Phase'] = phase
+    data['Repeat'] = repeat
+
+    return data
+
+
+def raw_columns(data):
+    """
+    Returns the columns of a DataFrame without the ones added by add_cycle_codes.
+
+    Parameters:
+        data (DataFrame): The data.
+    """
+    return [column for column in data.columns if column not in CODE_COLUMNS]
+
+
+def get_phase(data):
+    """
+    Returns the phase codes of a DataFrame, using its 'Phase' column when present.
+
+    Parameters:
+        data (DataFrame): DataFrame with a 'Phase' or 'Cycle' column.
+    """
+    if 'Phase' in data.columns:
+        return data['Phase'].to_numpy()
+
+    return decode_cycles(data['Cycle'])[0]
+
+
+def get_repeat(data):
+    """
+    Returns the repeat numbers of a DataFrame, using its 'Repeat' column when present.
+
+    Parameters:
+        data (DataFrame): DataFrame with a 'Repeat' or 'Cycle' column.
+    """
+    if 'Repeat' in data.columns:
+        return data['Repeat'].to_numpy()
+
+    return decode_cycles(data['Cycle'])[1]
@@ -0,0 +1,132 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file has functions for reducing long signals to a drawable number of points.
+
+##### IMPORTS #####
+
+import numpy as np
+
+##### FUNCTIONS #####
+
+def minmax_envelope(x, y, n_buckets=2000):
+    """
+    Decimates a signal by keeping the minimum and maximum sample of each bucket of consecutive
+    samples, in their original order. Peaks and dips survive, so the drawn envelope matches
+    a plot of every sample.
+
+    Parameters:
+        x (array): The x values, e.g. time.
+        y (array): The y values, e.g. resistance.
+        n_buckets (int): Number of buckets, at most 2 * n_buckets points are returned.
+
+    Returns:
+        tuple: (decimated x, decimated y)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    if n <= 2 * n_buckets:
+        return x, y
+
+    bucket_size = n // n_buckets
+    full = bucket_size * n_buckets
+    offsets = np.arange(n_buckets) * bucket_size
+
+    # NaN samples are never picked as a bucket minimum or maximum
+    buckets = y[:full].reshape(n_buckets, bucket_size)
+    nan = np.isnan(buckets)
+    min_idx = np.argmin(np.where(nan, np.inf, buckets), axis=1) + offsets
+    max_idx = np.argmax(np.where(nan, -np.inf, buckets), axis=1) + offsets
+
+    indices = [min_idx, max_idx]
+
+    # The remaining samples form one last, shorter bucket
+    if full < n:
+        tail = y[full:]
+        if not np.all(np.isnan(tail)):
+            indices.append([full + np.nanargmin(tail), full + np.nanargmax(tail)])
+
+    indices = np.unique(np.concatenate(indices))
+
+    return x[indices], y[indices]
+
+
+def lttb(x, y, n_out=2000):
+    """
+    Decimates a signal with the Largest-Triangle-Three-Buckets algorithm, which keeps the
+    samples that best preserve the visual shape of the line.
+
+    Parameters:
+        x (array): The x values, sorted in increasing order.
+        y (array): The y values.
+        n_out (int): Number of points returned.
+
+    Returns:
+        tuple: (decimated x, decimated y)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # The first and last samples are always kept, the rest is split into n_out - 2 buckets
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(int) + 1
+    edges[-1] = n - 1
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+
+        # Average of the next bucket, the last sample for the final bucket
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = np.nanmean(y[stop:next_stop]) if not np.all(np.isnan(y[stop:next_stop])) else y[selected]
+
+        area = np.abs((x[selected] - avg_x) * (y[start:stop] - y[selected])
+                      - (x[selected] - x[start:stop]) * (avg_y - y[selected]))
+
+        selected = start + int(np.argmax(np.where(np.isnan(area), -1, area)))
+        indices[i + 1] = selected
+
+    return x[indices], y[indices]
+
+
+def decimate_window(x, y, xlim=None, n_buckets=2000, method='minmax'):
+    """
+    Decimates the part of a signal that falls inside a visible x range. One sample on each side
+    of the range is kept so the line reaches the edges of the view.
+
+    Parameters:
+        x (array): The x values, sorted in increasing order.
+        y (array): The y values.
+        xlim (tuple): Visible (xmin, xmax) range. Defaults to the whole signal.
+        n_buckets (int): Number of buckets, e.g. the width of the axes in pixels.
+        method (str): 'minmax' for minmax_envelope or 'lttb' for lttb.
+
+    Returns:
+        tuple: (decimated x, decimated y)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if xlim is not None:
+        start = max(np.searchsorted(x, min(xlim), side='left') - 1, 0)
+        stop = min(np.searchsorted(x, max(xlim), side='right') + 1, len(x))
+        x = x[start:stop]
+        y = y[start:stop]
+
+    if method == 'minmax':
+        return minmax_envelope(x, y, n_buckets)
+    if method == 'lttb':
+        return lttb(x, y, 2 * n_buckets)
+
+    raise ValueError(f"Unknown decimation method '{method}'. Expected 'minmax' or 'lttb'.")
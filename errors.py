@@ -0,0 +1,13 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file holds the exceptions shared by the processing modules.
+
+##### CLASS DEFINITION #####
+
+class MissingMetadataError(ValueError):
+    """
+    Raised when a file name lacks metadata the processing needs, such as its date, repeat count
+    or PN sensor label.
+    """
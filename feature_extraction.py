@@ -0,0 +1,324 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file computes the response features of formatted cycles in batches and stores them
+# next to the entries of a json_folder.
+
+##### IMPORTS #####
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+import json_db
+
+from array_utils import pad_ragged, valid_mask, window_mask
+
+##### CONSTANTS #####
+
+# Features of every cycle, stored in the features file next to the entries
+FEATURE_KEYS = ['baseline', 'noise', 'delta_r', 'response', 't90_response', 't90_recovery', 'slope_on', 'slope_off']
+
+FEATURES_FILENAME = '_features.jsonl'
+
+##### FUNCTIONS #####
+
+def masked_slope(x, y, mask):
+    """
+    Returns the least-squares slope of y against x over the masked cells of each row.
+
+    Parameters:
+        x (array): 2-D x values.
+        y (array): 2-D y values.
+        mask (array): 2-D mask of the cells used in each row, NaN values of y are left out.
+
+    Returns:
+        tuple: (slope, mean of x, mean of y, number of cells) per row.
+    """
+    mask = mask & np.isfinite(y)
+    n = mask.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(mask, x, 0).sum(axis=1) / n
+        mean_y = np.where(mask, y, 0).sum(axis=1) / n
+
+        dx = np.where(mask, x - mean_x[:, None], 0)
+        dy = np.where(mask, y - mean_y[:, None], 0)
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+
+    return slope, mean_x, mean_y, n
+
+
+def baseline_stats(off, off_lengths, baseline_fraction=0.2):
+    """
+    Returns the baseline resistance and relative noise of each cycle. The baseline is the end
+    of the "Off" data, once the sensor has recovered, and the noise is the RMS deviation of
+    that window from a straight line, relative to the baseline.
+
+    Parameters:
+        off (array): Padded "Off" resistances, one row per cycle.
+        off_lengths (array): Length of each row.
+        baseline_fraction (float): Fraction of the end of each row used as the baseline.
+
+    Returns:
+        tuple: (baseline, noise) arrays.
+    """
+    # At least 3 samples are needed to fit the drift and keep a residual
+    window = np.maximum(np.ceil(off_lengths * baseline_fraction).astype(int), 3)
+    mask = window_mask(off_lengths, off.shape[1], off_lengths - window, off_lengths)
+
+    x = np.broadcast_to(np.arange(off.shape[1], dtype=float), off.shape)
+    drift, mean_x, baseline, n = masked_slope(x, off, mask)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residual = np.where(mask & np.isfinite(off), off - baseline[:, None] - drift[:, None] * (x - mean_x[:, None]), 0)
+        noise = np.sqrt((residual ** 2).sum(axis=1) / (n - 2)) / np.abs(baseline)
+
+    return baseline, noise
+
+
+def first_index(condition):
+    """
+    Returns the first column where a condition holds in each row, or -1 if it never does.
+
+    Parameters:
+        condition (array): 2-D boolean array.
+    """
+    index = np.argmax(condition, axis=1)
+
+    return np.where(condition.any(axis=1), index, -1)
+
+
+def peak_change(on, on_lengths, baseline):
+    """
+    Returns the relative change (R - baseline) / baseline of the "On" data and its largest
+    deviation from the baseline in each cycle. Padding and missing samples are never picked.
+
+    Parameters:
+        on (array): Padded "On" resistances, one row per cycle.
+        on_lengths (array): Length of each "On" row.
+        baseline (array): Baseline resistance of each cycle, see baseline_stats.
+
+    Returns:
+        tuple: (relative change, its absolute value with -inf in invalid cells, largest change with its sign)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        on_change = (on - baseline[:, None]) / baseline[:, None]
+
+    on_valid = valid_mask(on_lengths, on.shape[1]) & np.isfinite(on_change)
+    on_deviation = np.where(on_valid, np.abs(on_change), -np.inf)
+
+    peak = np.argmax(on_deviation, axis=1)
+
+    return on_change, on_deviation, np.take_along_axis(on_change, peak[:, None], axis=1)[:, 0]
+
+
+def extract_features(on, on_lengths, off, off_lengths, timestep, baseline_fraction=0.2, slope_window=10.0):
+    """
+    Computes the response features of many cycles at once from their padded ON and OFF arrays.
+
+    - baseline: baseline resistance, see baseline_stats.
+    - noise: relative baseline noise, see baseline_stats.
+    - delta_r: largest resistance change from the baseline during "On", with its sign, see peak_change.
+    - response: abs(delta_r) / baseline.
+    - t90_response: seconds from the start of "On" until 90% of delta_r is reached.
+    - t90_recovery: seconds from the start of "Off" until the change is back under 10% of
+      delta_r, NaN if the sensor does not recover.
+    - slope_on, slope_off: slope of the relative change (R - baseline) / baseline per second
+      over the first slope_window seconds of "On" and "Off".
+
+    Parameters:
+        on (array): Padded "On" resistances, one row per cycle.
+        on_lengths (array): Length of each "On" row.
+        off (array): Padded "Off" resistances.
+        off_lengths (array): Length of each "Off" row.
+        timestep (array): Sampling period of each cycle in seconds.
+        baseline_fraction (float): Fraction of the end of "Off" used as the baseline.
+        slope_window (float): Length in seconds of the windows of the slopes.
+
+    Returns:
+        dict: Feature name to array of one value per cycle.
+    """
+    timestep = np.asarray(timestep, dtype=float)
+    baseline, noise = baseline_stats(off, off_lengths, baseline_fraction)
+
+    # Largest change during "On"
+    on_change, on_deviation, peak = peak_change(on, on_lengths, baseline)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        off_change = (off - baseline[:, None]) / baseline[:, None]
+
+        # Padding and missing samples are NaN, they never meet a threshold
+        off_valid = valid_mask(off_lengths, off.shape[1]) & np.isfinite(off_change)
+
+        peak_deviation = np.abs(peak)
+
+        t90_on = first_index(on_deviation >= 0.9 * peak_deviation[:, None])
+        t90_off = first_index(off_valid & (np.abs(off_change) <= 0.1 * peak_deviation[:, None]))
+
+        # Slopes over the first slope_window seconds, at least 2 samples
+        window = np.maximum(np.round(slope_window / timestep).astype(int), 2)
+        time_on = np.arange(on.shape[1]) * timestep[:, None]
+        time_off = np.arange(off.shape[1]) * timestep[:, None]
+
+        slope_on = masked_slope(time_on, on_change, window_mask(on_lengths, on.shape[1], 0, window))[0]
+        slope_off = masked_slope(time_off, off_change, window_mask(off_lengths, off.shape[1], 0, window))[0]
+
+    return {
+        'baseline': baseline,
+        'noise': noise,
+        'delta_r': peak * baseline,
+        'response': peak_deviation,
+        't90_response': np.where(t90_on >= 0, t90_on * timestep, np.nan),
+        't90_recovery': np.where(t90_off >= 0, t90_off * timestep, np.nan),
+        'slope_on': slope_on,
+        'slope_off': slope_off,
+    }
+
+
+def extract_entry_features(entries, baseline_fraction=0.2, slope_window=10.0):
+    """
+    Computes the features of a list of formatted entries, see extract_features.
+
+    Parameters:
+        entries (list): Entries with 'ON', 'OFF' and 'timestep' keys.
+        baseline_fraction (float): Fraction of the end of "Off" used as the baseline.
+        slope_window (float): Length in seconds of the windows of the slopes.
+
+    Returns:
+        dict: Feature name to array of one value per entry.
+    """
+    on, on_lengths = pad_ragged([entry['ON'] for entry in entries])
+    off, off_lengths = pad_ragged([entry['OFF'] for entry in entries])
+    timestep = [entry['timestep'] for entry in entries]
+
+    return extract_features(on, on_lengths, off, off_lengths, timestep, baseline_fraction, slope_window)
+
+##### CLASS DEFINITION #####
+
+class feature_store:
+
+    def __init__(self, json_folder='json_folder', baseline_fraction=0.2, slope_window=10.0):
+        """
+        Features of the entries of a json_folder, stored one JSON record per entry in a features
+        file next to the entries. update only computes the entries that are new or were
+        rewritten since their features were stored.
+
+        Parameters:
+            json_folder (str): The folder holding the saved entries.
+            baseline_fraction (float): Fraction of the end of "Off" used as the baseline.
+            slope_window (float): Length in seconds of the windows of the slopes.
+        """
+        self.json_folder = json_folder
+        self.path = os.path.join(json_folder, FEATURES_FILENAME)
+        self.baseline_fraction = baseline_fraction
+        self.slope_window = slope_window
+        self.db = json_db.json_db(json_folder)
+
+    def read(self):
+        """
+        Returns the stored feature records as a dictionary of entry name to record, the last
+        record of an entry wins.
+        """
+        records = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as features_file:
+                for line in features_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        records[record['name']] = record
+
+        return records
+
+    def version(self, record):
+        """
+        Returns what identifies the saved content of an entry: the modification time of its file,
+        or the run file and offset of an entry appended to a newline-delimited run file, since
+        appending other entries changes the modification time of the run file.
+
+        Parameters:
+            record (dict): The index record of the entry.
+        """
+        if record.get('offset') is not None:
+            return f"{record['path']}:{record['offset']}"
+
+        return os.path.getmtime(os.path.join(self.json_folder, record['path']))
+
+    def pending(self):
+        """
+        Returns the index records of the entries without up-to-date features.
+        """
+        stored = self.read()
+        pending = []
+
+        for name, record in self.db.load_index().items():
+            path = os.path.join(self.json_folder, record['path'])
+
+            if not os.path.exists(path):
+                continue
+
+            if stored.get(name, {}).get('version') != self.version(record):
+                pending.append(record)
+
+        return pending
+
+    def update(self, batch_size=1000):
+        """
+        Computes the features of the new entries in batches and appends them to the features file.
+
+        Parameters:
+            batch_size (int): Number of entries loaded and computed at a time.
+
+        Returns:
+            int: Number of entries computed.
+        """
+        pending = self.pending()
+
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            features = extract_entry_features([self.db.load_record(record, self.json_folder) for record in batch],
+                                              self.baseline_fraction, self.slope_window)
+
+            with open(self.path, 'a') as features_file:
+                for i, record in enumerate(batch):
+                    feature_record = {'name': record['name'], 'version': self.version(record)}
+
+                    # NaN is not valid JSON, missing features are stored as null
+                    for key in FEATURE_KEYS:
+                        value = float(features[key][i])
+                        feature_record[key] = value if np.isfinite(value) else None
+
+                    features_file.write(json.dumps(feature_record) + '\n')
+
+        print(f"Computed features of {len(pending)} entries in {self.json_folder}.")
+
+        return len(pending)
+
+    def load(self):
+        """
+        Returns the features of the entries in the index joined with their index metadata.
+
+        Returns:
+            DataFrame: One row per entry.
+        """
+        index = self.db.load_index()
+        stored = self.read()
+
+        rows = [dict(record, **{key: stored[name][key] for key in FEATURE_KEYS})
+                for name, record in index.items() if name in stored]
+
+        return pd.DataFrame(rows, columns=list(next(iter(index.values()), {}).keys()) + FEATURE_KEYS)
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    json_folder = input("Enter the folder with the formatted entries (default json_folder): ") or 'json_folder'
+
+    store = feature_store(json_folder)
+    store.update()
+
+    print(store.load().describe().to_string())
@@ -11,12 +11,19 @@ import pandas as pd
 import re
 
 from os.path import basename
+from csv_loader import TIME_COLUMN
+from cycle_codes import get_phase, get_repeat, PHASE_ON, PHASE_OFF
+from concentration_segments import segment_concentrations, row_concentrations, parse_repeats
+from kinetics import fit_entries
 
 ##### CLASS #####
 
 class data_format:
+
+    # Column holding the elapsed time of each row
+    time_column = 'Time'
     
-    def __init__(self, filepath, data, analytes, materials, ppm=None, sensor_type=None):
+    def __init__(self, filepath, data, analytes, materials, ppm=None, sensor_type=None, rep_method='C'):
 
         '''
         Constructor for the data_format class.
@@ -27,6 +34,8 @@ class data_format:
             analytes (set): The set of analytes to be extracted.
             materials (set): The set of materials to be extracted.
             sensor_type (str): The type of sensor used (optional).
+            rep_method (str): 'C' for cascade files, 'R' for repeat files, used to assign the cycles
+                              of multi-ppm data to their concentration (optional).
         '''
 
         # Initialize the class variables
@@ -38,6 +47,7 @@ class data_format:
         self.materials = materials 
         self.label = ["Pre", "On", "Off"]
         self.sensor_type = sensor_type
+        self.rep_method = rep_method
         
         # Initialize the following variables to None
         self.avg_timestep = None
@@ -85,7 +95,7 @@ class data_format:
             data = self.data
 
         # Extracting the average timestep from the data
-        time = np.array(data['Time'].values, dtype=float)
+        time = np.array(data[self.time_column].values, dtype=float)
         time_diff = np.diff(time)
         self.avg_timestep = np.mean(time_diff)
 
@@ -131,8 +141,12 @@ class data_format:
         if data is None:
             data = self.data
 
-        # Creating a new DataFrame with only the required columns
-        self.data = data[['Cycle', 'Resistance', 'Time']]
+        # Creating a new DataFrame with only the required columns, keeping decoded phases if present
+        columns = ['Cycle', 'Resistance', 'Time']
+        if 'Phase' in data.columns:
+            columns.append('Phase')
+
+        self.data = data[columns]
 
         return self.data
     
@@ -205,10 +219,9 @@ class data_format:
         if data is None:
             data = self.data
 
-        # Creating DataFrame slices for 'ON', 'OFF', and 'Baseline'
-
-        on_data = data[data['Cycle'].str.contains('on', case=False, na=False)]
-        off_data = data[data['Cycle'].str.contains('off', case=False, na=False)]
+        # Decoded phases for the 'ON' and 'OFF' slices, and the concentration of each row
+        phase = get_phase(data)
+        concentration = self.row_concentrations(data)
 
         ''' Removing the 'pre' data from the 'ON' and 'OFF' data slices ''' 
         '''
@@ -220,14 +233,11 @@ class data_format:
         # Minimum number of data points required for 5 seconds of data
         min_data_points = int(5 / self.avg_timestep)
 
-        # Extact reps
-        reps = set([re.findall(r'\d+', cycle)[0] for cycle in data['Cycle'] if re.findall(r'\d+', cycle)])
-
-
         for i in range(len(self.ppm)):
 
-            specific_on_data = on_data[on_data['Cycle'].str.contains('on', case=False, na=False)]
-            specific_off_data = off_data[off_data['Cycle'].str.contains('off', case=False, na=False)]
+            # Each entry only holds the cycles of its own concentration
+            specific_on_data = data[(phase == PHASE_ON) & (concentration == i)]
+            specific_off_data = data[(phase == PHASE_OFF) & (concentration == i)]
 
             # Check if each slice has at least 10 seconds of data
             if len(specific_on_data) >= min_data_points and len(specific_off_data) >= min_data_points:
@@ -242,6 +252,8 @@ class data_format:
                     'Sensor Type': None,
                     'RC_on': None,
                     'RC_off': None,
+                    'RC_on_r2': None,
+                    'RC_off_r2': None,
                     'Material': self.current_material,
                     'ppm': self.ppm[i],
                     'timestep': self.avg_timestep,
@@ -256,10 +268,34 @@ class data_format:
 
                 final_data_array.append(entry)
 
+        # Fill the time constants of all the entries in one batched fit
+        fit_entries(final_data_array)
+
         self.final_data = final_data_array
 
         return final_data_array
 
+    def row_concentrations(self, data=None):
+
+        '''
+        This function returns the index in self.ppm of the concentration of each row. With
+        several concentrations, the cycles are assigned with concentration_segments.
+
+        Parameters:
+            data (DataFrame): The DataFrame containing the data
+        '''
+
+        if data is None:
+            data = self.data
+
+        if len(self.ppm) == 1:
+            return np.zeros(len(data), dtype=int)
+
+        repeat_numbers, index = segment_concentrations(data, len(self.ppm), parse_repeats(basename(self.filepath)),
+                                                       self.rep_method, columns=['Resistance'])
+
+        return row_concentrations(get_repeat(data), repeat_numbers, index)
+
     def format(self):
         '''
         This function formats the data into a dictionary.
@@ -276,6 +312,136 @@ class data_format:
 
         return self.final_data
 
+class multi_sensor_format(data_format):
+
+    # Repeats keep the column names of the raw acquisition file
+    time_column = TIME_COLUMN
+
+    def __init__(self, filepath, data, analytes, materials, columns, sensor_types, ppm=None, rep_method='C',
+                 from_files=None):
+
+        '''
+        Formats all the relays of a repeat at once. The phase masks, concentrations and timestep
+        are computed once from the shared Time and Cycle columns, and the ON and OFF data of every
+        relay are sliced together from the (samples x relays) resistance matrix. Each relay gets
+        the entries one data_format would give it, with its sensor type in the filename.
+
+        Parameters:
+            filepath (str): The path of the repeat, used for the date, analytes, materials and ppm.
+            data (DataFrame): The repeat with its time, 'Cycle' (or 'Phase' and 'Repeat') and relay columns.
+            analytes (set): The set of analytes to be extracted.
+            materials (set): The set of materials to be extracted.
+            columns (list): The resistance column of each relay, e.g. 'Relay 1 Resistance'.
+            sensor_types (list): The sensor type of each relay, e.g. 'PN1.1'.
+            ppm (list): The concentrations, parsed from the filepath if not provided.
+            rep_method (str): 'C' for cascade files, 'R' for repeat files (optional).
+            from_files (list): The 'from_file' of each relay's entries. Defaults to the filepath name.
+        '''
+
+        super().__init__(filepath, data, analytes, materials, ppm=ppm, rep_method=rep_method)
+
+        self.columns = list(columns)
+        self.sensor_types = list(sensor_types)
+        self.from_files = list(from_files) if from_files is not None else [basename(filepath)] * len(self.columns)
+
+    def extract_labeled_data(self, data=None):
+
+        '''
+        This function keeps the time, cycle and relay columns of the DataFrame.
+
+        Parameters:
+            data (DataFrame): The DataFrame containing the data
+        '''
+
+        if data is None:
+            data = self.data
+
+        columns = [self.time_column, 'Cycle'] + [column for column in ('Phase', 'Repeat') if column in data.columns]
+        self.data = data[columns + self.columns]
+
+        return self.data
+
+    def format_data(self, data=None):
+
+        '''
+        This function formats the data of every relay into dictionaries, relay by relay and
+        concentration by concentration within a relay.
+
+        Parameters:
+            data (DataFrame): The DataFrame containing the data
+        '''
+
+        if data is None:
+            data = self.data
+
+        # Shared by all relays: decoded phases, concentration of each row and minimum slice length
+        phase = get_phase(data)
+        concentration = self.row_concentrations(data)
+        min_data_points = int(5 / self.avg_timestep)
+
+        resistance = data[self.columns].to_numpy(dtype=float)
+        date_format = re.findall(r'\d{8}', basename(self.filepath))[0]
+
+        # ON and OFF slices of every concentration, for all relays at once
+        slices = []
+
+        for i in range(len(self.ppm)):
+            on_data = resistance[(phase == PHASE_ON) & (concentration == i)]
+            off_data = resistance[(phase == PHASE_OFF) & (concentration == i)]
+
+            if len(on_data) >= min_data_points and len(off_data) >= min_data_points:
+                slices.append((i, on_data, off_data))
+
+        final_data_array = []
+
+        for j, sensor_type in enumerate(self.sensor_types):
+            for i, on_data, off_data in slices:
+                final_data_array.append({
+                    'from_file': self.from_files[j],
+                    'filename': f'{date_format}_{self.current_material}_{self.current_analyte[0]}_{self.ppm[i]}ppm_cycle{i + 1}_{sensor_type}',
+                    'Analyte': list(self.current_analyte),
+                    'Sensor Type': sensor_type,
+                    'RC_on': None,
+                    'RC_off': None,
+                    'RC_on_r2': None,
+                    'RC_off_r2': None,
+                    'Material': self.current_material,
+                    'ppm': self.ppm[i],
+                    'timestep': self.avg_timestep,
+                    'ON': np.ascontiguousarray(on_data[:, j]),
+                    'OFF': np.ascontiguousarray(off_data[:, j]),
+                })
+
+        # Fill the time constants of the entries of all relays in one batched fit
+        fit_entries(final_data_array)
+
+        self.final_data = final_data_array
+
+        return final_data_array
+
+    def row_concentrations(self, data=None):
+
+        '''
+        This function returns the index in self.ppm of the concentration of each row, shared by
+        all relays. Cascade files without matching cycle labels are split at the steps of the
+        mean response of the relays.
+
+        Parameters:
+            data (DataFrame): The DataFrame containing the data
+        '''
+
+        if data is None:
+            data = self.data
+
+        if len(self.ppm) == 1:
+            return np.zeros(len(data), dtype=int)
+
+        repeat_numbers, index = segment_concentrations(data, len(self.ppm), parse_repeats(basename(self.filepath)),
+                                                       self.rep_method, columns=self.columns)
+
+        return row_concentrations(get_repeat(data), repeat_numbers, index)
+
+
 ##### MAIN ######
 if __name__ == "__main__":
                 
@@ -0,0 +1,165 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a lazy reader over the formatted entries of a json_folder. The index metadata
+# is available right away and the ON and OFF arrays are only read when they are accessed.
+
+##### IMPORTS #####
+
+import numpy as np
+import pandas as pd
+
+import json_db
+
+from array_utils import pad_ragged
+
+##### CLASS DEFINITION #####
+
+class lazy_entry:
+
+    def __init__(self, record, mmap=True):
+        """
+        One saved entry. Index keys are read from the index record, the ON and OFF arrays are
+        memory-mapped on access for the npz and hdf5 backends, and any other key loads the entry.
+
+        Parameters:
+            record (dict): The index record, with 'path' joined to the folder as returned by json_db.query.
+            mmap (bool): If False, arrays are read into memory instead of being memory-mapped.
+        """
+        self.record = record
+        self.mmap = mmap
+        self._entry = None
+
+    def load(self):
+        """
+        Returns the whole entry, loaded once and kept by this object.
+        """
+        if self._entry is None:
+            self._entry = json_db.json_db().load_record(self.record)
+
+        return self._entry
+
+    def array(self, key):
+        """
+        Returns an array of the entry, memory-mapped when the backend allows it.
+
+        Parameters:
+            key (str): 'ON' or 'OFF'.
+        """
+        if self._entry is None and self.mmap and self.record.get('offset') is None:
+            backend = json_db.get_backend(self.record['path'])
+
+            if hasattr(backend, 'map_array'):
+                return backend.map_array(self.record['path'], key)
+
+        return self.load()[key]
+
+    def __getitem__(self, key):
+        if key in json_db.ARRAY_KEYS:
+            return self.array(key)
+
+        if key in self.record:
+            return self.record[key]
+
+        return self.load()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"lazy_entry({self.record['name']!r})"
+
+
+class json_dataset:
+
+    def __init__(self, json_folder='json_folder', filters=None, records=None, mmap=True, **kwargs):
+        """
+        The entries of a json_folder as a lazy sequence. Only the index is read when the dataset
+        is created, entries are loaded one at a time as they are accessed, so iterating over the
+        whole folder keeps a constant memory footprint.
+
+        Example:
+            dataset = json_dataset('json_folder', Analyte='H2')
+            for entry in dataset.filter(ppm=[1250, 2500])[:100]:
+                on = entry['ON']
+
+        Parameters:
+            json_folder (str): The folder holding the saved entries.
+            filters (dict): json_db.query filters, e.g. {'Sensor Type': 'PN1.2'}. All entries if not provided.
+            records (list): Index records to use instead of querying the folder.
+            mmap (bool): If False, arrays are read into memory instead of being memory-mapped.
+            kwargs: Additional filters, underscores in the key are read as spaces.
+        """
+        self.json_folder = json_folder
+        self.mmap = mmap
+
+        if records is None:
+            records = json_db.json_db(json_folder).query(filters, **kwargs)
+
+        self.records = records
+
+    def _subset(self, records):
+        return json_dataset(self.json_folder, records=records, mmap=self.mmap)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        """
+        Returns one entry for an integer, or a dataset for a slice, a list of positions or a
+        boolean mask.
+        """
+        if isinstance(index, slice):
+            return self._subset(self.records[index])
+
+        if isinstance(index, (list, np.ndarray)):
+            index = np.asarray(index)
+            positions = np.flatnonzero(index) if index.dtype == bool else index
+
+            return self._subset([self.records[i] for i in positions])
+
+        return lazy_entry(self.records[index], self.mmap)
+
+    def __iter__(self):
+        for record in self.records:
+            yield lazy_entry(record, self.mmap)
+
+    def filter(self, filters=None, **kwargs):
+        """
+        Returns the entries matching the filters, see json_db.query.
+
+        Parameters:
+            filters (dict): Mapping of index key to accepted value(s).
+            kwargs: Additional filters, e.g. Analyte='H2', ppm=[1250, 2500], Sensor_Type='PN1.2'.
+        """
+        filters = json_db.make_filters(filters, **kwargs)
+
+        return self._subset([record for record in self.records if json_db.match_record(record, filters)])
+
+    def metadata(self):
+        """
+        Returns the index records as a DataFrame, one row per entry.
+        """
+        return pd.DataFrame(self.records)
+
+    def batches(self, batch_size=256, keys=json_db.ARRAY_KEYS):
+        """
+        Yields the entries in batches with their arrays stacked into padded 2-D arrays, see
+        array_utils.pad_ragged. Only one batch is held in memory at a time.
+
+        Parameters:
+            batch_size (int): Number of entries per batch.
+            keys (tuple): Array keys to stack.
+
+        Yields:
+            tuple: (index records of the batch, dict of key to (padded array, lengths))
+        """
+        for start in range(0, len(self.records), batch_size):
+            entries = list(self[start:start + batch_size])
+            arrays = {key: pad_ragged([entry[key] for entry in entries]) for key in keys}
+
+            yield [entry.record for entry in entries], arrays
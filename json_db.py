@@ -1,8 +1,22 @@
+import base64
+import io
 import json
 import os
 import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
 import numpy as np
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from background_writer import write_file
+
 '''
 Contact: Agosh Saini (as7saini@uwaterloo.ca)
 ---------
@@ -10,34 +24,998 @@ This class handles the database generation for data management for the experimen
 '''
 
 
+##### ARRAY ENCODINGS #####
+
+# Keys holding the measured arrays, loaded back as numpy arrays by every backend
+ARRAY_KEYS = ('ON', 'OFF')
+
+# Compact encodings of the arrays in the JSON-based backends:
+#   'base64': float64 bytes in base64, lossless.
+#   'float32': float32 bytes in base64, relative error of each value below FLOAT32_TOLERANCE.
+#   'delta': integer multiples of a step, delta encoded, zlib compressed and in base64. The error
+#            is below tolerance times the largest absolute value of the array.
+ENCODINGS = ('base64', 'float32', 'delta')
+
+FLOAT32_TOLERANCE = 2.0 ** -24
+DEFAULT_TOLERANCE = 1e-6
+
+INTEGER_DTYPES = ('<i1', '<i2', '<i4', '<i8')
+
+
+def encode_array(values, encoding, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Encodes an array as a JSON-compatible dictionary, see ENCODINGS.
+
+    Parameters:
+        values (array): The values.
+        encoding (str): 'base64', 'float32' or 'delta'.
+        tolerance (float): Largest error of 'delta', relative to the largest absolute value.
+
+    Returns:
+        dict: The encoded array with its 'encoding', 'length', declared 'tolerance' and 'data'.
+    '''
+    values = np.asarray(values, dtype=float)
+    encoded = {'encoding': encoding, 'length': len(values)}
+
+    if encoding == 'base64':
+        encoded['tolerance'] = 0.0
+        data = values.astype('<f8').tobytes()
+
+    elif encoding == 'float32':
+        encoded['tolerance'] = FLOAT32_TOLERANCE
+        data = values.astype('<f4').tobytes()
+
+    elif encoding == 'delta':
+        finite = np.isfinite(values)
+        peak = np.max(np.abs(values[finite])) if finite.any() else 0.0
+
+        # Rounding to the nearest step keeps the error within half a step, half the tolerance
+        step = tolerance * peak or 1.0
+        steps = np.round(np.where(finite, values, 0.0) / step).astype(np.int64)
+
+        # Missing values repeat the previous step to keep the deltas small
+        if not finite.all():
+            steps = steps[np.maximum.accumulate(np.where(finite, np.arange(len(values)), 0))]
+
+        deltas = np.diff(steps, prepend=0)
+
+        for dtype in INTEGER_DTYPES:
+            info = np.iinfo(dtype)
+
+            if len(deltas) == 0 or (deltas.min() >= info.min and deltas.max() <= info.max):
+                break
+
+        encoded.update({'tolerance': tolerance, 'step': step, 'dtype': dtype,
+                        'nan': np.flatnonzero(~finite).tolist()})
+        data = zlib.compress(deltas.astype(dtype).tobytes())
+
+    else:
+        raise ValueError(f"Unknown array encoding '{encoding}'. Expected one of {list(ENCODINGS)}.")
+
+    encoded['data'] = base64.b64encode(data).decode('ascii')
+
+    return encoded
+
+
+def decode_array(encoded):
+    '''
+    Decodes an array encoded by encode_array.
+
+    Parameters:
+        encoded (dict): The encoded array.
+
+    Returns:
+        array: The float64 values.
+    '''
+    data = base64.b64decode(encoded['data'])
+
+    if encoded['encoding'] == 'base64':
+        return np.frombuffer(data, dtype='<f8').astype(float)
+
+    if encoded['encoding'] == 'float32':
+        return np.frombuffer(data, dtype='<f4').astype(float)
+
+    if encoded['encoding'] == 'delta':
+        steps = np.cumsum(np.frombuffer(zlib.decompress(data), dtype=encoded['dtype']).astype(np.int64))
+        values = steps * encoded['step']
+        values[encoded['nan']] = np.nan
+
+        return values
+
+    raise ValueError(f"Unknown array encoding '{encoded['encoding']}'. Expected one of {list(ENCODINGS)}.")
+
+
+def encode_arrays(data_dict, encoding, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Returns a copy of an entry with its 'ON' and 'OFF' arrays encoded, see encode_array. Arrays
+    that are encoded already are kept as they are.
+
+    Parameters:
+        data_dict (dict): The entry.
+        encoding (str): 'base64', 'float32' or 'delta'.
+        tolerance (float): Largest error of 'delta', relative to the largest absolute value.
+    '''
+    data_dict = dict(data_dict)
+
+    for key in ARRAY_KEYS:
+        if data_dict.get(key) is not None and not isinstance(data_dict[key], dict):
+            data_dict[key] = encode_array(data_dict[key], encoding, tolerance)
+
+    return data_dict
+
+
+def decode_arrays(data_dict):
+    '''
+    Turns the 'ON' and 'OFF' values of a loaded JSON entry into numpy arrays, decoding them if
+    they were saved with an encoding.
+
+    Parameters:
+        data_dict (dict): The loaded entry, modified in place.
+
+    Returns:
+        dict: The entry.
+    '''
+    for key in ARRAY_KEYS:
+        value = data_dict.get(key)
+
+        if isinstance(value, list):
+            data_dict[key] = np.asarray(value, dtype=float)
+        elif isinstance(value, dict):
+            data_dict[key] = decode_array(value)
+
+    return data_dict
+
+
+##### STORAGE BACKENDS #####
+
+class json_backend:
+    '''
+    Stores each entry as an indented JSON text file, arrays are written as lists.
+    '''
+
+    extension = '.json'
+    text = True
+
+    def dumps(self, data_dict):
+        # Numpy arrays and scalars are written as lists and numbers
+        return json.dumps(data_dict, indent=4, default=lambda value: value.tolist()).encode('utf-8')
+
+    def save(self, path, data_dict):
+        # Save the data dictionary as a JSON file
+        with open(path, 'wb') as json_file:
+            json_file.write(self.dumps(data_dict))
+
+    def load(self, path, decode=True):
+        with open(path, 'r') as json_file:
+            data_dict = json.load(json_file)
+
+        return decode_arrays(data_dict) if decode else data_dict
+
+
+class npz_backend:
+    '''
+    Stores each entry as an uncompressed NPZ file. Numpy arrays are kept as raw buffers
+    and the remaining metadata is stored as a small JSON header.
+    '''
+
+    extension = '.npz'
+
+    def dumps(self, data_dict):
+        arrays = {key: value for key, value in data_dict.items() if isinstance(value, np.ndarray)}
+        metadata = {key: value for key, value in data_dict.items() if key not in arrays}
+        header = np.frombuffer(json.dumps(metadata).encode('utf-8'), dtype=np.uint8)
+
+        # Write through a file object so numpy does not append its own extension
+        buffer = io.BytesIO()
+        np.savez(buffer, __metadata__=header, **arrays)
+
+        return buffer.getvalue()
+
+    def save(self, path, data_dict):
+        with open(path, 'wb') as npz_file:
+            npz_file.write(self.dumps(data_dict))
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as npz_file:
+            data_dict = json.loads(npz_file['__metadata__'].tobytes().decode('utf-8'))
+
+            for key in npz_file.files:
+                if key != '__metadata__':
+                    data_dict[key] = npz_file[key]
+
+        return data_dict
+
+    def map_array(self, path, key):
+        '''
+        Returns one array of an entry memory-mapped from the file, without reading the rest.
+        NPZ files written by save are uncompressed zip archives, so each array is a plain .npy
+        payload at a fixed offset.
+
+        Parameters:
+            path (str): Path to the saved entry.
+            key (str): The array key, e.g. 'ON'.
+        '''
+        with zipfile.ZipFile(path) as archive:
+            info = archive.getinfo(f'{key}.npy')
+
+        if info.compress_type != zipfile.ZIP_STORED:
+            return self.load(path)[key]
+
+        with open(path, 'rb') as npz_file:
+            # The zip local header holds the lengths of the member name and extra field
+            npz_file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', npz_file.read(4))
+            npz_file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(npz_file)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(npz_file)
+            offset = npz_file.tell()
+
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype)
+
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+class hdf5_backend:
+    '''
+    Stores each entry as an HDF5 file with one dataset per numpy array and the remaining
+    metadata as a JSON attribute. Requires h5py.
+    '''
+
+    extension = '.h5'
+
+    def __init__(self):
+        if h5py is None:
+            raise ImportError("The hdf5 backend requires h5py. Install it with 'pip install h5py'.")
+
+    def save(self, path, data_dict):
+        arrays = {key: value for key, value in data_dict.items() if isinstance(value, np.ndarray)}
+        metadata = {key: value for key, value in data_dict.items() if key not in arrays}
+
+        with h5py.File(path, 'w') as h5_file:
+            h5_file.attrs['metadata'] = json.dumps(metadata)
+
+            for key, value in arrays.items():
+                h5_file.create_dataset(key, data=value)
+
+    def load(self, path):
+        with h5py.File(path, 'r') as h5_file:
+            data_dict = json.loads(h5_file.attrs['metadata'])
+
+            for key in h5_file.keys():
+                data_dict[key] = h5_file[key][()]
+
+        return data_dict
+
+    def map_array(self, path, key):
+        '''
+        Returns one array of an entry memory-mapped from the file when it is stored contiguously,
+        as written by save, or read from its dataset otherwise.
+
+        Parameters:
+            path (str): Path to the saved entry.
+            key (str): The array key, e.g. 'ON'.
+        '''
+        with h5py.File(path, 'r') as h5_file:
+            dataset = h5_file[key]
+            offset = dataset.id.get_offset()
+
+            if offset is None or dataset.chunks is not None:
+                return dataset[()]
+
+            dtype, shape = dataset.dtype, dataset.shape
+
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+class ndjson_backend:
+    '''
+    Appends entries to a shared newline-delimited JSON file, one compact JSON entry per line.
+    An entry is found by its byte offset in the file, see ndjson_writer and ndjson_reader.
+    '''
+
+    extension = '.ndjson'
+    appendable = True
+    text = True
+
+    def save(self, path, data_dict):
+        with ndjson_writer(path) as writer:
+            return writer.write(data_dict)
+
+    def load(self, path, offset=0, decode=True):
+        with ndjson_reader(path) as reader:
+            return reader.read(offset, decode)
+
+
+BACKENDS = {
+    'json': json_backend,
+    'npz': npz_backend,
+    'hdf5': hdf5_backend,
+    'ndjson': ndjson_backend,
+}
+
+# Extensions of the backends storing one file per entry
+FILE_EXTENSIONS = tuple(backend_class.extension for backend_class in BACKENDS.values()
+                        if not getattr(backend_class, 'appendable', False))
+
+
+def get_backend(backend='json'):
+    '''
+    Returns a storage backend instance from its name or from a file path with a known extension.
+
+    Parameters:
+        backend (str or object): Backend name ('json', 'npz', 'hdf5', 'ndjson'), file path or backend instance.
+    '''
+    if not isinstance(backend, str):
+        return backend
+
+    if backend in BACKENDS:
+        return BACKENDS[backend]()
+
+    extension = os.path.splitext(backend)[1].lower()
+
+    for backend_class in BACKENDS.values():
+        if backend_class.extension == extension:
+            return backend_class()
+
+    raise ValueError(f"Unknown storage backend '{backend}'. Expected one of {sorted(BACKENDS)}.")
+
+
+##### APPEND-ONLY FILES #####
+
+def encode_line(data_dict):
+    '''
+    Returns an entry as one compact JSON line, numpy arrays and scalars are written as lists
+    and numbers without modifying the entry.
+
+    Parameters:
+        data_dict (dict): The entry.
+    '''
+    return (json.dumps(data_dict, separators=(',', ':'), default=lambda value: value.tolist()) + '\n').encode('utf-8')
+
+
+def decode_line(line):
+    '''
+    Returns the entry of a JSON line with its 'ON' and 'OFF' arrays as numpy arrays.
+
+    Parameters:
+        line (bytes): The JSON line.
+    '''
+    return decode_arrays(json.loads(line))
+
+
+class ndjson_writer:
+    '''
+    Appends entries to a newline-delimited JSON file through a write buffer. The buffer is
+    flushed every flush_every entries, and by flush or close.
+    '''
+
+    def __init__(self, path, flush_every=256, buffer_size=1 << 20):
+        self.path = path
+        self.flush_every = flush_every
+        self.file = open(path, 'ab', buffering=buffer_size)
+        self.position = self.file.tell()
+        self.unflushed = 0
+
+    def write(self, data_dict):
+        '''
+        Appends an entry.
+
+        Parameters:
+            data_dict (dict): The entry.
+
+        Returns:
+            tuple: (byte offset, length in bytes) of the entry in the file.
+        '''
+        line = encode_line(data_dict)
+        offset = self.position
+
+        self.file.write(line)
+        self.position += len(line)
+        self.unflushed += 1
+
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+        return offset, len(line)
+
+    def flush(self):
+        '''
+        Writes the buffered entries to the file.
+        '''
+        self.file.flush()
+        self.unflushed = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ndjson_reader:
+    '''
+    Reads the entries of a newline-delimited JSON file, by byte offset or in order.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+
+    def read(self, offset, decode=True):
+        '''
+        Returns the entry starting at a byte offset.
+
+        Parameters:
+            offset (int): Byte offset of the entry, from the index record or ndjson_writer.write.
+            decode (bool): If False, the arrays are returned as stored, as lists or encoded.
+        '''
+        self.file.seek(offset)
+        line = self.file.readline()
+
+        return decode_line(line) if decode else json.loads(line)
+
+    def __iter__(self):
+        '''
+        Yields (byte offset, length in bytes, entry) for every entry of the file.
+        '''
+        self.file.seek(0)
+        offset = 0
+
+        for line in iter(self.file.readline, b''):
+            if line.strip():
+                yield offset, len(line), decode_line(line)
+
+            offset += len(line)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+##### INDEX #####
+
+# Append-only index of the saved entries, one JSON record per line
+INDEX_FILENAME = '_index.jsonl'
+
+# Metadata keys copied from each entry into its index record
+INDEX_KEYS = ('Analyte', 'Material', 'ppm', 'Sensor Type', 'from_file')
+
+
+def make_index_record(data_dict, path, name=None, offset=None, length=None):
+    '''
+    Builds the index record of an entry without its array payloads.
+
+    Parameters:
+        data_dict (dict): The entry.
+        path (str): Path of the saved entry, or of the append-only file holding it.
+        name (str): Entry name. Defaults to the file name without extension.
+        offset (int): Byte offset of the entry in an append-only file.
+        length (int): Length in bytes of the entry in an append-only file.
+    '''
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+
+    record = {'name': name, 'path': os.path.basename(path)}
+
+    if offset is not None:
+        record['offset'] = offset
+        record['length'] = length
+
+    for key in INDEX_KEYS:
+        record[key] = data_dict.get(key)
+
+    date_match = re.search(r'\d{8}', record['from_file'] or name)
+    record['date'] = date_match.group(0) if date_match else None
+
+    for key in ARRAY_KEYS:
+        value = data_dict.get(key)
+        if isinstance(value, dict):
+            record[f'{key}_length'] = value['length']
+        else:
+            record[f'{key}_length'] = len(value) if value is not None else None
+
+    return record
+
+
+def make_filters(filters=None, **kwargs):
+    '''
+    Combines a filters dictionary with keyword filters, underscores in the keyword names are
+    read as spaces for the index keys, e.g. Sensor_Type for 'Sensor Type'.
+
+    Parameters:
+        filters (dict): Mapping of index key to accepted value(s).
+        kwargs: Additional filters.
+    '''
+    filters = dict(filters or {})
+    filters.update({key.replace('_', ' ') if key.replace('_', ' ') in INDEX_KEYS else key: value for key, value in kwargs.items()})
+
+    return filters
+
+
+def match_record(record, filters):
+    '''
+    Checks an index record against query filters. A filter value may be a single value or a
+    list/set/tuple of accepted values; list fields such as 'Analyte' match on membership.
+
+    Parameters:
+        record (dict): The index record.
+        filters (dict): Mapping of index key to accepted value(s).
+    '''
+    for key, accepted in filters.items():
+        value = record.get(key)
+        values = value if isinstance(value, list) else [value]
+        accepted = accepted if isinstance(accepted, (list, set, tuple)) else [accepted]
+
+        if not any(v in accepted for v in values):
+            return False
+
+    return True
+
+
+##### CLASS #####
+
 class json_db:
 
     # initializing class
-    def __init__(self, directory='json_folder'):
+    def __init__(self, directory='json_folder', backend='json', flush_every=256, encoding=None, tolerance=DEFAULT_TOLERANCE,
+                 writer=None):
         self.directory =  directory
-        pass
-    
+        self.backend = get_backend(backend)
+        self.flush_every = flush_every
+
+        # background_writer the entry files are written by, None writes them immediately
+        self.writer = writer
+        self._lock = threading.Lock()
+
+        # Encoding of the ON and OFF arrays, see ENCODINGS. Binary backends store raw arrays already
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValueError(f"Unknown array encoding '{encoding}'. Expected one of {list(ENCODINGS)}.")
+
+        if encoding is not None and not getattr(self.backend, 'text', False):
+            raise ValueError(f"Array encodings apply to the JSON-based backends, not to {type(self.backend).__name__}.")
+
+        self.encoding = encoding
+        self.tolerance = tolerance
+
+        # Index records per directory, loaded on first use
+        self._indexes = {}
+        self._index_offsets = {}
+
+        # Append-only writers and their index records waiting for a flush, per directory
+        self._writers = {}
+        self._pending_records = {}
+
+        # Bytes of entries written by this instance
+        self.bytes_written = 0
+
+    def load_index(self, directory=None):
+        '''
+        Returns the index of a directory as a dictionary of entry name to index record.
+        The index file is rebuilt from the saved entries if it does not exist yet.
+
+        Parameters:
+            directory (str): The directory of the entries. Defaults to self.directory.
+        '''
+        if directory is None: directory = self.directory
+
+        if directory in self._indexes:
+            return self._indexes[directory]
+
+        index_path = os.path.join(directory, INDEX_FILENAME)
+
+        if not os.path.exists(index_path):
+            return self.rebuild_index(directory)
+
+        index = {}
+        records, self._index_offsets[directory] = self._read_index_lines(directory)
+
+        for record in records:
+            index[record['name']] = record
+
+        self._indexes[directory] = index
+
+        return index
+
+    def _read_index_lines(self, directory, start=0):
+        '''
+        Returns the complete records of the index file of a directory from a byte offset, and
+        the offset after the last complete line.
+        '''
+        with open(os.path.join(directory, INDEX_FILENAME), 'rb') as index_file:
+            index_file.seek(start)
+            data = index_file.read()
+
+        # A line being appended by another writer is read on the next call
+        end = data.rfind(b'\n') + 1
+        records = [json.loads(line) for line in data[:end].decode('utf-8').splitlines() if line.strip()]
+
+        return records, start + end
+
+    def _refresh_index(self, directory):
+        '''
+        Adds the names of the index lines appended since this index was read, e.g. by another
+        process writing to the same directory. Records already in the index are kept as they are.
+        '''
+        index = self.load_index(directory)
+        index_path = os.path.join(directory, INDEX_FILENAME)
+        start = self._index_offsets.get(directory, 0)
+
+        if os.path.exists(index_path) and os.path.getsize(index_path) > start:
+            records, self._index_offsets[directory] = self._read_index_lines(directory, start)
+
+            for record in records:
+                index.setdefault(record['name'], record)
+
+        return index
+
+    def rebuild_index(self, directory=None):
+        '''
+        Rebuilds the index of a directory by loading every saved entry. Use this after files
+        were added or removed outside of json_db.
+
+        Parameters:
+            directory (str): The directory of the entries. Defaults to self.directory.
+        '''
+        if directory is None: directory = self.directory
+
+        index = {}
+        extensions = {backend_class.extension for backend_class in BACKENDS.values()}
+
+        if os.path.exists(directory):
+            self.flush(directory)
+
+            for filename in sorted(os.listdir(directory)):
+                # Files starting with '_' hold bookkeeping such as the index, not entries
+                if filename.startswith('_') or os.path.splitext(filename)[1].lower() not in extensions:
+                    continue
+
+                path = os.path.join(directory, filename)
+
+                if filename.lower().endswith(ndjson_backend.extension):
+                    # Later lines of the same entry replace earlier ones
+                    with ndjson_reader(path) as reader:
+                        for offset, length, entry in reader:
+                            record = make_index_record(entry, path, entry['filename'], offset, length)
+                            index[record['name']] = record
+                    continue
+
+                record = make_index_record(self.load_summary(path), path)
+                index[record['name']] = record
+
+            with open(os.path.join(directory, INDEX_FILENAME), 'w') as index_file:
+                for record in index.values():
+                    index_file.write(json.dumps(record) + '\n')
+
+            self._index_offsets[directory] = os.path.getsize(os.path.join(directory, INDEX_FILENAME))
+
+        self._indexes[directory] = index
+
+        return index
+
+    def register(self, record, directory=None, defer=False):
+        '''
+        Adds an index record to the index of a directory.
+
+        Parameters:
+            record (dict): The index record, see make_index_record.
+            directory (str): The directory of the entries. Defaults to self.directory.
+            defer (bool): If True, the record is written with the next flush, after the entries
+                          it points to.
+        '''
+        if directory is None: directory = self.directory
+
+        index = self.load_index(directory)
+        index[record['name']] = record
+
+        if defer:
+            self._pending_records.setdefault(directory, []).append(record)
+            return
+
+        self._append_index([record], directory)
+
+    def _append_index(self, records, directory):
+        '''
+        Appends index records to the index file of a directory, also from writer threads.
+        '''
+        with self._lock:
+            with open(os.path.join(directory, INDEX_FILENAME), 'a') as index_file:
+                index_file.write(''.join(json.dumps(record) + '\n' for record in records))
+
+    def encode(self, data_dict):
+        '''
+        Returns the entry as it is stored, with its arrays encoded if an encoding is set.
+
+        Parameters:
+            data_dict (dict): The entry.
+        '''
+        if self.encoding is None:
+            return data_dict
+
+        return encode_arrays(data_dict, self.encoding, self.tolerance)
+
+    def run_writer(self, directory=None):
+        '''
+        Returns the append-only writer of a directory, creating a new run file on first use.
+
+        Parameters:
+            directory (str): The directory of the entries. Defaults to self.directory.
+        '''
+        if directory is None: directory = self.directory
+
+        if directory not in self._writers:
+            os.makedirs(directory, exist_ok=True)
+
+            base = f"run_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+            path = os.path.join(directory, base + ndjson_backend.extension)
+            counter = 1
+
+            while os.path.exists(path):
+                path = os.path.join(directory, f"{base}_{counter}{ndjson_backend.extension}")
+                counter += 1
+
+            self._writers[directory] = ndjson_writer(path, self.flush_every)
+
+        return self._writers[directory]
+
+    def append(self, data_dict, name, directory=None):
+        '''
+        Appends an entry to the run file of a directory and indexes it under a name. The index
+        record is written with the flush that makes the entry visible.
+
+        Parameters:
+            data_dict (dict): The entry.
+            name (str): The entry name.
+            directory (str): The directory of the entries. Defaults to self.directory.
+
+        Returns:
+            str: Path of the run file.
+        '''
+        if directory is None: directory = self.directory
+
+        writer = self.run_writer(directory)
+        unflushed = writer.unflushed
+
+        offset, length = writer.write(self.encode(data_dict))
+        self.bytes_written += length
+        self.register(make_index_record(data_dict, writer.path, name, offset, length), directory, defer=True)
+
+        # The writer flushed its buffer, write the index records of the flushed entries
+        if writer.unflushed <= unflushed:
+            self._write_pending(directory)
+
+        return writer.path
+
+    def _write_pending(self, directory):
+        '''
+        Writes the deferred index records of a directory.
+        '''
+        records = self._pending_records.pop(directory, [])
+
+        if records:
+            self._append_index(records, directory)
+
+    def flush(self, directory=None):
+        '''
+        Flushes the append-only writers, then writes their deferred index records.
+
+        Parameters:
+            directory (str): Only flush this directory. All directories if not provided.
+        '''
+        directories = [directory] if directory is not None else list(set(self._writers) | set(self._pending_records))
+
+        for folder in directories:
+            if folder in self._writers:
+                self._writers[folder].flush()
+            self._write_pending(folder)
+
+    def close(self):
+        '''
+        Flushes and closes the append-only writers.
+        '''
+        self.flush()
+
+        for writer in self._writers.values():
+            writer.close()
+
+        self._writers = {}
+
+    def unique_name(self, name, directory=None):
+        '''
+        Returns name, or name with the first free '_N' suffix if an entry already uses it. The
+        cached index is checked first. A name it does not hold is also checked against the entry
+        files and the index lines written by other processes since the index was read.
+
+        Parameters:
+            name (str): The requested entry name without extension.
+            directory (str): The directory of the entries. Defaults to self.directory.
+        '''
+        if directory is None: directory = self.directory
+
+        index = self.load_index(directory)
+
+        unique = name
+        counter = 1
+
+        while unique in index or self._name_taken(unique, directory):
+            unique = f'{name}_{counter}'
+            counter += 1
+
+        return unique
+
+    def _name_taken(self, name, directory):
+        '''
+        Returns True if an entry file of that name exists, or another writer indexed the name.
+        '''
+        if any(os.path.exists(os.path.join(directory, name + extension)) for extension in FILE_EXTENSIONS):
+            return True
+
+        return name in self._refresh_index(directory)
+
+    def query(self, filters=None, directory=None, **kwargs):
+        '''
+        Returns the index records matching the filters without loading the array payloads.
+
+        Example:
+            db.query(Analyte='H2', ppm=2500, Sensor_Type='PN1.2')
+
+        Parameters:
+            filters (dict): Mapping of index key to accepted value(s).
+            directory (str): The directory of the entries. Defaults to self.directory.
+            kwargs: Additional filters, underscores in the key are read as spaces.
+
+        Returns:
+            list: The matching index records, with 'path' joined to the directory.
+        '''
+        if directory is None: directory = self.directory
+
+        filters = make_filters(filters, **kwargs)
+
+        return [
+            dict(record, path=os.path.join(directory, record['path']))
+            for record in self.load_index(directory).values()
+            if match_record(record, filters)
+        ]
+
     def save_summary_as_json(self, data_dict, directory=None) -> bool:
         if directory is None: directory = self.directory
 
         # Ensure the directory exists
         os.makedirs(directory, exist_ok=True)
-        
+
         # Use the 'filename' attribute to create a unique filename
         filename_without_ext = re.sub(r'\.txt$', '', data_dict['filename'], flags=re.IGNORECASE)
+        filename_without_ext = self.unique_name(filename_without_ext, directory)
 
-        if filename_without_ext in os.listdir(directory):
-            filename_without_ext = filename_without_ext + '_1'
-            
-        json_filename = os.path.join(directory, filename_without_ext + '.json')
-    
-        # Convert numpy arrays to lists
-        for key, value in data_dict.items():
-            if isinstance(value, np.ndarray):
-                data_dict[key] = value.tolist()
-        
-        # Save the data dictionary as a JSON file
-        with open(json_filename, 'w') as json_file:
-            json.dump(data_dict, json_file, indent=4)
-        
-        return json_filename
\ No newline at end of file
+        json_filename = os.path.join(directory, filename_without_ext + self.backend.extension)
+
+        # Append-only backends stream the entry into the run file of the directory
+        if getattr(self.backend, 'appendable', False):
+            return self.append(data_dict, filename_without_ext, directory)
+
+        # Build the index record before the backend converts any arrays
+        record = make_index_record(data_dict, json_filename)
+        stored = self.encode(data_dict)
+
+        if self.writer is None:
+            # Save the data dictionary with the configured backend
+            self.backend.save(json_filename, stored)
+            self.register(record, directory)
+            self.bytes_written += os.path.getsize(json_filename)
+
+            return json_filename
+
+        # Index the entry now so unique_name sees it, the index file is appended once the file is written
+        self.load_index(directory)[record['name']] = record
+
+        if hasattr(self.backend, 'dumps'):
+            payload = self.backend.dumps(stored)
+            self.bytes_written += len(payload)
+        else:
+            payload = dict(stored)
+
+        self.writer.submit(self._write_entry, json_filename, payload, record, directory)
+
+        return json_filename
+
+    def _write_entry(self, path, payload, record, directory):
+        '''
+        Writes an entry in a writer thread, then appends its index record.
+
+        Parameters:
+            path (str): Path of the entry file.
+            payload (bytes or dict): The serialized entry, or the entry for backends without dumps.
+            record (dict): The index record.
+            directory (str): The directory of the entries.
+        '''
+        if isinstance(payload, bytes):
+            write_file(path, payload)
+        else:
+            self.backend.save(path, payload)
+
+            with self._lock:
+                self.bytes_written += os.path.getsize(path)
+
+        self._append_index([record], directory)
+
+    # Backend neutral name for save_summary_as_json
+    save_summary = save_summary_as_json
+
+    def load_summary(self, path):
+        '''
+        Loads a saved entry, the backend is picked from the file extension.
+
+        Parameters:
+            path (str): Path to the saved entry.
+
+        Returns:
+            dict: The entry with its 'ON' and 'OFF' arrays as numpy arrays.
+        '''
+        return get_backend(path).load(path)
+
+    def load_record(self, record, directory=None, decode=True):
+        '''
+        Loads the entry of an index record, seeking to its offset for append-only files.
+
+        Parameters:
+            record (dict): The index record, e.g. from query or load_index.
+            directory (str): Directory to join to the record path, for records from load_index.
+            decode (bool): If False, the arrays of the JSON-based backends are returned as stored,
+                           as lists or encoded, e.g. to rewrite an entry without re-encoding it.
+
+        Returns:
+            dict: The entry with its 'ON' and 'OFF' arrays as numpy arrays.
+        '''
+        path = record['path'] if directory is None else os.path.join(directory, record['path'])
+
+        if record.get('offset') is None:
+            backend = get_backend(path)
+
+            return backend.load(path, decode=decode) if getattr(backend, 'text', False) else backend.load(path)
+
+        # Entries still in a write buffer become readable after a flush
+        for writer in self._writers.values():
+            if os.path.abspath(writer.path) == os.path.abspath(path):
+                writer.flush()
+
+        return ndjson_backend().load(path, record['offset'], decode)
+
+    def update_summary(self, name, fields, directory=None):
+        '''
+        Updates fields of a saved entry, e.g. fitted values. The arrays are written back as they
+        were stored, keeping their encoding. Entries of append-only files are appended again and
+        the index points to the new copy.
+
+        Parameters:
+            name (str): The entry name.
+            fields (dict): The fields to set.
+            directory (str): The directory of the entries. Defaults to self.directory.
+
+        Returns:
+            str: Path of the file holding the updated entry.
+        '''
+        if directory is None: directory = self.directory
+
+        record = self.load_index(directory)[name]
+        entry = self.load_record(record, directory, decode=False)
+        entry.update(fields)
+
+        if record.get('offset') is not None:
+            return self.append(entry, name, directory)
+
+        path = os.path.join(directory, record['path'])
+        get_backend(path).save(path, entry)
+
+        return path
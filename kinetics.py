@@ -0,0 +1,261 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file fits exponential rise and decay models to the ON and OFF data of many cycles at
+# once to get their time constants.
+
+##### IMPORTS #####
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+import json_db
+
+from array_utils import pad_ragged, valid_mask
+
+##### CONSTANTS #####
+
+# Entry keys filled by fit_entries, time constants in seconds and R^2 of the fits
+KINETICS_KEYS = ('RC_on', 'RC_off', 'RC_on_r2', 'RC_off_r2')
+
+# Number of golden-section steps of the refinement, and the search range around the first pass
+REFINE_ITERATIONS = 30
+SEARCH_FACTOR = 10.0
+
+GOLDEN = (np.sqrt(5) - 1) / 2
+
+# Minimum R^2 of a fit for its time constant to be kept, noise without a transient fits poorly
+MIN_R2 = 0.5
+
+##### FUNCTIONS #####
+
+def fit_amplitudes(t, y, mask, tau):
+    """
+    Fits y = A + B * exp(-t / tau) by linear least squares for a fixed tau per row.
+
+    Parameters:
+        t (array): 2-D times.
+        y (array): 2-D values.
+        mask (array): 2-D mask of the valid cells.
+        tau (array): Time constant of each row.
+
+    Returns:
+        tuple: (A, B, sum of squared residuals) per row.
+    """
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        e = np.where(mask, np.exp(-t / tau[:, None]), 0.0)
+        y0 = np.where(mask, y, 0.0)
+
+        n = mask.sum(axis=1)
+        sum_e = e.sum(axis=1)
+        sum_y = y0.sum(axis=1)
+
+        b = (n * (e * y0).sum(axis=1) - sum_e * sum_y) / (n * (e * e).sum(axis=1) - sum_e ** 2)
+        a = (sum_y - b * sum_e) / n
+
+        residual = np.where(mask, y0 - a[:, None] - b[:, None] * e, 0.0)
+
+    return a, b, (residual ** 2).sum(axis=1)
+
+
+def linearized_tau(y, mask, timestep):
+    """
+    First estimate of the time constants. For evenly spaced samples of an exponential,
+    y[k + 1] = c + r * y[k] with r = exp(-timestep / tau), so tau follows from the slope of a
+    linear fit of each row against itself shifted by one sample.
+
+    Parameters:
+        y (array): 2-D values.
+        mask (array): 2-D mask of the valid cells.
+        timestep (array): Sampling period of each row.
+
+    Returns:
+        array: Time constant of each row, NaN where the data does not look exponential.
+    """
+    pairs = mask[:, :-1] & mask[:, 1:]
+    current = np.where(pairs, y[:, :-1], 0.0)
+    following = np.where(pairs, y[:, 1:], 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = pairs.sum(axis=1)
+        dx = np.where(pairs, current - (current.sum(axis=1) / n)[:, None], 0.0)
+        dy = np.where(pairs, following - (following.sum(axis=1) / n)[:, None], 0.0)
+        r = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+
+        return np.where((r > 0) & (r < 1), -timestep / np.log(r), np.nan)
+
+
+def fit_exponential(y, lengths, timestep, iterations=REFINE_ITERATIONS, min_r2=MIN_R2):
+    """
+    Fits y = A + B * exp(-t / tau) to every row of a padded array. A linearized first pass gives
+    a starting tau, which is refined by a golden-section search on log(tau) within a factor
+    SEARCH_FACTOR of it. Tau is bounded between one timestep and ten times the row duration.
+    For each tried tau, A and B are solved exactly by linear least squares. The time constant of
+    a fit whose R^2 is undefined or below min_r2 is not meaningful and is returned as NaN.
+
+    Parameters:
+        y (array): Padded values, one row per curve.
+        lengths (array): Length of each row.
+        timestep (array): Sampling period of each row in seconds.
+        iterations (int): Number of golden-section steps.
+        min_r2 (float): Minimum R^2 for the time constant to be kept.
+
+    Returns:
+        dict: 'tau', 'r2', 'asymptote' (A) and 'amplitude' (B) arrays, NaN for rows with fewer than 4 samples.
+    """
+    timestep = np.asarray(timestep, dtype=float)
+    mask = valid_mask(lengths, y.shape[1]) & np.isfinite(y)
+    t = np.arange(y.shape[1]) * timestep[:, None]
+
+    duration = np.maximum(lengths - 1, 1) * timestep
+    low_bound = np.log(timestep)
+    high_bound = np.log(10 * duration)
+
+    # Start from the linearized estimate, or a third of the duration
+    tau0 = linearized_tau(y, mask, timestep)
+    tau0 = np.where(np.isfinite(tau0), tau0, duration / 3)
+    log_tau0 = np.clip(np.log(tau0), low_bound, high_bound)
+
+    low = np.maximum(log_tau0 - np.log(SEARCH_FACTOR), low_bound)
+    high = np.minimum(log_tau0 + np.log(SEARCH_FACTOR), high_bound)
+
+    # Golden-section search, one step for all rows at a time
+    left = high - GOLDEN * (high - low)
+    right = low + GOLDEN * (high - low)
+    left_sse = fit_amplitudes(t, y, mask, np.exp(left))[2]
+    right_sse = fit_amplitudes(t, y, mask, np.exp(right))[2]
+
+    for _ in range(iterations):
+        go_left = left_sse < right_sse
+
+        high = np.where(go_left, right, high)
+        low = np.where(go_left, low, left)
+
+        new_point = np.where(go_left, high - GOLDEN * (high - low), low + GOLDEN * (high - low))
+        new_sse = fit_amplitudes(t, y, mask, np.exp(new_point))[2]
+
+        right, right_sse, left, left_sse = (
+            np.where(go_left, left, new_point), np.where(go_left, left_sse, new_sse),
+            np.where(go_left, new_point, right), np.where(go_left, new_sse, right_sse),
+        )
+
+    tau = np.exp((low + high) / 2)
+    asymptote, amplitude, sse = fit_amplitudes(t, y, mask, tau)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = mask.sum(axis=1)
+        mean = np.where(mask, y, 0.0).sum(axis=1) / n
+        sst = (np.where(mask, y - mean[:, None], 0.0) ** 2).sum(axis=1)
+        r2 = 1 - sse / sst
+
+    enough = n >= 4
+
+    # NaN R^2 compares as False, so flat rows get no time constant either
+    with np.errstate(invalid='ignore'):
+        good_fit = enough & (r2 >= min_r2)
+
+    return {
+        'tau': np.where(good_fit, tau, np.nan),
+        'r2': np.where(enough, r2, np.nan),
+        'asymptote': np.where(enough, asymptote, np.nan),
+        'amplitude': np.where(enough, amplitude, np.nan),
+    }
+
+
+def fit_entries(entries):
+    """
+    Fits the ON and OFF data of formatted entries and fills their 'RC_on', 'RC_off', 'RC_on_r2'
+    and 'RC_off_r2' fields in place. Time constants are in seconds, failed fits and fits with an
+    R^2 below MIN_R2 are None.
+
+    Parameters:
+        entries (list): Entries with 'ON', 'OFF' and 'timestep' keys.
+
+    Returns:
+        list: The entries.
+    """
+    if not entries:
+        return entries
+
+    timestep = [float(entry['timestep']) for entry in entries]
+
+    for key in ('ON', 'OFF'):
+        values, lengths = pad_ragged([entry[key] for entry in entries])
+        fit = fit_exponential(values, lengths, timestep)
+
+        suffix = key.lower()
+
+        for entry, tau, r2 in zip(entries, fit['tau'], fit['r2']):
+            entry[f'RC_{suffix}'] = float(tau) if np.isfinite(tau) else None
+            entry[f'RC_{suffix}_r2'] = float(r2) if np.isfinite(r2) else None
+
+    return entries
+
+
+def fit_files(json_folder, names, refit=False):
+    """
+    Fits saved entries and rewrites them with their time constants.
+
+    Parameters:
+        json_folder (str): The folder holding the saved entries.
+        names (list): Names of the entries in the index.
+        refit (bool): If False, entries that were already fitted are skipped.
+
+    Returns:
+        int: Number of entries fitted.
+    """
+    db = json_db.json_db(json_folder)
+    index = db.load_index()
+
+    loaded = [(name, db.load_record(index[name], json_folder)) for name in names]
+    # A fitted entry keeps its R^2 even when the time constant was rejected
+    loaded = [(name, entry) for name, entry in loaded if refit or entry.get('RC_on_r2') is None]
+
+    fit_entries([entry for _, entry in loaded])
+
+    for name, entry in loaded:
+        db.update_summary(name, {key: entry[key] for key in KINETICS_KEYS})
+
+    db.close()
+
+    return len(loaded)
+
+
+def fit_store(json_folder='json_folder', workers=None, batch_size=500, refit=False):
+    """
+    Fills the time constants of the saved entries of a json_folder, in batches spread over
+    worker processes.
+
+    Parameters:
+        json_folder (str): The folder holding the saved entries.
+        workers (int): Number of worker processes. Defaults to the number of CPUs, 1 fits the
+                       batches in this process.
+        batch_size (int): Number of entries per batch.
+        refit (bool): If False, entries that were already fitted are skipped.
+
+    Returns:
+        int: Number of entries fitted.
+    """
+    names = list(json_db.json_db(json_folder).load_index())
+    batches = [names[start:start + batch_size] for start in range(0, len(names), batch_size)]
+
+    if workers == 1:
+        fitted = sum(fit_files(json_folder, batch, refit) for batch in batches)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fitted = sum(executor.map(fit_files, [json_folder] * len(batches), batches, [refit] * len(batches)))
+
+    print(f"Fitted time constants of {fitted} entries in {json_folder}.")
+
+    return fitted
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    json_folder = input("Enter the folder with the formatted entries (default json_folder): ") or 'json_folder'
+    refit = input("Refit entries that were already fitted? (Y/N): ").strip().upper() == 'Y'
+
+    fit_store(json_folder, refit=refit)
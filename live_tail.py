@@ -0,0 +1,214 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a class for following an acquisition CSV while it is being written and
+# formatting each repeat as soon as it has completed.
+
+##### IMPORTS #####
+
+import io
+import os
+import time
+import pandas as pd
+
+import json_db
+import main
+
+from repeat_splitter import cycle_data_formatter, repeat_assembler
+
+##### CLASS DEFINITION #####
+
+class live_tail:
+
+    def __init__(self, filepath, rep_method='R', work_dir=os.curdir, storage_backend='json',
+                 poll_interval=1.0, idle_timeout=None, chunksize=10000, graph=False, storage_encoding=None,
+                 analytes=main.ANALYTES, materials=main.MATERIALS):
+        """
+        Follows a growing acquisition CSV and saves the formatted entries of every repeat once
+        its "Off Cycle (Repeat N)" segment has ended. Only the newly appended rows are parsed.
+
+        Parameters:
+            filepath (str): Path to the acquisition CSV, it may not exist yet.
+            rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+            work_dir (str): Directory holding the json_folder and relay_graphs folders.
+            storage_backend (str): json_db storage backend for the entries.
+            poll_interval (float): Seconds to wait before checking the file again.
+            idle_timeout (float): Stop after the file has not grown for this many seconds. None follows forever.
+            chunksize (int): Maximum number of rows parsed per read.
+            graph (bool): If True, a scatter plot is saved for each relay.
+            storage_encoding (str): json_db encoding of the ON and OFF arrays.
+            analytes (list): The analytes to look for in the file name.
+            materials (list): The materials to look for in the file name.
+        """
+        if rep_method not in ('R', 'C'):
+            raise ValueError(f"Unknown rep_method '{rep_method}'. Expected 'R' or 'C'.")
+
+        self.filepath = filepath
+        self.rep_method = rep_method
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.chunksize = chunksize
+        self.graph = graph
+        self.analytes = analytes
+        self.materials = materials
+
+        self.db_json = json_db.json_db(os.path.join(work_dir, 'json_folder'), backend=storage_backend,
+                                     encoding=storage_encoding)
+        self.assembler = repeat_assembler()
+
+        # File state
+        self.formatter = None
+        self.columns = None
+        self.position = 0
+        self.partial_line = b''
+        self.rows_read = 0
+        self.repeats_processed = 0
+        self.saved = []
+
+    def read_new_rows(self):
+        """
+        Reads the complete lines appended since the last call. A trailing line without a
+        newline is kept until it is completed.
+
+        Returns:
+            DataFrame: The new rows, or None if there are none.
+        """
+        if not os.path.exists(self.filepath):
+            return None
+
+        # The file was truncated or replaced, start over
+        if os.path.getsize(self.filepath) < self.position:
+            print(f"File {self.filepath} was truncated, restarting from the beginning.")
+            self.position = 0
+            self.partial_line = b''
+            self.columns = None
+
+        lines = []
+
+        with open(self.filepath, 'rb') as csv_file:
+            csv_file.seek(self.position)
+
+            while len(lines) < self.chunksize:
+                line = csv_file.readline()
+
+                if not line:
+                    break
+
+                if not line.endswith(b'\n'):
+                    self.partial_line += line
+                    break
+
+                lines.append(self.partial_line + line)
+                self.partial_line = b''
+
+            self.position = csv_file.tell()
+
+        # The first complete line is the header
+        if self.columns is None and lines:
+            header = lines.pop(0).decode('utf-8')
+            self.columns = pd.read_csv(io.StringIO(header), nrows=0).columns.tolist()
+
+        if not lines:
+            return None
+
+        rows = pd.read_csv(io.BytesIO(b''.join(lines)), header=None, names=self.columns)
+        rows.index += self.rows_read
+        self.rows_read += len(rows)
+
+        return rows
+
+    def process_rows(self, rows):
+        """
+        Feeds new rows to the repeat assembler and formats every repeat they complete.
+
+        Parameters:
+            rows (DataFrame): The new rows.
+        """
+        if 'Cycle' not in rows.columns:
+            raise ValueError("The 'Cycle' column is missing in the data.")
+
+        for repeat_num, repeat_data in self.assembler.feed(rows):
+            self.process_repeat(repeat_num, repeat_data)
+
+    def process_repeat(self, repeat_num, repeat_data):
+        """
+        Formats and saves the entries of a completed repeat.
+
+        Parameters:
+            repeat_num (int): The repeat number.
+            repeat_data (DataFrame): The combined "On" and "Off" data of the repeat.
+        """
+        # Parses the date and repeat count from the filename without loading the file
+        if self.formatter is None:
+            self.formatter = cycle_data_formatter(filepath=self.filepath, output_dir=None, chunksize=self.chunksize)
+
+        file_name = self.formatter.repeat_name(repeat_num)
+
+        saved = main.process_repeat(file_name, repeat_data, self.repeats_processed, self.db_json,
+                                    rep_method=self.rep_method, analytes=self.analytes, materials=self.materials,
+                                    work_dir=self.work_dir, graph=self.graph)
+
+        # Entries of append-only backends become readable once flushed
+        self.db_json.flush()
+
+        self.repeats_processed += 1
+        self.saved.extend(saved)
+
+        print(f"Repeat {repeat_num} completed, {len(saved)} entries saved.")
+
+    def follow(self):
+        """
+        Follows the file until it has been idle for idle_timeout seconds or the user interrupts
+        with Ctrl+C. The last open repeat is formatted when following stops, and the database is
+        closed even if formatting fails.
+
+        Returns:
+            list: Paths of the saved entries.
+        """
+        print(f"Following {self.filepath} (Ctrl+C to stop)")
+
+        last_change = time.time()
+
+        try:
+            try:
+                while True:
+                    rows = self.read_new_rows()
+
+                    if rows is not None:
+                        self.process_rows(rows)
+                        last_change = time.time()
+
+                        # More rows may already be waiting
+                        if self.position < os.path.getsize(self.filepath):
+                            continue
+
+                    elif self.idle_timeout is not None and time.time() - last_change > self.idle_timeout:
+                        print(f"No new data for {self.idle_timeout} s, stopping.")
+                        break
+
+                    time.sleep(self.poll_interval)
+
+            except KeyboardInterrupt:
+                print("Stopped following.")
+
+            # The last repeat has no following row to close it
+            for repeat_num, repeat_data in self.assembler.close():
+                self.process_repeat(repeat_num, repeat_data)
+
+        finally:
+            # Flushes and closes the append-only writers of the ndjson backend
+            self.db_json.close()
+
+        return self.saved
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    path = input("Enter the path to the acquisition CSV to follow: ")
+    rep_method = input('Enter the method of data processing (R - Repeat PPM, C - Cascade PPM): ')
+
+    tail = live_tail(path, rep_method=rep_method)
+    tail.follow()
@@ -7,16 +7,42 @@
 
 
 ###### IMPORTS ######
-import pandas as pd
 import gas_data_formatting 
 import split_relay_data
+import json
 import json_db
+import run_config
 import os
+import sys
 import time 
 import re
+import tempfile
+import matplotlib
 
-from shutil import rmtree
+from shutil import rmtree, move
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from repeat_splitter import cycle_data_formatter
+from result_cache import result_cache
+from plot_queue import plot_queue
+from background_writer import background_writer
+from run_profiler import run_profiler, load_report
+from feature_extraction import feature_store
+from cycle_codes import add_cycle_codes
+from errors import MissingMetadataError
+from concentration_segments import parse_ppm, parse_repeats, label_segments, segment_concentrations
+
+
+###### CONSTANTS ######
+
+ANALYTES = set(run_config.DEFAULT_CONFIG['analytes'])
+MATERIALS = set(run_config.DEFAULT_CONFIG['materials'])
+
+# Folder of the run reports, and the report name used inside worker scratch directories
+REPORT_FOLDER = 'reports'
+WORKER_REPORT = 'run_report.json'
+
+# Status of each input file of a batch, see process_files
+FILE_STATUSES = ('processed', 'cached', 'skipped', 'failed')
 
 
 ###### FUNCTIONS ######
@@ -50,224 +76,736 @@ def clear_folder(folder):
     else:
         os.makedirs(folder)  # Create the folder if it does not exist
 
-def main(input_file=None, data=None, rep_method='R'):
+def check_metadata(input_file, analytes=ANALYTES, materials=MATERIALS, sensor_match='PN'):
+    """
+    Returns the metadata missing from the name of a raw file: its date, repeat count, PN sensor
+    label, analyte, material and ppm, all parsed from the file name during processing.
+
+    Parameters:
+        input_file (str): Path to the raw file.
+        analytes (set): The analytes to look for in the file name.
+        materials (set): The materials to look for in the file name.
+        sensor_match (str): Prefix of the sensor label, see split_relay_data.SplitRelayData.
+
+    Returns:
+        list: Names of the missing fields, empty if the file name is complete.
+    """
+
+    name = os.path.basename(input_file)
+
+    checks = {
+        'date': re.search(r'\d{8}', name),
+        'repeat count': re.search(r'rep=\d+', name),
+        'sensor label': re.search(fr'{re.escape(sensor_match)}\d+', name),
+        'analyte': any(analyte in name for analyte in analytes),
+        'material': any(material in name for material in materials),
+        'ppm': parse_ppm(name),
+    }
+
+    return [field for field, found in checks.items() if not found]
+
+
+def repeat_concentrations(formatter, rep_method='R'):
+    """
+    Returns the concentration of each repeat of a loaded multi-ppm file, from the cycle labels or
+    the response steps, see concentration_segments.segment_concentrations. Streamed files and
+    single-ppm files return an empty mapping, their repeats are assigned by position.
+
+    Parameters:
+        formatter (cycle_data_formatter): The formatter of the file.
+        rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+
+    Returns:
+        dict: Mapping of repeat number to ppm.
+    """
+
+    concentrations = parse_ppm(formatter.base_filename)
+
+    if formatter.data is None or len(concentrations) < 2:
+        return {}
+
+    # Decode the cycles once, the repeat split reuses the columns
+    formatter.data = add_cycle_codes(formatter.data)
+    repeat_numbers, index = segment_concentrations(formatter.data, len(concentrations), formatter.repeat_count, rep_method)
+
+    return {int(repeat): concentrations[i] for repeat, i in zip(repeat_numbers, index) if i >= 0}
+
+
+def write_run_report(profiler, report_path=None, work_dir=os.curdir):
+    """
+    Writes the run report of a profiler and prints the time spent in each stage.
+
+    Parameters:
+        profiler (run_profiler): The profiler of the run.
+        report_path (str): Path of the JSON report. Defaults to reports/run_<timestamp>.json in work_dir.
+        work_dir (str): Directory holding the reports folder.
+
+    Returns:
+        str: Path of the JSON report.
+    """
+
+    if report_path is None:
+        report_path = os.path.join(work_dir, REPORT_FOLDER, f"run_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    profiler.write_report(report_path)
+    profiler.print_summary()
+    print(f'Run report saved at: {report_path}')
+
+    return report_path
+
+
+def update_features(json_folder, profiler):
+    """
+    Computes the response features of the entries of json_folder that do not have them yet.
+
+    Parameters:
+        json_folder (str): Path to the JSON folder.
+        profiler (run_profiler): Profiler recording the 'features' stage.
+    """
+
+    with profiler.stage('features') as counters:
+        counters['rows'] = feature_store(json_folder).update()
+
+
+def save_entries(formatted_data, json_filename_base, json_folder, db_json):
+    """
+    Saves formatted entries with unique filenames using the storage backend of db_json.
+
+    Parameters:
+        formatted_data (list): List of formatted entry dictionaries.
+        json_filename_base (str): Base name for the JSON files.
+        json_folder (str): Path to the folder for the JSON files.
+        db_json (json_db): The JSON database used for saving.
+
+    Returns:
+        list: Paths of the saved files.
+
+    With a background writer on db_json, the files are only queued here: the caller prints them
+    after flushing the writer, and a failed write is raised by the flush, not caught here.
+    """
+
+    saved = []
+
+    for entry in formatted_data:
+        # Look up a unique name in the json_db index instead of probing the folder
+        entry['filename'] = db_json.unique_name(json_filename_base, json_folder)
+
+        try:
+            # Save the summary as JSON using the updated unique filename
+            json_file_path = db_json.save_summary_as_json(entry, json_folder)
+            saved.append(json_file_path)
+
+            if db_json.writer is None:
+                print(f'JSON file saved at: {json_file_path}')
+        except Exception as e:
+            print(f"Error saving JSON for file {json_filename_base}: {e}")
+
+    return saved
+
+
+def process_repeat(file_name, repeat_data, idx, db_json, rep_method='R', analytes=ANALYTES, materials=MATERIALS,
+                   work_dir=os.curdir, save_intermediate=False, graph=True, plots=None, profiler=None, ppm=None,
+                   writer=None):
+    """
+    Formats all the relays of one repeat together and saves the entries of each relay. The repeat
+    is only split per relay for the relay CSV files and the scatter plots.
+
+    Parameters:
+        file_name (str): Base name of the repeat, see cycle_data_formatter.repeat_name.
+        repeat_data (DataFrame): The combined "On" and "Off" data of the repeat.
+        idx (int): Position of the repeat in the file, used to pick the ppm when it is not provided.
+        db_json (json_db): The JSON database used for saving, entries go to db_json.directory.
+        rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+        analytes (set): The analytes to look for in the file names.
+        materials (set): The materials to look for in the file names.
+        work_dir (str): Directory holding the relay_data and relay_graphs folders.
+        save_intermediate (bool): If True, the relay CSV files are written to relay_data.
+        graph (bool): If True, a scatter plot is saved for each relay.
+        plots (plot_queue): Queue the scatter plots are submitted to, rendered immediately if not provided.
+        profiler (run_profiler): Profiler recording the relay split, plotting, formatting and JSON save stages.
+        ppm (int): Concentration of the repeat, see repeat_concentrations. If not provided, it is taken from
+                   the file name using idx, see concentration_segments.label_segments.
+        writer (background_writer): Writer the relay CSV files are submitted to, written immediately if not provided.
+
+    Returns:
+        list: Paths of the saved entries.
+    """
+
+    if profiler is None:
+        profiler = run_profiler()
+
+    # Every entry of the repeat holds the samples of its single concentration
+    if ppm is None:
+        concentrations = parse_ppm(file_name)
+
+        if concentrations:
+            index = int(label_segments(idx, len(concentrations), parse_repeats(file_name), rep_method))
+
+            if index < 0:
+                raise ValueError(f"Repeat {idx + 1} of {file_name} is past the concentrations in the file name.")
+
+            ppm = concentrations[index]
+
+    output_folder = os.path.join(work_dir, 'relay_data')
+    graph_folder = os.path.join(work_dir, 'relay_graphs')
+    relay_sink = output_folder if save_intermediate else None
+
+    saved = []
+
+    # Print the repeat to confirm it's being processed
+    print(f"Processing repeat: {file_name}")
+
+    # Initialize SplitRelayData to find the active relays and their sensor names
+    with profiler.stage('relay_split', rows=len(repeat_data)) as counters:
+        spliter = split_relay_data.SplitRelayData(file_name, repeat_data, output_dir=relay_sink, graph_dir=graph_folder,
+                                                  plots=plots, profiler=profiler, writer=writer)
+
+        # The per-relay frames are only built for the relay CSV files and the scatter plots
+        if save_intermediate or graph:
+            spliter.generate_files(graph=graph)
+            counters['bytes'] = spliter.bytes_written
+
+    if not spliter.relays:
+        return saved
+
+    # The sensor names are the PN sensor labels of the relays, e.g. PN1.3
+    sensors = list(spliter.sensor_names)
+    sensor_types = sensors
+    columns = [f'Relay {relay} Resistance' for relay in spliter.relays]
+
+    # **Step 3: Format all the relays of the repeat at once and save the entries of each relay**
+    formatter_repeat = gas_data_formatting.multi_sensor_format(
+        filepath=os.path.join(output_folder, f"{file_name}.csv"),
+        data=repeat_data,
+        analytes=analytes,
+        materials=materials,
+        columns=columns,
+        sensor_types=sensor_types,
+        ppm=[ppm] if ppm is not None else None,
+        rep_method=rep_method,
+        from_files=[f"{file_name}_{sensor}.csv" for sensor in sensors]
+    )
+
+    with profiler.stage('formatting', rows=len(repeat_data) * len(columns)):
+        formatted_data = formatter_repeat.format()
+
+    for sensor, sensor_type in zip(sensors, sensor_types):
+
+        # Base name of the relay slice, matching the relay file name without its extension
+        relay_base_name = f"{file_name}_{sensor}"
+        relay_entries = [entry for entry in formatted_data if entry['Sensor Type'] == sensor_type]
+
+        if not relay_entries:
+            print(f"No entries formatted for: {relay_base_name}")
+            continue
+
+        # Generate the unique JSON filename using the PN sensor label, repeat, and timestamp
+        timestamp = int(time.time())
+        json_filename_base = f"{relay_base_name}_{timestamp}"
+
+        # Save formatted data as JSON
+        with profiler.stage('json_save', rows=len(relay_entries)) as counters:
+            bytes_written = db_json.bytes_written
+            entry_paths = save_entries(relay_entries, json_filename_base, db_json.directory, db_json)
+            counters['bytes'] = db_json.bytes_written - bytes_written
+
+        saved.extend(entry_paths)
+
+    return saved
+
+
+def main(input_file=None, data=None, rep_method='R', save_intermediate=False, work_dir=os.curdir, storage_backend='json', chunksize=None,
+         plots='async', profiler=None, report=True, features=True, storage_encoding=None, io_workers=4, analytes=ANALYTES,
+         materials=MATERIALS):
     """
     Main function for processing and formatting relay data.
 
+    Repeats and relay slices are passed between the stages as DataFrames. The intermediate
+    CSV files in repeat_data and relay_data are only written when save_intermediate is set.
+
     Parameters:
         input_file (str): Path to the input file containing relay data (optional if data is provided).
         data (DataFrame): DataFrame containing relay data (optional if input_file is provided).
+        rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+        save_intermediate (bool): If True, the repeat and relay CSV files are kept for debugging.
+        work_dir (str): Directory holding the relay_data, repeat_data, relay_graphs and json_folder
+                        folders. Defaults to the current directory.
+        storage_backend (str): json_db storage backend for the entries ('json', 'npz', 'hdf5' or 'ndjson').
+        chunksize (int): If set, input_file is streamed in chunks of this many rows and each repeat
+                         is processed as soon as it is complete, bounding memory by the largest repeat.
+        plots (str): Plot mode, see plot_queue: 'async' (default) renders decimated plots in a background
+                     process, 'sync' renders them in the loop, 'lazy' saves them for render_pending, 'off' skips them.
+        profiler (run_profiler): Profiler recording the time, rows, bytes and peak RSS of each stage. A new one is
+                                 used if not provided, e.g. pass one profiler to several runs to report them together.
+        report (bool or str): If True, the run report is written to reports/run_<timestamp>.json (and .csv) in
+                              work_dir. A path writes it there instead, False skips it.
+        features (bool): If True, the response features of the new entries are computed after the run,
+                         see feature_extraction.feature_store.
+        storage_encoding (str): Compact encoding of the ON and OFF arrays for the 'json' and 'ndjson'
+                                backends ('base64', 'float32' or 'delta'), see json_db.ENCODINGS.
+        io_workers (int): Number of background_writer threads writing the entry, repeat and relay files
+                          while the next repeats are processed. 0 writes them in the loop.
+        analytes (set): The analytes to look for in the file name.
+        materials (set): The materials to look for in the file name.
+
+    Returns:
+        list: Paths of the saved entries.
     """
 
-    # Define folders for output
-    output_folder = os.path.join(os.curdir, 'relay_data')
-    repeat_output_folder = os.path.join(os.curdir, 'repeat_data')
-    json_folder = os.path.join(os.curdir, 'json_folder')
+    if rep_method not in ('R', 'C'):
+        raise ValueError(f"Unknown rep_method '{rep_method}'. Expected 'R' or 'C'.")
+
+    if data is None and input_file is None:
+        raise ValueError("Either input_file or data must be provided.")
 
-    # Ensure necessary output directories exist, but do not clear json_folder to preserve JSON files
+    # Define folders for output
+    output_folder = os.path.join(work_dir, 'relay_data')
+    repeat_output_folder = os.path.join(work_dir, 'repeat_data')
+    json_folder = os.path.join(work_dir, 'json_folder')
 
-    for folder in [output_folder, repeat_output_folder]:
-        clear_folder(folder)
+    # Intermediate folders are only used as a debug sink, do not clear json_folder to preserve JSON files
+    if save_intermediate:
+        for folder in [output_folder, repeat_output_folder]:
+            clear_folder(folder)
 
     if not os.path.exists(json_folder):
         os.makedirs(json_folder)
 
-    # Set up cycle_data_formatter for splitting data into repeats
-    if data is None:
+    repeat_sink = repeat_output_folder if save_intermediate else None
 
-        if input_file is None:
-            input_file = input('Enter the path to the input file containing relay data: ')
+    if profiler is None:
+        profiler = run_profiler()
 
-        formatter = cycle_data_formatter(filepath=input_file, output_dir=repeat_output_folder)
+    profiler.current_file = os.path.basename(input_file) if data is None else "provided_data"
 
-    else:
-        formatter = cycle_data_formatter(filepath="provided_data", data=data, output_dir=repeat_output_folder)
+    # Output files are written in the background, all of them are flushed at the end of the file
+    writer = background_writer(workers=io_workers)
+
+    # Set up cycle_data_formatter for splitting data into repeats, streamed files are read by the repeat split
+    with profiler.stage('load') as counters:
+        if data is None:
+            formatter = cycle_data_formatter(filepath=input_file, output_dir=repeat_sink, chunksize=chunksize,
+                                             writer=writer)
+        else:
+            formatter = cycle_data_formatter(filepath="provided_data", data=data, output_dir=repeat_sink, writer=writer)
 
-    ####### Split the input data into repeats and save each repeat as a separate file #######
-    formatter.run()
+        counters['rows'] = len(formatter.data) if formatter.data is not None else 0
+
+    ####### Split the input data into repeats, streamed when a chunksize is set #######
+    repeats = profiler.iterate(formatter.iter_repeats(), 'repeat_split', rows=lambda repeat: len(repeat[1]),
+                               bytes_written=lambda: formatter.bytes_written)
 
     ########## Process and format relay data for each repeat ##########
 
-    analytes = {"EtOH", "IPA", "Ace"}
-    materials = {"CuOxSnOx"}
+    db_json = json_db.json_db(json_folder, backend=storage_backend, encoding=storage_encoding, writer=writer)
+    render_queue = plot_queue(mode=plots)
 
-    db_json = json_db.json_db()
+    # Concentration of each repeat of multi-ppm files
+    repeat_ppm = repeat_concentrations(formatter, rep_method)
 
-    for idx, repeat_file in enumerate(os.listdir(repeat_output_folder)):
+    saved = []
 
-        repeat_file_path = os.path.join(repeat_output_folder, repeat_file)
+    try:
+        for idx, (repeat_num, repeat_data) in enumerate(repeats):
 
-        if not repeat_file_path.endswith('.csv'):
-            continue
+            # Base name of the repeat, matching the repeat file name without its date prefix
+            file_name = formatter.repeat_name(repeat_num)
 
-        # Print the repeat file to confirm it's being processed
-        print(f"Processing repeat file: {repeat_file}")
+            saved.extend(process_repeat(file_name, repeat_data, idx, db_json, rep_method=rep_method,
+                                        analytes=analytes, materials=materials, work_dir=work_dir, save_intermediate=save_intermediate,
+                                        graph=plots != 'off', plots=render_queue, profiler=profiler,
+                                        ppm=repeat_ppm.get(repeat_num), writer=writer))
 
-        repeat_data = pd.read_csv(repeat_file_path)
+        # Wait for the background writes, a failed write raises here
+        with profiler.stage('write_wait'):
+            writer.flush()
 
-        # Extract base filename for clarity
-        file_name = os.path.splitext(repeat_file)[0]
-        file_name = file_name[9:]  # Adjust if necessary for naming consistency
+        # The queued entries are only on disk once the writer is flushed
+        for path in saved:
+            print(f'JSON file saved at: {path}')
+    finally:
+        writer.close()
 
-        # Initialize SplitRelayData to split relay data for the current repeat file
-        spliter = split_relay_data.SplitRelayData(file_name, repeat_data)
-        spliter.generate_files(graph=True)
+        # Write the buffered entries of append-only backends
+        db_json.close()
 
-        if rep_method == 'R':
-            # **Step 3: Format relay data and save to JSON immediately after generating graphs**
-            for relay_file in os.listdir(output_folder):
+        # Wait for the remaining plots
+        with profiler.stage('plotting'):
+            render_queue.close()
 
-                relay_file_path = os.path.join(output_folder, relay_file)
+    if features:
+        update_features(json_folder, profiler)
 
-                if not relay_file.endswith('.csv'):
-                    continue
+    if report:
+        write_run_report(profiler, report if isinstance(report, str) else None, work_dir)
 
-                # Make sure we are only processing files related to the current repeat
-                if not relay_file.startswith(file_name):
-                    continue
+    return saved
 
-                relay_data = pd.read_csv(relay_file_path)
 
-                if relay_data.empty:
-                    print(f"Skipping empty relay data for file: {relay_file_path}")
-                    continue
+def process_file_isolated(input_file, rep_method='R', scratch_root=None, storage_backend='json', storage_encoding=None,
+                          **options):
+    """
+    Processes a single file inside its own scratch directory so several files can be
+    processed in parallel without sharing output folders.
 
-                # Base name extraction
-                relay_base_name = os.path.splitext(os.path.basename(relay_file_path))[0]
+    Parameters:
+        input_file (str): Path to the input file containing relay data.
+        rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+        scratch_root (str): Directory in which the scratch directory is created.
+        storage_backend (str): json_db storage backend for the entries.
+        storage_encoding (str): json_db encoding of the ON and OFF arrays.
+        options: Additional arguments of main, e.g. analytes, materials, plots or chunksize.
+
+    Returns:
+        str: Path to the scratch directory holding the outputs of this file.
+    """
 
-                # Deduce sensor name base (PN sensor label) and use repeat information from file_name
-                sensor_name_base = re.findall(r'PN\d+\.\d+', relay_base_name)[0] if 'PN' in relay_base_name else input('Enter the sensor name base: ')
+    # Worker processes have no display, render plots with a headless backend
+    matplotlib.use('Agg')
 
-                # Generate the unique JSON filename using the PN sensor label, repeat, and timestamp
-                timestamp = int(time.time())
-                json_filename_base = f"{relay_base_name}_{timestamp}"
+    work_dir = tempfile.mkdtemp(prefix='worker_', dir=scratch_root)
+    profiler = run_profiler()
 
-                # Process and format the relay data using gas_data_formatting
-                formatter = gas_data_formatting.data_format(
-                    filepath=relay_file_path, 
-                    data=relay_data, 
-                    analytes=analytes, 
-                    materials=materials, 
-                    sensor_type=sensor_name_base
-                )
+    try:
+        main(input_file, rep_method=rep_method, work_dir=work_dir, storage_backend=storage_backend, storage_encoding=storage_encoding,
+             profiler=profiler, report=False, features=False, **options)
 
-                formatted_data = formatter.format()
-                
-                # Save formatted data as JSON
-                for entry in formatted_data:
-                    # Prepare the base path for the JSON file
-                    json_file_path = os.path.join(json_folder, f"{json_filename_base}.json")
+        # The scratch report is only read by the merge, the parent prints the merged report
+        profiler.write_report(os.path.join(work_dir, WORKER_REPORT))
+    except BaseException:
+        # A failed file is not merged, remove its partial outputs
+        rmtree(work_dir, ignore_errors=True)
+        raise
 
-                    # Check if file already exists, if it does, append a counter to ensure uniqueness
-                    counter = 1
-                    
-                    while os.path.exists(json_file_path):
-                        json_file_path = os.path.join(json_folder, f"{json_filename_base}_{counter}.json")
-                        counter += 1
+    return work_dir
 
-                    # Set file name to json file name
-                    entry['filename'] = os.path.splitext(os.path.basename(json_file_path))[0]
 
-                    try:
-                        # Save the summary as JSON using the updated unique filename
-                        db_json.save_summary_as_json(entry, json_folder)
-                        print(f'JSON file saved at: {json_file_path}')
-                    except Exception as e:
-                        print(f"Erfror saving JSON for file {json_filename_base}: {e}")
+def merge_worker_output(work_dir, json_folder='json_folder', graph_folder='relay_graphs'):
+    """
+    Moves the saved entries and graphs of a worker scratch directory into the shared folders.
 
-        if rep_method == 'C':
+    Parameters:
+        work_dir (str): Scratch directory returned by process_file_isolated.
+        json_folder (str): Path to the shared JSON folder.
+        graph_folder (str): Path to the shared graph folder.
 
-            # **Step 3: Format relay data and save to JSON immediately after generating graphs**
-            for relay_file in os.listdir(output_folder):
+    Returns:
+        list: Paths of the merged entry files.
+    """
 
-                relay_file_path = os.path.join(output_folder, relay_file)
+    merged = []
 
-                if not relay_file.endswith('.csv'):
-                    continue
+    # Entries are moved using the worker index so the shared index stays in sync
+    source_folder = os.path.join(work_dir, 'json_folder')
 
-                # Make sure we are only processing files related to the current repeat
-                if not relay_file.startswith(file_name):
-                    continue
+    if os.path.exists(source_folder):
+        db_json = json_db.json_db(json_folder)
+        os.makedirs(json_folder, exist_ok=True)
 
-                relay_data = pd.read_csv(relay_file_path)
+        # Newline-delimited run files are moved whole, their entries keep their offsets
+        run_records = {}
 
-                if relay_data.empty:
-                    print(f"Skipping empty relay data for file: {relay_file_path}")
-                    continue
+        for name, record in db_json.load_index(source_folder).items():
+            source_path = os.path.join(source_folder, record['path'])
+            extension = os.path.splitext(record['path'])[1]
 
-                # Base name extraction
-                relay_base_name = os.path.splitext(os.path.basename(relay_file_path))[0]
+            if record.get('offset') is not None:
+                run_records.setdefault(record['path'], []).append(record)
+                continue
 
-                # Deduce sensor name base (PN sensor label) and use repeat information from file_name
-                sensor_name_base = re.findall(r'PN\d+\.\d+', relay_base_name)[0] if 'PN' in relay_base_name else input('Enter the sensor name base: ')
+            unique_name = db_json.unique_name(name, json_folder)
 
-                # Generate the unique JSON filename using the PN sensor label, repeat, and timestamp
-                timestamp = int(time.time())
-                json_filename_base = f"{relay_base_name}_{timestamp}"
+            if unique_name != name:
+                # Rename on clash and keep the stored filename in sync with the file
+                db_json.update_summary(name, {'filename': unique_name}, source_folder)
 
-                extract_ppm = re.findall(r'(\d+)ppm', relay_base_name)
+            target_path = os.path.join(json_folder, f"{unique_name}{extension}")
+            move(source_path, target_path)
 
-                formatted_data = []
+            db_json.register(dict(record, name=unique_name, path=os.path.basename(target_path)), json_folder)
+            merged.append(target_path)
 
-                formatter = gas_data_formatting.data_format(
-                    filepath=relay_file_path,
-                    data=relay_data,
-                    analytes=analytes,
-                    materials=materials,
-                    sensor_type=sensor_name_base,
-                    ppm=[extract_ppm[idx]]
-                )
-                
-                formatted_data = formatter.format()
-                
-                for entry in formatted_data:
-                    # Prepare the base path for the JSON file
-                    json_file_path = os.path.join(json_folder, f"{json_filename_base}.json")
+        for run_file, records in run_records.items():
+            source_path = os.path.join(source_folder, run_file)
+            unique_names = [db_json.unique_name(record['name'], json_folder) for record in records]
 
-                    # Check if file already exists, if it does, append a counter to ensure uniqueness
-                    counter = 1
+            if any(unique_name != record['name'] for unique_name, record in zip(unique_names, records)):
+                # Copy the entries on clash, so no stale copy of a renamed entry is left in the folder
+                for unique_name, record in zip(unique_names, records):
+                    entry = db_json.load_record(record, source_folder, decode=False)
+                    entry['filename'] = unique_name
+                    merged.append(db_json.append(entry, unique_name, json_folder))
 
-                    while os.path.exists(json_file_path):
-                        json_file_path = os.path.join(json_folder, f"{json_filename_base}_{counter}.json")
-                        counter += 1
+                continue
 
-                    # Set file name to json file name
+            target_path = os.path.join(json_folder, run_file)
+            counter = 1
 
-                    entry['filename'] = os.path.splitext(os.path.basename(json_file_path))[0]
+            while os.path.exists(target_path):
+                target_path = os.path.join(json_folder, f"{os.path.splitext(run_file)[0]}_{counter}{json_db.ndjson_backend.extension}")
+                counter += 1
 
-                    try:
-                        # Save the summary as JSON using the updated unique filename
-                        db_json.save_summary_as_json(entry, json_folder)
-                        print(f'JSON file saved at: {json_file_path}')
-                    except Exception as e:
-                        print(f"Error saving JSON for file {json_filename_base}: {e}")
-                    
-                      
+            move(source_path, target_path)
+            merged.append(target_path)
 
-    # Final cleanup of temporary folders after processing the current input file
-    clear_folder(repeat_output_folder)
-    clear_folder(output_folder)
+            for record in records:
+                db_json.register(dict(record, path=os.path.basename(target_path)), json_folder, defer=True)
 
+        db_json.close()
 
-if __name__ == '__main__':
-    db_json = json_db.json_db()
-
-    method = input('Enter the method of data processing (F - File, D - Directory): ')
-    rep_or_cascase = input('Enter the method of data processing (R - Repeat PPM, C - Cascade PPM): ')
-
-    if method == 'F':
-        # Run the main function with a single file input
-        main(rep_method=rep_or_cascase)
-    elif method == 'D':
-        # Process all files in a specified directory
-        folder = 'data'
-        files = os.listdir(folder)
-        for file in files:
+    # Graphs keep their names, they are unique per input file
+    source_folder = os.path.join(work_dir, 'relay_graphs')
+
+    if os.path.exists(source_folder):
+        os.makedirs(graph_folder, exist_ok=True)
+
+        for filename in os.listdir(source_folder):
+            move(os.path.join(source_folder, filename), os.path.join(graph_folder, filename))
+
+    rmtree(work_dir, ignore_errors=True)
+
+    return merged
+
+
+def process_directory(folder='data', **options):
+    """
+    Processes every file in a directory with the defaults of run_config, see run.
+
+    Parameters:
+        folder (str): Directory containing the input files.
+        options: Config keys that override the defaults, e.g. rep_method, workers,
+                 storage_backend, use_cache or on_missing.
+
+    Returns:
+        dict: The result of process_files.
+    """
+
+    return run(run_config.load_config(inputs=[folder], **options))
+
+
+def process_files(files, rep_method='R', workers=None, storage_backend='json', use_cache=True, storage_encoding=None,
+                  work_dir=os.curdir, analytes=ANALYTES, materials=MATERIALS, on_missing='error', features=True, **options):
+    """
+    Processes a list of files using a pool of worker processes. Each worker writes to its own
+    scratch directory, and the results are merged into json_folder. Files whose content and
+    configuration match a cached run are skipped.
+
+    The file names are checked before any file is processed, see check_metadata, so a batch
+    never stops halfway on a file that lacks its metadata.
+
+    Parameters:
+        files (list): Paths of the input files.
+        rep_method (str): 'R' for repeat ppm files, 'C' for cascade ppm files.
+        workers (int): Number of worker processes. Defaults to the number of CPUs, 1 processes
+                       the files one after another in this process.
+        storage_backend (str): json_db storage backend for the entries.
+        use_cache (bool): If True, unchanged files are skipped using result_cache.
+        storage_encoding (str): json_db encoding of the ON and OFF arrays.
+        work_dir (str): Directory holding json_folder, relay_graphs, scratch and reports.
+        analytes (set): The analytes to look for in the file names.
+        materials (set): The materials to look for in the file names.
+        on_missing (str): 'error' raises a MissingMetadataError for a file lacking metadata before
+                          anything is processed, 'skip' logs the file and processes the others.
+        features (bool): If True, the response features of the new entries are computed once all files are merged.
+        options: Additional arguments of main, e.g. plots, io_workers, chunksize or save_intermediate.
+                 Intermediate files are only kept with workers=1, the scratch directories are removed.
+
+    Returns:
+        dict: Mapping of each file to its result, a dictionary with its 'status' from FILE_STATUSES
+              and the paths of its 'entries': 'processed' files were run, 'cached' files were
+              unchanged and keep their cached entries, 'skipped' files lack metadata and 'failed'
+              files raised an error, kept under 'error'.
+
+    The stages of every processed file are written to one run report in the reports folder.
+    """
+
+    if on_missing not in run_config.MISSING_ACTIONS:
+        raise ValueError(f"Unknown on_missing '{on_missing}'. Expected one of {run_config.MISSING_ACTIONS}.")
+
+    analytes, materials = set(analytes), set(materials)
+    json_folder = os.path.join(work_dir, 'json_folder')
+    options.update(analytes=analytes, materials=materials)
+
+    # Check every file name first, the run either stops here or skips the incomplete files
+    incomplete = {file: check_metadata(file, analytes, materials) for file in files}
+    incomplete = {file: missing for file, missing in incomplete.items() if missing}
+
+    for file, missing in incomplete.items():
+        print(f"Missing {', '.join(missing)} in the name of: {file}")
+
+    if incomplete and on_missing == 'error':
+        raise MissingMetadataError(
+            f"{len(incomplete)} of {len(files)} files lack metadata in their name, rename them or run with on_missing='skip'.")
+
+    results = {file: {'status': 'skipped', 'entries': []} for file in incomplete}
+
+    cache = result_cache(json_folder) if use_cache else None
+    # Every option that changes the entries is part of the cache key. Streamed files assign the
+    # concentrations by position, so the chunk size can change the segmentation
+    config = {'analytes': analytes, 'materials': materials, 'rep_method': rep_method, 'storage_backend': storage_backend,
+              'storage_encoding': storage_encoding, 'chunksize': options.get('chunksize')}
+
+    # Look up each file in the cache, keeping the keys of the files to process
+    pending = {}
+    profiler = run_profiler()
+
+    for file in files:
+        if file in incomplete:
+            continue
+
+        key = None
+
+        if cache is not None:
+            key, outputs = cache.lookup(file, config)
+
+            if outputs is not None:
+                print(f'Skipping unchanged file: {file} ({len(outputs)} cached entries)')
+                results[file] = {'status': 'cached', 'entries': outputs}
+                continue
+
+        pending[file] = key
+
+    if workers == 1:
+        for file, key in pending.items():
             print(f'Processing file: {file}')
-            main(os.path.join(folder, file), rep_method=rep_or_cascase)
 
-        # Remove temp forlders
-        os.rmdir('relay_data')
-        os.rmdir('repeat_data')
+            try:
+                saved = main(file, rep_method=rep_method, storage_backend=storage_backend, profiler=profiler, report=False,
+                             features=False, storage_encoding=storage_encoding, work_dir=work_dir, **options)
+            except MissingMetadataError as e:
+                if on_missing == 'error':
+                    raise
+
+                print(f"Skipping file {file}: {e}")
+                results[file] = {'status': 'skipped', 'entries': []}
+                continue
+            except Exception as e:
+                print(f"Error processing file {file}: {e}")
+                results[file] = {'status': 'failed', 'entries': [], 'error': f"{type(e).__name__}: {e}"}
+                continue
+
+            results[file] = {'status': 'processed', 'entries': saved}
+
+            if cache is not None:
+                cache.store(key, file, saved)
+
+        if features:
+            update_features(json_folder, profiler)
+
+        write_run_report(profiler, work_dir=work_dir)
+
+        return results
+
+    scratch_root = os.path.join(work_dir, 'scratch')
+    os.makedirs(scratch_root, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file_isolated, file, rep_method, scratch_root, storage_backend,
+                                   storage_encoding, **options): file for file in pending}
+
+        for future in as_completed(futures):
+            file = futures[future]
+
+            try:
+                work_dir_file = future.result()
+            except MissingMetadataError as e:
+                if on_missing == 'error':
+                    for queued in futures:
+                        queued.cancel()
+
+                    raise
+
+                print(f"Skipping file {file}: {e}")
+                results[file] = {'status': 'skipped', 'entries': []}
+                continue
+            except Exception as e:
+                print(f"Error processing file {file}: {e}")
+                results[file] = {'status': 'failed', 'entries': [], 'error': f"{type(e).__name__}: {e}"}
+                continue
+
+            # Collect the worker's stage records before its scratch directory is removed
+            worker_report = os.path.join(work_dir_file, WORKER_REPORT)
+            if os.path.exists(worker_report):
+                profiler.merge(load_report(worker_report))
+
+            merged = merge_worker_output(work_dir_file, json_folder, os.path.join(work_dir, 'relay_graphs'))
+            print(f'Processed file: {file} ({len(merged)} JSON files)')
+            results[file] = {'status': 'processed', 'entries': merged}
+
+            if cache is not None:
+                cache.store(pending[file], file, merged)
+
+    # Remove the scratch root if every worker directory was merged
+    if not os.listdir(scratch_root):
+        os.rmdir(scratch_root)
+
+    if features:
+        update_features(json_folder, profiler)
+
+    write_run_report(profiler, work_dir=work_dir)
+
+    return results
+
+
+def run(config):
+    """
+    Runs a batch from a configuration, see run_config.load_config.
+
+    Parameters:
+        config (dict): The configuration.
+
+    Returns:
+        dict: The result of process_files.
+    """
+
+    files = run_config.expand_inputs(config['inputs'])
+
+    if not files:
+        raise FileNotFoundError(f"No input files match {config['inputs']}.")
+
+    print(f"Processing {len(files)} files with workers={config['workers']} and backend={config['storage_backend']}.")
+
+    results = process_files(files, rep_method=config['rep_method'], workers=config['workers'],
+                            storage_backend=config['storage_backend'], use_cache=config['use_cache'],
+                            storage_encoding=config['storage_encoding'], work_dir=config['work_dir'],
+                            analytes=config['analytes'], materials=config['materials'], on_missing=config['on_missing'],
+                            features=config['features'], plots=config['plots'], io_workers=config['io_workers'],
+                            chunksize=config['chunksize'], save_intermediate=config['save_intermediate'])
+
+    counts = {status: sum(result['status'] == status for result in results.values()) for status in FILE_STATUSES}
+    print(f"Processed {counts['processed']} files, {counts['cached']} unchanged (cached), skipped {counts['skipped']}, "
+          f"failed {counts['failed']}.")
+
+    for file, result in results.items():
+        if result['status'] == 'failed':
+            print(f"Failed: {file} ({result['error']})")
+
+    return results
+
+
+if __name__ == '__main__':
+    # Options come from the command line and an optional JSON config file, see run_config
+    config, args = run_config.parse_args()
+
+    if args.write_config:
+        run_config.save_config(config, args.write_config)
+        print(f"Config saved at: {args.write_config}")
+        sys.exit(0)
+
+    if args.dry_run:
+        print(json.dumps(config, indent=4))
+
+        for file in run_config.expand_inputs(config['inputs']):
+            missing = check_metadata(file, config['analytes'], config['materials'])
+            print(f"{'missing ' + ', '.join(missing) if missing else 'ok':<30}{file}")
+
+        sys.exit(0)
 
+    try:
+        results = run(config)
+    except (MissingMetadataError, FileNotFoundError) as e:
+        sys.exit(f"Error: {e}")
 
+    # A scheduler sees the failed files through the exit status
+    if any(result['status'] == 'failed' for result in results.values()):
+        sys.exit(1)
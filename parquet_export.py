@@ -0,0 +1,233 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file exports the formatted entries of a json_folder as a partitioned Parquet dataset:
+# a long table with one row per sample and a table with one row per entry. Requires pyarrow.
+
+##### IMPORTS #####
+
+import os
+import numpy as np
+
+from shutil import rmtree
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from cycle_codes import PHASE_ON, PHASE_OFF
+from json_dataset import json_dataset
+
+##### CONSTANTS #####
+
+SAMPLES_FOLDER = 'samples'
+ENTRIES_FILENAME = 'entries.parquet'
+
+# Hive partitions of the samples table, e.g. samples/date=20241105/Material=CuOxSnOx/Analyte=H2
+PARTITION_KEYS = ['date', 'Material', 'Analyte']
+
+# Entry fields copied to the entries table, next to the entry id, name and partition keys
+ENTRY_FIELDS = ['ppm', 'Sensor Type', 'from_file', 'timestep', 'RC_on', 'RC_off', 'RC_on_r2', 'RC_off_r2']
+
+##### FUNCTIONS #####
+
+def require_pyarrow():
+    """
+    Raises an ImportError if pyarrow is not installed.
+    """
+    if pa is None:
+        raise ImportError("The Parquet export requires pyarrow. Install it with 'pip install pyarrow'.")
+
+
+def samples_schema():
+    """
+    Returns the schema of the samples table. The time offset is in seconds from the start of
+    the "On" data, so the "Off" samples follow the "On" samples of the same entry.
+    """
+    return pa.schema([
+        ('entry_id', pa.int64()),
+        ('phase', pa.int8()),
+        ('time', pa.float64()),
+        ('resistance', pa.float64()),
+        ('date', pa.string()),
+        ('Material', pa.string()),
+        ('Analyte', pa.string()),
+    ])
+
+
+def partitioning():
+    """
+    Returns the hive partitioning of the samples table, with the partition keys read as strings.
+    """
+    return ds.partitioning(pa.schema([samples_schema().field(key) for key in PARTITION_KEYS]), flavor='hive')
+
+
+def joined(value):
+    """
+    Returns a list field such as 'Analyte' as a single partition value, e.g. 'EtOH+IPA'.
+    """
+    return '+'.join(value) if isinstance(value, list) else str(value)
+
+
+def sample_batches(dataset, entry_rows, batch_size=1000):
+    """
+    Yields the samples of the entries of a dataset as record batches, one batch of entries at
+    a time, and appends one row per entry to entry_rows.
+
+    Parameters:
+        dataset (json_dataset): The entries to export.
+        entry_rows (list): List receiving the rows of the entries table.
+        batch_size (int): Number of entries loaded at a time.
+    """
+    schema = samples_schema()
+
+    for start in range(0, len(dataset), batch_size):
+        columns = {name: [] for name in schema.names}
+
+        for entry_id, entry in enumerate(dataset[start:start + batch_size], start):
+            data = entry.load()
+            on, off = np.asarray(data['ON'], dtype=float), np.asarray(data['OFF'], dtype=float)
+            n_on, n_off = len(on), len(off)
+            timestep = float(data['timestep'])
+
+            partition = {'date': entry.record['date'], 'Material': joined(data['Material']),
+                         'Analyte': joined(data['Analyte'])}
+
+            columns['entry_id'].append(np.full(n_on + n_off, entry_id, dtype=np.int64))
+            columns['phase'].append(np.repeat(np.array([PHASE_ON, PHASE_OFF], dtype=np.int8), [n_on, n_off]))
+            columns['time'].append(np.arange(n_on + n_off) * timestep)
+            columns['resistance'].append(np.concatenate([on, off]))
+
+            for key, value in partition.items():
+                columns[key].append(np.full(n_on + n_off, value, dtype=object))
+
+            entry_rows.append(dict({'entry_id': entry_id, 'name': entry.record['name']}, **partition,
+                                   **{key: data.get(key) for key in ENTRY_FIELDS},
+                                   ON_length=n_on, OFF_length=n_off))
+
+        if columns['entry_id']:
+            yield pa.RecordBatch.from_arrays([pa.array(np.concatenate(columns[name]), type=schema.field(name).type)
+                                              for name in schema.names], schema=schema)
+
+
+def export_parquet(json_folder='json_folder', output_dir='parquet_export', filters=None, batch_size=1000,
+                   compression='zstd', max_rows_per_file=10000000):
+    """
+    Writes the entries of a json_folder as a Parquet dataset in output_dir, replacing any
+    previous export:
+
+    - samples/: one row per sample with 'entry_id', 'phase' (cycle_codes PHASE_ON or PHASE_OFF),
+      'time' and 'resistance', hive-partitioned by date, Material and Analyte.
+    - entries.parquet: one row per entry with its 'entry_id', name, partition keys, ppm,
+      Sensor Type, timestep, time constants and array lengths.
+
+    The entries are streamed in batches, only one batch of samples is held in memory.
+
+    Parameters:
+        json_folder (str): The folder holding the saved entries.
+        output_dir (str): The export folder.
+        filters (dict): json_db.query filters of the exported entries. All entries if not provided.
+        batch_size (int): Number of entries loaded at a time.
+        compression (str): Parquet compression codec, e.g. 'zstd', 'snappy' or 'none'.
+        max_rows_per_file (int): Largest number of rows in one Parquet file of a partition.
+
+    Returns:
+        tuple: (number of entries, number of samples) exported.
+    """
+    require_pyarrow()
+
+    dataset = json_dataset(json_folder, filters)
+
+    if os.path.exists(output_dir):
+        rmtree(output_dir)
+
+    os.makedirs(output_dir)
+
+    entry_rows = []
+    samples_folder = os.path.join(output_dir, SAMPLES_FOLDER)
+
+    ds.write_dataset(
+        sample_batches(dataset, entry_rows, batch_size),
+        samples_folder,
+        schema=samples_schema(),
+        format='parquet',
+        partitioning=partitioning(),
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        max_rows_per_file=max_rows_per_file,
+        max_rows_per_group=min(max_rows_per_file, 1 << 20),
+    )
+
+    entries = pa.Table.from_pylist(entry_rows)
+    pq.write_table(entries, os.path.join(output_dir, ENTRIES_FILENAME), compression=compression)
+
+    n_samples = sum(row['ON_length'] + row['OFF_length'] for row in entry_rows)
+    print(f"Exported {len(entry_rows)} entries and {n_samples} samples to {output_dir}.")
+
+    return len(entry_rows), n_samples
+
+
+def filter_expression(filters):
+    """
+    Returns a pyarrow filter expression from a dictionary of column to accepted value(s).
+    """
+    expression = None
+
+    for key, accepted in (filters or {}).items():
+        accepted = list(accepted) if isinstance(accepted, (list, set, tuple)) else [accepted]
+        condition = pc.field(key).isin(accepted)
+        expression = condition if expression is None else expression & condition
+
+    return expression
+
+
+def read_samples(output_dir='parquet_export', filters=None, columns=None):
+    """
+    Reads samples of an export. Filters on the partition keys skip the other partitions, and
+    filters on the other columns are pushed down to the Parquet row groups.
+
+    Example:
+        read_samples('parquet_export', {'Analyte': 'H2', 'phase': PHASE_ON}, ['entry_id', 'resistance'])
+
+    Parameters:
+        output_dir (str): The export folder.
+        filters (dict): Mapping of column to accepted value(s).
+        columns (list): Columns to read. All columns if not provided.
+
+    Returns:
+        DataFrame: The matching samples.
+    """
+    require_pyarrow()
+
+    samples = ds.dataset(os.path.join(output_dir, SAMPLES_FOLDER), format='parquet', partitioning=partitioning())
+
+    return samples.to_table(columns=columns, filter=filter_expression(filters)).to_pandas()
+
+
+def read_entries(output_dir='parquet_export', filters=None):
+    """
+    Reads the entries table of an export.
+
+    Parameters:
+        output_dir (str): The export folder.
+        filters (dict): Mapping of column to accepted value(s).
+
+    Returns:
+        DataFrame: The matching entries.
+    """
+    require_pyarrow()
+
+    return pq.read_table(os.path.join(output_dir, ENTRIES_FILENAME), filters=filter_expression(filters)).to_pandas()
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    json_folder = input("Enter the folder with the formatted entries (default json_folder): ") or 'json_folder'
+    output_dir = input("Enter the export folder (default parquet_export): ") or 'parquet_export'
+
+    export_parquet(json_folder, output_dir)
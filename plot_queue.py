@@ -0,0 +1,172 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a class for rendering plots in the background so that plotting does not
+# hold up the data processing.
+
+##### IMPORTS #####
+
+import os
+import numpy as np
+import matplotlib
+
+from concurrent.futures import ProcessPoolExecutor
+from decimation import minmax_envelope
+
+##### CONSTANTS #####
+
+PLOT_MODES = ('sync', 'async', 'lazy', 'off')
+
+# Extension of the plot specifications written in 'lazy' mode
+PENDING_EXTENSION = '.plot.npz'
+
+##### FUNCTIONS #####
+
+def _init_renderer():
+    """
+    Selects the headless backend in render worker processes.
+    """
+    matplotlib.use('Agg')
+
+
+def render_scatter(path, title, series, xlabel="Time (s)", ylabel="Resistance"):
+    """
+    Renders a scatter plot and saves it as an image.
+
+    Parameters:
+        path (str): Output path of the image.
+        title (str): Plot title.
+        series (list): (label, x, y) tuples, one scatter per tuple.
+        xlabel (str): Label of the x axis.
+        ylabel (str): Label of the y axis.
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+
+    for label, x, y in series:
+        ax.scatter(x, y, label=label, s=1)
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.legend()
+    fig.savefig(path)
+    plt.close(fig)
+
+    return path
+
+
+def render_pending(graph_dir='relay_graphs'):
+    """
+    Renders the plots saved in 'lazy' mode and removes their specifications.
+
+    Parameters:
+        graph_dir (str): Directory holding the plot specifications.
+
+    Returns:
+        list: Paths of the rendered images.
+    """
+    rendered = []
+
+    for filename in sorted(os.listdir(graph_dir)):
+        if not filename.endswith(PENDING_EXTENSION):
+            continue
+
+        spec_path = os.path.join(graph_dir, filename)
+
+        with np.load(spec_path, allow_pickle=False) as spec:
+            labels = [str(label) for label in spec['labels']]
+            series = [(label, spec[f'x{i}'], spec[f'y{i}']) for i, label in enumerate(labels)]
+            title = str(spec['title'])
+
+        image_path = spec_path[:-len(PENDING_EXTENSION)] + '.png'
+        rendered.append(render_scatter(image_path, title, series))
+        os.remove(spec_path)
+
+    return rendered
+
+##### CLASS DEFINITION #####
+
+class plot_queue:
+
+    def __init__(self, mode='async', workers=1, n_buckets=2000):
+        """
+        Queue for scatter plots. Every series is decimated to a min/max envelope before it is
+        drawn or sent to a worker.
+
+        Parameters:
+            mode (str): 'sync' renders immediately, 'async' renders in background processes,
+                        'lazy' saves the decimated data for render_pending, 'off' discards plots.
+            workers (int): Number of render processes in 'async' mode.
+            n_buckets (int): Number of min/max buckets per series.
+        """
+        if mode not in PLOT_MODES:
+            raise ValueError(f"Unknown plot mode '{mode}'. Expected one of {PLOT_MODES}.")
+
+        self.mode = mode
+        self.n_buckets = n_buckets
+        self.futures = []
+        self.executor = None
+
+        if mode == 'async':
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_renderer)
+
+    def submit(self, path, title, series):
+        """
+        Queues a scatter plot.
+
+        Parameters:
+            path (str): Output path of the image.
+            title (str): Plot title.
+            series (list): (label, x, y) tuples, one scatter per tuple.
+        """
+        if self.mode == 'off':
+            return
+
+        series = [(label, *minmax_envelope(x, y, self.n_buckets)) for label, x, y in series]
+
+        if self.mode == 'sync':
+            render_scatter(path, title, series)
+
+        elif self.mode == 'async':
+            self.futures.append(self.executor.submit(render_scatter, path, title, series))
+
+        elif self.mode == 'lazy':
+            arrays = {}
+            for i, (_, x, y) in enumerate(series):
+                arrays[f'x{i}'] = x
+                arrays[f'y{i}'] = y
+
+            with open(os.path.splitext(path)[0] + PENDING_EXTENSION, 'wb') as spec_file:
+                np.savez(spec_file, title=np.array(title), labels=np.array([label for label, _, _ in series]), **arrays)
+
+    def flush(self):
+        """
+        Waits for the queued plots. The first rendering error is raised here.
+
+        Returns:
+            list: Paths of the rendered images.
+        """
+        futures, self.futures = self.futures, []
+
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Waits for the queued plots and stops the render processes.
+        """
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    graph_dir = input("Enter the folder with pending plots (default relay_graphs): ") or 'relay_graphs'
+    print(f"Rendered {len(render_pending(graph_dir))} plots.")
@@ -6,15 +6,21 @@
 
 ##### IMPORTS #####
 
+import numpy as np
 import pandas as pd
 import re
 import os
 
+from background_writer import save_csv
+from cycle_codes import add_cycle_codes, raw_columns, PHASE_ON, PHASE_OFF
+from csv_loader import load_raw_csv, iter_raw_csv
+from errors import MissingMetadataError
+
 ##### CLASS DEFINITION #####
 
 class cycle_data_formatter:
 
-    def __init__(self, filepath=None, data=None, output_dir="repeat_data"):
+    def __init__(self, filepath=None, data=None, output_dir="repeat_data", chunksize=None, writer=None):
         """
         Initializes the CycleDataFormatter with the data filepath or DataFrame and output directory.
 
@@ -22,12 +28,22 @@ class cycle_data_formatter:
             filepath (str): Path to the input data file. Optional if data is provided.
             data (DataFrame): DataFrame containing the input data. Optional if filepath is provided.
             output_dir (str): Directory to save the output files. Defaults to "repeat_data".
+                              If None, repeats are only kept in memory (see self.repeats).
+            chunksize (int): If set, the file is not loaded up front but streamed in chunks of
+                             this many rows by iter_repeats.
+            writer (background_writer): Writer the repeat files are submitted to. If not provided,
+                                        they are written immediately.
         """
 
         # Initialize instance variables
         self.filepath = filepath
         self.output_dir = output_dir
         self.data = data
+        self.chunksize = chunksize
+        self.writer = writer
+
+        # Bytes of the repeat files written so far
+        self.bytes_written = 0
 
         if self.data is not None:
             self.validate_data()
@@ -38,14 +54,18 @@ class cycle_data_formatter:
         self.date_format = None
         self.base_filename = None
         self.repeat_count = None  
+        self.repeats = {}
         
         # Create output directory if it does not exist
-        if not os.path.exists(self.output_dir):
+        if self.output_dir is not None and not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        # Check if data is provided; if not, load data from the file
+        # Check if data is provided; if not, load data from the file unless it is streamed
         if self.data is None and self.filepath is not None:
-            self.load_data()
+            if self.chunksize is None:
+                self.load_data()
+            elif not os.path.exists(self.filepath):
+                raise FileNotFoundError(f"File not found: {self.filepath}")
         elif self.data is None:
             raise ValueError("Either filepath or data (DataFrame) must be provided.")
 
@@ -80,9 +100,9 @@ class cycle_data_formatter:
         if not os.path.exists(self.filepath):
             raise FileNotFoundError(f"File not found: {self.filepath}")
         
-        # Load data from the file
+        # Load the raw columns from the file with explicit dtypes
         print(f"Loading data from {self.filepath}")
-        self.data = pd.read_csv(self.filepath)
+        self.data = load_raw_csv(self.filepath)
 
         # Ensure 'Cycle' column is present
         if 'Cycle' not in self.data.columns:
@@ -115,13 +135,23 @@ class cycle_data_formatter:
         if date_match:
             self.date_format = date_match.group(0)
         else:
-            raise ValueError("Date not found in filename. Expected format YYYYMMDD.")
+            raise MissingMetadataError(f"Date not found in filename {self.base_filename}. Expected format YYYYMMDD.")
         
         # Check if repeat count is found in the filename
         if repeat_match:
             self.repeat_count = int(repeat_match.group(1))
         else:
-            raise ValueError("Repeat count not found in filename. Expected format 'rep=N'.")
+            raise MissingMetadataError(f"Repeat count not found in filename {self.base_filename}. Expected format 'rep=N'.")
+
+    def repeat_name(self, repeat_num):
+        """
+        Returns the base name used for a repeat, matching the saved repeat file name
+        without its date prefix and extension.
+
+        Parameters:
+            repeat_num (int): The repeat number.
+        """
+        return f"{self.base_filename}_rep={repeat_num}"
 
     def save_cycle(self, cycle_combined, repeat_num):
         """
@@ -130,21 +160,29 @@ class cycle_data_formatter:
         Parameters:
             cycle_combined (DataFrame): Combined DataFrame of "On" and "Off" cycle data.
             repeat_num (int): The current repeat number for the cycle.
+
+        Returns:
+            int: Number of bytes written, 0 if the repeat is not saved.
         """
         # Check if the combined data is empty before saving
         if cycle_combined.empty:
             print(f"Warning: Combined cycle data is empty for repeat {repeat_num}. Skipping save.")
-            return
+            return 0
+
+        # Repeats are kept in memory only when no output directory is set
+        if self.output_dir is None:
+            return 0
 
         # Ensure the output directory exists
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
 
-        # Save the combined cycle data to a CSV file
+        # Save the combined cycle data to a CSV file, with the columns of the input only
         output_filename = os.path.join(self.output_dir, f"{self.date_format}_{self.base_filename}_rep={repeat_num}.csv")
-        cycle_combined.to_csv(output_filename, index=False)
+        written = save_csv(cycle_combined, output_filename, self.writer, columns=raw_columns(cycle_combined))
+        self.bytes_written += written
 
-        print(f"File {output_filename} has been saved.")
+        return written
 
 
     def process_cycles(self):
@@ -154,56 +192,199 @@ class cycle_data_formatter:
 
         Parameters:
             None
+
+        Returns:
+            dict: Mapping of repeat number to the combined "On" and "Off" DataFrame.
         """
         # Validate 'Cycle' column
         if 'Cycle' not in self.data.columns:
             raise ValueError("The 'Cycle' column is missing in the data.")
 
-        # Prepare regex patterns for matching cycles
-        on_pattern = r"Run-On Cycle \(Repeat (\d+)\)"
-        off_pattern = r"Off Cycle \(Repeat (\d+)\)"
-
-        # Extract and filter "Run-On" and "Off" cycles
-        on_cycles = self.data[self.data['Cycle'].str.contains(on_pattern, case=False, na=False, regex=True)]
-        off_cycles = self.data[self.data['Cycle'].str.contains(off_pattern, case=False, na=False, regex=True)]
+        # Decode the cycle labels once into phase codes and repeat numbers, the caller's data is not modified
+        self.data = add_cycle_codes(self.data)
 
-        # Extract repeat numbers
-        on_cycles['Repeat'] = on_cycles['Cycle'].str.extract(on_pattern, expand=False).astype(int)
-        off_cycles['Repeat'] = off_cycles['Cycle'].str.extract(off_pattern, expand=False).astype(int)
+        phase = self.data['Phase'].to_numpy()
+        repeat = self.data['Repeat'].to_numpy()
 
-        # Find unique repeats in both "Run-On" and "Off" cycles
-        on_repeats = set(on_cycles['Repeat'])
-        off_repeats = set(off_cycles['Repeat'])
-        all_repeats = sorted(on_repeats & off_repeats)  # Only consider repeats that exist in both
+        # Rows of "Run-On" and "Off" cycles that carry a repeat number
+        is_on = phase == PHASE_ON
+        is_off = phase == PHASE_OFF
+        rows = np.flatnonzero((repeat >= 0) & (is_on | is_off))
 
-        if not all_repeats:
+        if len(rows) == 0:
             raise ValueError("No matching 'Run-On' and 'Off' cycle pairs found.")
 
-        # Process each repeat
-        for repeat_num in all_repeats:
+        # Order the rows by repeat with "Run-On" before "Off", the stable sort is skipped if already ordered
+        keys = repeat[rows].astype(np.int64) * 2 + is_off[rows]
+
+        if np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys, kind='stable')
+            rows = rows[order]
+            keys = keys[order]
+
+        # Segment boundaries of each repeat in one pass
+        repeats_sorted = keys // 2
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(repeats_sorted)) + 1))
+        stops = np.append(starts[1:], len(rows))
+
+        # Only consider repeats that exist in both "Run-On" and "Off" cycles
+        on_counts = np.add.reduceat(is_on[rows].astype(np.int64), starts)
+        off_counts = (stops - starts) - on_counts
+
+        self.repeats = {}
+
+        for start, stop, on_count, off_count in zip(starts, stops, on_counts, off_counts):
+            if on_count == 0 or off_count == 0:
+                continue
+
+            repeat_num = int(repeats_sorted[start])
+
             try:
-                # Select "Run-On" and "Off" cycle data for this repeat
-                on_data = on_cycles[on_cycles['Repeat'] == repeat_num]
-                off_data = off_cycles[off_cycles['Repeat'] == repeat_num]
+                segment_rows = rows[start:stop]
 
-                # Combine the data for this repeat
-                combined_data = pd.concat([on_data, off_data])
+                # Contiguous segments are returned as slices of the data instead of copies
+                if segment_rows[-1] - segment_rows[0] == stop - start - 1:
+                    combined_data = self.data.iloc[segment_rows[0]:segment_rows[-1] + 1]
+                else:
+                    combined_data = self.data.iloc[segment_rows]
+
+                self.repeats[repeat_num] = combined_data
 
                 # Save combined cycle data
                 self.save_cycle(combined_data, repeat_num)
             except Exception as e:
                 print(f"Error processing repeat {repeat_num}: {e}")
 
+        if not self.repeats:
+            raise ValueError("No matching 'Run-On' and 'Off' cycle pairs found.")
+
+        return self.repeats
+
 
     def run(self):
         """
         Runs the data processing and saving of cycles.
+
+        Returns:
+            dict: Mapping of repeat number to the combined "On" and "Off" DataFrame.
         """
         # Ensure repeat count is set if no filepath was provided
         if self.repeat_count is None:
             raise ValueError("Repeat count must be specified when providing data directly.")
 
-        self.process_cycles()
+        return self.process_cycles()
+
+    def iter_repeats(self, chunksize=None):
+        """
+        Yields each combined "On" and "Off" repeat as soon as it is complete. When the data was
+        not loaded up front, the file is read in chunks and only the open repeat is kept in memory.
+
+        Parameters:
+            chunksize (int): Number of rows per chunk. Defaults to self.chunksize.
+
+        Yields:
+            tuple: (repeat number, combined "On" and "Off" DataFrame)
+        """
+        if chunksize is None:
+            chunksize = self.chunksize
+
+        # Data that is already in memory is split in one pass
+        if self.data is not None or chunksize is None:
+            if self.data is None:
+                self.load_data()
+
+            yield from self.run().items()
+            return
+
+        print(f"Streaming data from {self.filepath} in chunks of {chunksize} rows")
+
+        assembler = repeat_assembler()
+
+        for chunk in iter_raw_csv(self.filepath, chunksize):
+            if 'Cycle' not in chunk.columns:
+                raise ValueError("The 'Cycle' column is missing in the data.")
+
+            for repeat_num, combined_data in assembler.feed(chunk):
+                self.save_cycle(combined_data, repeat_num)
+                yield repeat_num, combined_data
+
+        for repeat_num, combined_data in assembler.close():
+            self.save_cycle(combined_data, repeat_num)
+            yield repeat_num, combined_data
+
+
+class repeat_assembler:
+
+    def __init__(self):
+        """
+        Collects rows chunk by chunk and returns each "On" and "Off" repeat once it has closed.
+        A repeat closes when a row of another repeat, or a row without a repeat, follows it.
+        Rows of the open repeat are carried over chunk boundaries.
+        """
+        self.current_repeat = None
+        self.pending = []
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of rows in acquisition order.
+
+        Parameters:
+            chunk (DataFrame): The next rows, with a 'Cycle' column.
+
+        Returns:
+            list: (repeat number, combined DataFrame) for every repeat closed by this chunk.
+        """
+        closed = []
+
+        if chunk.empty:
+            return closed
+
+        chunk = add_cycle_codes(chunk)
+        repeat = chunk['Repeat'].to_numpy()
+
+        # Runs of rows sharing the same repeat number
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(repeat)) + 1))
+        stops = np.append(starts[1:], len(repeat))
+
+        for start, stop in zip(starts, stops):
+            repeat_num = int(repeat[start])
+
+            if repeat_num != self.current_repeat:
+                closed.extend(self.close())
+
+                if repeat_num >= 0:
+                    self.current_repeat = repeat_num
+
+            if repeat_num >= 0:
+                self.pending.append(chunk.iloc[start:stop])
+
+        return closed
+
+    def close(self):
+        """
+        Closes the open repeat, e.g. at the end of the file.
+
+        Returns:
+            list: (repeat number, combined DataFrame) for the open repeat if it has both "On" and "Off" rows.
+        """
+        closed = []
+
+        if self.pending:
+            combined_data = self.pending[0] if len(self.pending) == 1 else pd.concat(self.pending)
+            phase = combined_data['Phase'].to_numpy()
+            is_off = phase == PHASE_OFF
+
+            if np.any(phase == PHASE_ON) and np.any(is_off):
+                # Keep "Run-On" rows before "Off" rows, as in process_cycles
+                if np.any(is_off[:-1] > is_off[1:]):
+                    combined_data = combined_data.iloc[np.argsort(is_off, kind='stable')]
+
+                closed.append((self.current_repeat, combined_data))
+
+        self.current_repeat = None
+        self.pending = []
+
+        return closed
 
 
 #### EXAMPLE USAGE ####
@@ -0,0 +1,247 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a class for caching processing results by the content hash of the raw files.
+
+##### IMPORTS #####
+
+import ast
+import hashlib
+import json
+import os
+import time
+
+##### CONSTANTS #####
+
+# Modules whose source is part of the cache key, editing any of them invalidates the cache. The
+# local modules they import are added by pipeline_modules, so new pipeline modules are not missed
+PIPELINE_MODULES = ['main.py', 'repeat_splitter.py', 'split_relay_data.py', 'gas_data_formatting.py',
+                    'cycle_codes.py', 'csv_loader.py', 'json_db.py', 'kinetics.py', 'array_utils.py',
+                    'concentration_segments.py']
+
+CACHE_FILENAME = '_cache.json'
+
+##### FUNCTIONS #####
+
+def file_hash(filepath, block_size=1 << 20):
+    """
+    Returns the SHA-256 hash of a file's content, read in blocks.
+
+    Parameters:
+        filepath (str): Path to the file.
+        block_size (int): Number of bytes read at a time.
+    """
+    sha = hashlib.sha256()
+
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def pipeline_modules(source_dir=None):
+    """
+    Returns PIPELINE_MODULES and every module of the source folder they import, directly or
+    through other local modules, sorted by name.
+
+    Parameters:
+        source_dir (str): Folder of the pipeline modules. Defaults to the folder of this file.
+    """
+    if source_dir is None:
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+
+    found = set()
+    pending = list(PIPELINE_MODULES)
+
+    while pending:
+        module = pending.pop()
+        path = os.path.join(source_dir, module)
+
+        if module in found or not os.path.exists(path):
+            continue
+
+        found.add(module)
+
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+
+            pending.extend(f"{name.split('.')[0]}.py" for name in names)
+
+    return sorted(found)
+
+
+def code_version():
+    """
+    Returns a hash of the pipeline source files, used as the code version of the cache key.
+    """
+    sha = hashlib.sha256()
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+
+    for module in pipeline_modules(source_dir):
+        path = os.path.join(source_dir, module)
+
+        if os.path.exists(path):
+            sha.update(module.encode('utf-8'))
+            sha.update(file_hash(path).encode('utf-8'))
+
+    return sha.hexdigest()[:16]
+
+##### CLASS DEFINITION #####
+
+class result_cache:
+
+    def __init__(self, json_folder='json_folder'):
+        """
+        Cache of the entries produced for each raw file, keyed on the file's content hash, the
+        processing configuration and the code version. The cache is stored next to the entries.
+
+        Parameters:
+            json_folder (str): The folder holding the saved entries.
+        """
+        self.json_folder = json_folder
+        self.path = os.path.join(json_folder, CACHE_FILENAME)
+        self.version = code_version()
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+
+    def make_key(self, input_file, config):
+        """
+        Returns the cache key of a raw file and a processing configuration. The file name is part
+        of the key since the analyte, material and ppm values are parsed from it.
+
+        Parameters:
+            input_file (str): Path to the raw file.
+            config (dict): The processing configuration, e.g. analytes, materials and rep_method.
+        """
+        key_data = {
+            'name': os.path.basename(input_file),
+            'file': file_hash(input_file),
+            'config': config,
+            'code': self.version,
+        }
+
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=sorted).encode('utf-8')).hexdigest()
+
+    def lookup(self, input_file, config):
+        """
+        Returns the saved entries of a file processed with the same inputs, or None if the
+        file has to be processed. Entries whose outputs were deleted are treated as misses.
+
+        Parameters:
+            input_file (str): Path to the raw file.
+            config (dict): The processing configuration.
+
+        Returns:
+            tuple: (cache key, list of output paths or None)
+        """
+        key = self.make_key(input_file, config)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return key, None
+
+        outputs = [os.path.join(self.json_folder, output) for output in entry['outputs']]
+
+        if not all(os.path.exists(output) for output in outputs):
+            return key, None
+
+        return key, outputs
+
+    def store(self, key, input_file, outputs):
+        """
+        Records the outputs of a processed file and saves the cache.
+
+        Parameters:
+            key (str): The cache key returned by lookup.
+            input_file (str): Path to the raw file.
+            outputs (list): Paths of the saved entries.
+        """
+        self.entries[key] = {
+            'file': os.path.abspath(input_file),
+            'version': self.version,
+            'time': time.time(),
+            'outputs': [os.path.basename(output) for output in outputs],
+        }
+
+        self.save()
+
+    def invalidate(self, input_file=None):
+        """
+        Removes the cache entries of a raw file, or every entry if no file is given.
+
+        Parameters:
+            input_file (str): Path to the raw file (optional).
+
+        Returns:
+            int: Number of removed entries.
+        """
+        if input_file is None:
+            removed = len(self.entries)
+            self.entries = {}
+        else:
+            input_file = os.path.abspath(input_file)
+            stale = [key for key, entry in self.entries.items() if entry['file'] == input_file]
+            removed = len(stale)
+
+            for key in stale:
+                del self.entries[key]
+
+        self.save()
+
+        return removed
+
+    def prune(self):
+        """
+        Removes entries made by another code version, or whose raw file or outputs no longer exist.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        stale = [
+            key for key, entry in self.entries.items()
+            if entry['version'] != self.version
+            or not os.path.exists(entry['file'])
+            or not all(os.path.exists(os.path.join(self.json_folder, output)) for output in entry['outputs'])
+        ]
+
+        for key in stale:
+            del self.entries[key]
+
+        self.save()
+
+        return len(stale)
+
+    def save(self):
+        """
+        Writes the cache file.
+        """
+        os.makedirs(self.json_folder, exist_ok=True)
+
+        with open(self.path, 'w') as cache_file:
+            json.dump(self.entries, cache_file, indent=4)
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    cache = result_cache()
+
+    action = input('Enter the cache action (P - Prune stale entries, C - Clear all entries): ')
+
+    if action == 'P':
+        print(f"Removed {cache.prune()} stale cache entries.")
+    elif action == 'C':
+        print(f"Removed {cache.invalidate()} cache entries.")
@@ -0,0 +1,198 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file holds the configuration of unattended batch runs: the defaults, the JSON config
+# file and the command line options of main.py.
+
+##### IMPORTS #####
+
+import argparse
+import glob
+import json
+import os
+
+from json_db import BACKENDS, ENCODINGS
+from plot_queue import PLOT_MODES
+
+##### CONSTANTS #####
+
+# Configuration of a run, a config file or the command line only needs the keys it changes
+DEFAULT_CONFIG = {
+    'inputs': ['data/*.csv'],
+    'analytes': ['EtOH', 'IPA', 'Ace'],
+    'materials': ['CuOxSnOx'],
+    'rep_method': 'R',
+    'workers': None,
+    'work_dir': '.',
+    'storage_backend': 'json',
+    'storage_encoding': None,
+    'plots': 'async',
+    'io_workers': 4,
+    'chunksize': None,
+    'use_cache': True,
+    'features': True,
+    'save_intermediate': False,
+    'on_missing': 'error',
+}
+
+# 'error' stops the batch before processing when a file name lacks metadata, 'skip' logs and skips the file
+MISSING_ACTIONS = ('error', 'skip')
+
+##### FUNCTIONS #####
+
+def validate_config(config):
+    """
+    Raises a ValueError if a key or value of a configuration is not supported.
+
+    Parameters:
+        config (dict): The configuration.
+    """
+    unknown = set(config) - set(DEFAULT_CONFIG)
+
+    if unknown:
+        raise ValueError(f"Unknown config keys {sorted(unknown)}. Expected keys from {sorted(DEFAULT_CONFIG)}.")
+
+    choices = {
+        'rep_method': ('R', 'C'),
+        'storage_backend': tuple(BACKENDS),
+        'storage_encoding': (None,) + ENCODINGS,
+        'plots': PLOT_MODES,
+        'on_missing': MISSING_ACTIONS,
+    }
+
+    for key, accepted in choices.items():
+        if config[key] not in accepted:
+            raise ValueError(f"Unknown {key} '{config[key]}'. Expected one of {accepted}.")
+
+    for key in ('inputs', 'analytes', 'materials'):
+        if isinstance(config[key], str) or not config[key]:
+            raise ValueError(f"The config key '{key}' must be a non-empty list.")
+
+    for key in ('workers', 'chunksize'):
+        if config[key] is not None and (not isinstance(config[key], int) or config[key] < 1):
+            raise ValueError(f"The config key '{key}' must be a positive integer or null.")
+
+    if not isinstance(config['io_workers'], int) or config['io_workers'] < 0:
+        raise ValueError("The config key 'io_workers' must be a non-negative integer.")
+
+
+def load_config(path=None, **overrides):
+    """
+    Returns the configuration of a run: the defaults, updated with a JSON config file and then
+    with the overrides. None overrides are ignored, so unset command line options keep the
+    value of the config file.
+
+    Example config file:
+        {"inputs": ["data/2024*.csv"], "analytes": ["EtOH", "H2"], "workers": 8, "on_missing": "skip"}
+
+    Parameters:
+        path (str): Path to the JSON config file (optional).
+        overrides: Config keys set on top of the file.
+
+    Returns:
+        dict: The validated configuration.
+    """
+    config = dict(DEFAULT_CONFIG)
+
+    if path is not None:
+        with open(path, 'r') as config_file:
+            config.update(json.load(config_file))
+
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    validate_config(config)
+
+    return config
+
+
+def save_config(config, path):
+    """
+    Saves a configuration as a JSON config file.
+
+    Parameters:
+        config (dict): The configuration.
+        path (str): Output path.
+    """
+    with open(path, 'w') as config_file:
+        json.dump(config, config_file, indent=4)
+
+
+def expand_inputs(patterns):
+    """
+    Returns the files matching the input patterns, sorted and without duplicates. A directory
+    stands for every file in it, and '**' matches nested folders.
+
+    Parameters:
+        patterns (list): Glob patterns, file paths or directories.
+    """
+    files = set()
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+
+        files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+    return sorted(files)
+
+
+def build_parser():
+    """
+    Returns the command line parser of main.py. Every option overrides the config file.
+    """
+    parser = argparse.ArgumentParser(description="Format raw relay logs into json_folder without prompts, "
+                                                 "e.g. python main.py 'data/*.csv' --workers 8 --on-missing skip.")
+    parser.add_argument('inputs', nargs='*', default=None,
+                        help="Input files, directories or glob patterns (quote them). Defaults to data/*.csv.")
+    parser.add_argument('--config', default=None, help="JSON config file, see run_config.DEFAULT_CONFIG.")
+    parser.add_argument('--analytes', nargs='+', default=None, help="Analytes to look for in the file names.")
+    parser.add_argument('--materials', nargs='+', default=None, help="Materials to look for in the file names.")
+    parser.add_argument('--rep-method', choices=('R', 'C'), default=None,
+                        help="R for repeat ppm files, C for cascade ppm files.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes, 1 processes the files in this process. Defaults to all CPUs.")
+    parser.add_argument('--work-dir', default=None, help="Directory holding json_folder, relay_graphs and reports.")
+    parser.add_argument('--backend', dest='storage_backend', choices=tuple(BACKENDS), default=None,
+                        help="json_db storage backend of the entries.")
+    parser.add_argument('--encoding', dest='storage_encoding', choices=ENCODINGS, default=None,
+                        help="Encoding of the ON and OFF arrays for the json and ndjson backends.")
+    parser.add_argument('--plots', choices=PLOT_MODES, default=None, help="Plot mode, see plot_queue.")
+    parser.add_argument('--io-workers', type=int, default=None, help="Number of background writer threads.")
+    parser.add_argument('--chunksize', type=int, default=None, help="Stream the input files in chunks of this many rows.")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_const', const=False, default=None,
+                        help="Process every file, even if unchanged since a cached run.")
+    parser.add_argument('--no-features', dest='features', action='store_const', const=False, default=None,
+                        help="Do not compute the response features after the run.")
+    parser.add_argument('--save-intermediate', action='store_const', const=True, default=None,
+                        help="Keep the repeat and relay CSV files.")
+    parser.add_argument('--on-missing', choices=MISSING_ACTIONS, default=None,
+                        help="Stop (error) or skip the file (skip) when a file name lacks its metadata.")
+    parser.add_argument('--dry-run', action='store_true', help="Check the inputs and print the config without processing.")
+    parser.add_argument('--write-config', default=None, help="Save the resulting config to this path and exit.")
+
+    return parser
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line of main.py.
+
+    Parameters:
+        argv (list): Command line arguments. Defaults to sys.argv.
+
+    Returns:
+        tuple: (configuration, parsed arguments)
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    overrides = {key: getattr(args, key) for key in DEFAULT_CONFIG if hasattr(args, key)}
+    overrides['inputs'] = args.inputs or None
+
+    # An invalid config file exits with the usage message instead of a traceback
+    try:
+        config = load_config(args.config, **overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    return config, args
@@ -0,0 +1,308 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file is a class for timing the pipeline stages and writing a run report.
+
+##### IMPORTS #####
+
+import csv
+import json
+import os
+import sys
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+##### CONSTANTS #####
+
+# Stages recorded by main, in pipeline order
+STAGES = ('load', 'repeat_split', 'relay_split', 'plotting', 'formatting', 'json_save', 'write_wait', 'features')
+
+REPORT_FIELDS = ['file', 'stage', 'calls', 'seconds', 'rows', 'bytes', 'peak_rss_mb']
+
+# Linux files used to read and reset the peak RSS, so each stage reports its own peak
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+##### FUNCTIONS #####
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None if it cannot be read.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss)
+
+    return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of this process to its current RSS (Linux only).
+
+    Returns:
+        bool: True if the peak was reset.
+    """
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def stage_peak_rss():
+    """
+    Returns the peak resident set size in bytes since the last reset_peak_rss, from VmHWM.
+    """
+    with open(PROC_STATUS, 'r') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+
+    return peak_rss()
+
+
+def load_report(path):
+    """
+    Returns the stage records of a JSON run report.
+
+    Parameters:
+        path (str): Path to the report written by run_profiler.write_report.
+    """
+    with open(path, 'r') as report_file:
+        return json.load(report_file)['records']
+
+##### CLASS DEFINITION #####
+
+class run_profiler:
+
+    def __init__(self):
+        """
+        Records the wall time, rows processed, bytes written and peak RSS of each pipeline stage,
+        per input file. Nested stages are not counted twice, a stage's time excludes the stages
+        run inside it.
+
+        On Linux the peak RSS is reset when a stage starts, so 'peak_rss_mb' is the highest RSS
+        during the calls of that stage, including the stages run inside it. Elsewhere it is the
+        peak of the process up to the end of the stage.
+        """
+        self.records = {}
+        self.current_file = None
+        self.start = time.time()
+        self.peak_rss_mb = None
+        self._child_seconds = []
+        self._child_peaks = []
+        self.resets_peak = reset_peak_rss()
+
+    def _record(self, file, stage):
+        """
+        Returns the record of a file and stage, creating it if needed.
+        """
+        key = (file, stage)
+
+        if key not in self.records:
+            self.records[key] = {'file': file, 'stage': stage, 'calls': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0,
+                                 'peak_rss_mb': None}
+
+        return self.records[key]
+
+    @contextmanager
+    def stage(self, name, file=None, rows=0):
+        """
+        Times the code run inside the with block as one call of a stage. The block can set the
+        'rows' and 'bytes' counters of the yielded dictionary.
+
+        Parameters:
+            name (str): Stage name, see STAGES.
+            file (str): Input file the stage works on. Defaults to self.current_file.
+            rows (int): Number of rows processed, can also be set inside the block.
+        """
+        counters = {'rows': rows, 'bytes': 0}
+        self._child_seconds.append(0.0)
+
+        if self.resets_peak:
+            # Keep the enclosing stage's peak so far before resetting it for this stage
+            if self._child_peaks:
+                self._child_peaks[-1] = max(self._child_peaks[-1], stage_peak_rss())
+
+            reset_peak_rss()
+            self._child_peaks.append(0)
+
+        start = time.perf_counter()
+
+        try:
+            yield counters
+        finally:
+            elapsed = time.perf_counter() - start
+            child_seconds = self._child_seconds.pop()
+
+            # The enclosing stage does not count the time of this one
+            if self._child_seconds:
+                self._child_seconds[-1] += elapsed
+
+            peak_rss_mb = None
+
+            if self.resets_peak:
+                peak = max(self._child_peaks.pop(), stage_peak_rss())
+                peak_rss_mb = peak / 1e6
+
+                # The enclosing stage includes the peak of this one
+                if self._child_peaks:
+                    self._child_peaks[-1] = max(self._child_peaks[-1], peak)
+
+            self.add(name, file, elapsed - child_seconds, counters['rows'], counters['bytes'], peak_rss_mb=peak_rss_mb)
+
+    def iterate(self, iterable, name, file=None, rows=len, bytes_written=None):
+        """
+        Yields the items of an iterable, timing the production of each item as a call of a stage.
+        The time spent by the caller between items is not counted.
+
+        Parameters:
+            iterable (iterable): The items, e.g. a generator of repeats.
+            name (str): Stage name.
+            file (str): Input file the stage works on. Defaults to self.current_file.
+            rows (callable): Returns the number of rows of an item.
+            bytes_written (callable): Returns the running total of bytes written by the iterable (optional).
+        """
+        iterator = iter(iterable)
+
+        while True:
+            with self.stage(name, file) as counters:
+                written = bytes_written() if bytes_written is not None else 0
+
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    if bytes_written is not None:
+                        counters['bytes'] = bytes_written() - written
+
+                counters['rows'] = rows(item)
+
+            yield item
+
+    def add(self, name, file=None, seconds=0.0, rows=0, bytes_written=0, calls=1, peak_rss_mb=None):
+        """
+        Adds a measurement to the record of a file and stage.
+
+        Parameters:
+            name (str): Stage name.
+            file (str): Input file. Defaults to self.current_file.
+            seconds (float): Wall time.
+            rows (int): Rows processed.
+            bytes_written (int): Bytes written.
+            calls (int): Number of calls measured.
+            peak_rss_mb (float): Peak RSS, read from this process if not provided.
+        """
+        record = self._record(file if file is not None else self.current_file, name)
+
+        if peak_rss_mb is None:
+            peak = peak_rss()
+            peak_rss_mb = peak / 1e6 if peak is not None else None
+
+        record['calls'] += calls
+        record['seconds'] += seconds
+        record['rows'] += rows
+        record['bytes'] += bytes_written
+
+        if peak_rss_mb is not None:
+            record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.0, peak_rss_mb)
+            self.peak_rss_mb = max(self.peak_rss_mb or 0.0, peak_rss_mb)
+
+    def merge(self, records):
+        """
+        Adds the records of another run, e.g. the report of a worker process.
+
+        Parameters:
+            records (list): Records returned by load_report.
+        """
+        for record in records:
+            self.add(record['stage'], record['file'], record['seconds'], record['rows'], record['bytes'],
+                     record['calls'], record['peak_rss_mb'])
+
+    def stage_totals(self):
+        """
+        Returns the records summed over the files, one per stage, slowest first.
+        """
+        totals = {}
+
+        for record in self.records.values():
+            total = totals.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                        'rows': 0, 'bytes': 0, 'peak_rss_mb': None})
+            total['calls'] += record['calls']
+            total['seconds'] += record['seconds']
+            total['rows'] += record['rows']
+            total['bytes'] += record['bytes']
+
+            if record['peak_rss_mb'] is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0.0, record['peak_rss_mb'])
+
+        return sorted(totals.values(), key=lambda total: total['seconds'], reverse=True)
+
+    def write_report(self, path):
+        """
+        Writes the run report as JSON, and the per-file stage records as CSV next to it.
+
+        Parameters:
+            path (str): Path of the JSON report, the CSV uses the same name with a .csv extension.
+
+        Returns:
+            str: Path of the JSON report.
+        """
+        os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+
+        records = list(self.records.values())
+
+        # The stage resets lower the process peak, the run peak is the highest stage peak
+        peak = peak_rss()
+        peak_rss_mb = max(self.peak_rss_mb or 0.0, peak / 1e6) if peak is not None else self.peak_rss_mb
+
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_seconds': time.time() - self.start,
+            'peak_rss_mb': peak_rss_mb,
+            'stages': self.stage_totals(),
+            'records': records,
+        }
+
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+
+        with open(os.path.splitext(path)[0] + '.csv', 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+
+        return path
+
+    def print_summary(self):
+        """
+        Prints the time spent in each stage, slowest first.
+        """
+        totals = self.stage_totals()
+        total_seconds = sum(total['seconds'] for total in totals) or 1e-9
+
+        for total in totals:
+            print(f"{total['stage']:<14}{total['seconds']:>9.2f} s ({100 * total['seconds'] / total_seconds:4.1f}%) "
+                  f"{total['rows']:>12} rows {total['bytes'] / 1e6:>9.1f} MB written")
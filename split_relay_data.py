@@ -8,13 +8,24 @@
 
 import os
 import pandas as pd
-import matplotlib.pyplot as plt
 import re
 
+from background_writer import save_csv
+from cycle_codes import get_phase, PHASE_ON, PHASE_OFF
+from errors import MissingMetadataError
+from plot_queue import plot_queue
+from run_profiler import run_profiler
+
+###### CONSTANTS ######
+
+# Columns of the relay CSV files
+RELAY_COLUMNS = ['Time', 'Resistance', 'Cycle']
+
 ###### CLASS DEFINITION ######
 
 class SplitRelayData:
-    def __init__(self, filename, data, sensor_match=None):
+    def __init__(self, filename, data, sensor_match=None, output_dir='relay_data', graph_dir='relay_graphs', plots=None,
+                 profiler=None, writer=None):
         """
         This class is used to split relay data into separate files for each sensor.
 
@@ -24,10 +35,23 @@ class SplitRelayData:
 
         Optional Parameters:
             sensor_match (str): The pattern to match the sensor name in the filename. If not provided, it defaults to 'PN'.
+            output_dir (str): Directory for the per-sensor CSV files. If None, the sensor data is only returned in memory.
+            graph_dir (str): Directory for the scatter plots. Defaults to 'relay_graphs'.
+            plots (plot_queue): Queue the scatter plots are submitted to. If not provided, plots are rendered immediately.
+            profiler (run_profiler): Profiler recording the time spent submitting plots as the 'plotting' stage.
+            writer (background_writer): Writer the CSV files are submitted to. If not provided, they are written immediately.
         """
         self.data = data
         self.file_name = filename
         self.sensor_match = sensor_match or 'PN'
+        self.output_dir = output_dir
+        self.graph_dir = graph_dir
+        self.plots = plots if plots is not None else plot_queue(mode='sync')
+        self.profiler = profiler if profiler is not None else run_profiler()
+        self.writer = writer
+
+        # Bytes of the sensor files written so far
+        self.bytes_written = 0
         self.relays = self.get_active_relays()
 
         if not self.relays:
@@ -54,7 +78,8 @@ class SplitRelayData:
 
     def get_sensor_name(self):
         """
-        Extracts sensor names for each active relay from the filename or prompts the user for input.
+        Extracts sensor names for each active relay from the filename. Raises a
+        MissingMetadataError if the filename has no sensor label, so batch runs do not wait on a prompt.
 
         Returns:
             list: A list of sensor names for each relay.
@@ -63,7 +88,10 @@ class SplitRelayData:
         print(f'File: {self.file_name}')
         match = re.search(fr'{re.escape(self.sensor_match)}\d+', self.file_name)
 
-        sensor_name = match.group(0) if match else input("Enter the sensor name: ")
+        if not match:
+            raise MissingMetadataError(f"No {self.sensor_match} sensor label found in the file name: {self.file_name}")
+
+        sensor_name = match.group(0)
 
         for relay in self.relays:
             sensor_names.append(f'{sensor_name}.{relay}')
@@ -72,71 +100,89 @@ class SplitRelayData:
 
     def generate_files(self, graph=False):
         """
-        Generates CSV files for each sensor's data and optionally creates scatter plots.
+        Splits the data per sensor, writes CSV files for each sensor's data when an output
+        directory is set, and optionally creates scatter plots.
 
         Parameters:
             graph (bool): If True, scatter plots will be generated for each sensor's data.
+
+        Returns:
+            dict: Mapping of sensor name to its DataFrame with 'Time', 'Resistance', 'Cycle' and 'Phase' columns.
         """
+        sensor_data = {}
+
         if not self.relays:
             print("No active relays to generate files for.")
-            return
+            return sensor_data
 
         # Ensure output directories exist
-        os.makedirs('relay_data', exist_ok=True)
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
         if graph:
-            os.makedirs('relay_graphs', exist_ok=True)
+            os.makedirs(self.graph_dir, exist_ok=True)
 
         for sensor, relay in zip(self.sensor_names, self.relays):
             column_name = f'Relay {relay} Resistance'
             if column_name in self.data.columns:
-                self._save_sensor_data(sensor, column_name, graph)
+                sensor_data[sensor] = self._save_sensor_data(sensor, column_name, graph)
             else:
                 print(f"Warning: {column_name} does not exist in the data.")
 
+        return sensor_data
+
     def _save_sensor_data(self, sensor, column_name, graph):
         """
-        Saves individual sensor data to a CSV file and generates a scatter plot if required.
+        Builds the individual sensor data, saves it to a CSV file if an output directory is set
+        and generates a scatter plot if required.
 
         Parameters:
             sensor (str): Sensor name.
             column_name (str): Column name for relay resistance.
             graph (bool): Whether to generate scatter plots.
+
+        Returns:
+            DataFrame: The sensor data.
         """
+        # The loader already parsed the columns with their types, avoid re-casting copies
         data_dict = {
-            "Time": self.data["Elapsed Time (s)"].values.astype(float),
-            "Resistance": self.data[column_name].values.astype(float),
-            "Cycle": self.data["Cycle"].values.astype(str)
+            "Time": self.data["Elapsed Time (s)"].to_numpy(dtype=float),
+            "Resistance": self.data[column_name].to_numpy(dtype=float),
+            "Cycle": self.data["Cycle"].array,
+            "Phase": get_phase(self.data)
         }
 
         df = pd.DataFrame(data_dict)
-        output_csv = f'relay_data/{self.file_name}_{sensor}.csv'
-        df.to_csv(output_csv, index=False)
-        print(f"File {output_csv} has been saved.")
+
+        if self.output_dir is not None:
+            # The phase codes are only kept in memory for the plots, the CSV keeps the relay file columns
+            output_csv = os.path.join(self.output_dir, f'{self.file_name}_{sensor}.csv')
+            self.bytes_written += save_csv(df, output_csv, self.writer, columns=RELAY_COLUMNS)
 
         if graph:
-            self._generate_scatter_plot(df, sensor)
+            with self.profiler.stage('plotting', rows=len(df)):
+                self._generate_scatter_plot(df, sensor)
+
+        return df
 
     def _generate_scatter_plot(self, df, sensor):
         """
-        Generates a scatter plot for the sensor data.
+        Submits a scatter plot of the sensor data to the plot queue.
 
         Parameters:
             df (DataFrame): The DataFrame containing sensor data.
             sensor (str): Sensor name for labeling the plot.
         """
-        on_data = df[df['Cycle'].str.contains('on', case=False, na=False)]
-        off_data = df[df['Cycle'].str.contains('off', case=False, na=False)]
-
-        plt.scatter(on_data["Time"], on_data['Resistance'], label="ON", s=1)
-        plt.scatter(off_data["Time"], off_data["Resistance"], label="OFF", s=1)
-
-        plt.xlabel("Time (s)")
-        plt.ylabel("Resistance")
-        plt.title(f"{self.file_name}_{sensor}")
-        plt.legend()
-        plt.savefig(f'relay_graphs/{self.file_name}_{sensor}.png')
-        plt.close()
-        print(f"Scatter plot saved for {sensor}.")
+        phase = get_phase(df)
+        time = df["Time"].to_numpy()
+        resistance = df["Resistance"].to_numpy()
+
+        series = [
+            ("ON", time[phase == PHASE_ON], resistance[phase == PHASE_ON]),
+            ("OFF", time[phase == PHASE_OFF], resistance[phase == PHASE_OFF]),
+        ]
+
+        self.plots.submit(os.path.join(self.graph_dir, f'{self.file_name}_{sensor}.png'), f"{self.file_name}_{sensor}", series)
+        print(f"Scatter plot submitted for {sensor}.")
 
 #### MAIN FUNCTION ####
 
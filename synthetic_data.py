@@ -0,0 +1,181 @@
+# ----
+# Author: Agosh Saini
+# Contact: contact@agoshsaini.com
+# -----
+# This file generates synthetic raw relay logs that follow the acquisition file format.
+
+##### IMPORTS #####
+
+import os
+import numpy as np
+import pandas as pd
+
+from csv_loader import TIME_COLUMN, CYCLE_COLUMN
+
+##### FUNCTIONS #####
+
+def iter_relay_log(n_relays=8, repeats=3, ppm=(1250,), sample_rate=2.0, pre_duration=60.0,
+                   on_duration=120.0, off_duration=180.0, noise=0.002, seed=0, block_rows=None):
+    """
+    Generates a raw relay log with a "Pre" baseline followed by "Run-On" and "Off" cycles,
+    in blocks of rows. Each relay has its own baseline resistance, and its resistance drops
+    exponentially during exposure, by an amount that grows with the concentration, then recovers.
+
+    Every ppm value is repeated `repeats` times in order, so a log with several ppm values
+    has len(ppm) * repeats cycles.
+
+    Parameters:
+        n_relays (int): Number of relays, at most 8.
+        repeats (int): Number of cycles per ppm value.
+        ppm (tuple): Concentrations of the cycles.
+        sample_rate (float): Samples per second.
+        pre_duration (float): Length of the "Pre" baseline in seconds.
+        on_duration (float): Length of each "Run-On" cycle in seconds.
+        off_duration (float): Length of each "Off" cycle in seconds.
+        noise (float): Standard deviation of the noise, relative to the baseline resistance.
+        seed (int): Seed of the random generator.
+        block_rows (int): Number of rows per block. None generates the log in one block.
+
+    Yields:
+        DataFrame: The next rows, with 'Elapsed Time (s)', 'Cycle' and 'Relay N Resistance' columns.
+    """
+    if not 1 <= n_relays <= 8:
+        raise ValueError("n_relays must be between 1 and 8.")
+
+    rng = np.random.default_rng(seed)
+
+    n_pre = int(round(pre_duration * sample_rate))
+    n_on = int(round(on_duration * sample_rate))
+    n_off = int(round(off_duration * sample_rate))
+    n_cycles = repeats * len(ppm)
+    n_rows = n_pre + n_cycles * (n_on + n_off)
+
+    # Category 0 is "Pre", then the "Run-On" and "Off" label of each cycle
+    categories = ["Pre"]
+    for cycle in range(1, n_cycles + 1):
+        categories += [f"Run-On Cycle (Repeat {cycle})", f"Off Cycle (Repeat {cycle})"]
+
+    # Parameters of each relay
+    baseline = rng.uniform(5e4, 5e6, n_relays)
+    sensitivity = rng.uniform(0.05, 0.2, n_relays)
+    tau_on = rng.uniform(10.0, 40.0, n_relays)
+    tau_off = rng.uniform(20.0, 80.0, n_relays)
+
+    ppm = np.asarray(ppm, dtype=float)
+    block_rows = block_rows or n_rows
+
+    for start in range(0, n_rows, block_rows):
+        rows = np.arange(start, min(start + block_rows, n_rows))
+
+        # Cycle and position within the cycle of every row, rows before n_pre are "Pre"
+        cycle = (rows - n_pre) // (n_on + n_off)
+        position = (rows - n_pre) % (n_on + n_off)
+        is_pre = rows < n_pre
+        is_on = ~is_pre & (position < n_on)
+        is_off = ~is_pre & ~is_on
+
+        codes = np.where(is_pre, 0, 2 * cycle + np.where(is_on, 1, 2))
+        cycle_ppm = np.where(is_pre, 0.0, ppm[np.clip(cycle, 0, None) // repeats % len(ppm)])
+
+        t_on = position / sample_rate
+        t_off = (position - n_on) / sample_rate
+
+        data = {
+            TIME_COLUMN: rows / sample_rate,
+            CYCLE_COLUMN: pd.Categorical.from_codes(codes, categories=categories),
+        }
+
+        for relay in range(n_relays):
+            # Relative response saturates with concentration
+            magnitude = sensitivity[relay] * np.sqrt(cycle_ppm / 1000.0)
+            peak = magnitude * (1 - np.exp(-on_duration / tau_on[relay]))
+
+            response = np.where(is_on, magnitude * (1 - np.exp(-t_on / tau_on[relay])), 0.0)
+            response = np.where(is_off, peak * np.exp(-t_off / tau_off[relay]), response)
+
+            noise_factor = 1 + rng.normal(0, noise, len(rows))
+            data[f"Relay {relay + 1} Resistance"] = baseline[relay] * (1 - response) * noise_factor
+
+        yield pd.DataFrame(data)
+
+
+def generate_relay_log(**kwargs):
+    """
+    Generates a whole raw relay log in memory, see iter_relay_log for the parameters.
+
+    Returns:
+        DataFrame: The log.
+    """
+    kwargs.pop('block_rows', None)
+
+    return next(iter_relay_log(**kwargs))
+
+
+def log_filename(date="20241105", board="PN1", material="CuOxSnOx", analyte="EtOH", ppm=(1250,), repeats=3):
+    """
+    Returns a file name following the acquisition convention, e.g.
+    20241105_PN1_CuOxSnOx_EtOH_1250ppm_rep=3.csv
+
+    Parameters:
+        date (str): Date as YYYYMMDD.
+        board (str): Sensor board label, e.g. 'PN1'.
+        material (str): Sensing material.
+        analyte (str): Analyte.
+        ppm (tuple): Concentrations.
+        repeats (int): Number of cycles per ppm value.
+    """
+    concentrations = "_".join(f"{value}ppm" for value in ppm)
+
+    return f"{date}_{board}_{material}_{analyte}_{concentrations}_rep={repeats}.csv"
+
+
+def rows_to_repeats(n_rows, ppm=(1250,), sample_rate=2.0, pre_duration=60.0, on_duration=120.0, off_duration=180.0):
+    """
+    Returns the number of repeats per ppm value that gives at least n_rows rows.
+
+    Parameters:
+        n_rows (int): Target number of rows.
+        ppm (tuple): Concentrations of the cycles.
+        sample_rate (float): Samples per second.
+        pre_duration (float): Length of the "Pre" baseline in seconds.
+        on_duration (float): Length of each "Run-On" cycle in seconds.
+        off_duration (float): Length of each "Off" cycle in seconds.
+    """
+    rows_per_cycle = int(round(on_duration * sample_rate)) + int(round(off_duration * sample_rate))
+    cycle_rows = max(n_rows - int(round(pre_duration * sample_rate)), 1)
+
+    return max(int(np.ceil(cycle_rows / (rows_per_cycle * len(ppm)))), 1)
+
+
+def write_relay_log(directory, date="20241105", board="PN1", material="CuOxSnOx", analyte="EtOH", ppm=(1250,),
+                    repeats=3, block_rows=1000000, **kwargs):
+    """
+    Generates a raw relay log and saves it with a conventional file name. The log is written
+    in blocks so files larger than memory can be generated.
+
+    Parameters:
+        directory (str): Output directory.
+        date, board, material, analyte, ppm, repeats: See log_filename.
+        block_rows (int): Number of rows generated and written at a time.
+        kwargs: Other iter_relay_log parameters.
+
+    Returns:
+        str: Path of the written file.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, log_filename(date, board, material, analyte, ppm, repeats))
+
+    for i, block in enumerate(iter_relay_log(repeats=repeats, ppm=ppm, block_rows=block_rows, **kwargs)):
+        block.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+    return path
+
+
+##### MAIN #####
+
+if __name__ == "__main__":
+    directory = input("Enter the output directory (default data): ") or "data"
+    repeats = int(input("Enter the number of repeats (default 3): ") or 3)
+
+    print(f"Saved {write_relay_log(directory, repeats=repeats)}")
@@ -6,21 +6,40 @@
 ###########
 
 ######## IMPORTS ########
-import pandas as pd
 import matplotlib.pyplot as plt
 import tkinter as tk
 from tkinter import filedialog
+from decimation import decimate_window
+from csv_loader import load_raw_csv
+
+######## CONSTANTS ########
+
+# Lower bound on the number of decimation buckets of an axes
+MIN_BUCKETS = 200
 
 
 ###### CLASS DEFINITION ######
 class SensorVisualizer:
-    def __init__(self, select_folder=False):
+    def __init__(self, select_folder=False, lod_method='minmax'):
+        """
+        Plots the relay columns of a file. Only a decimated copy of each signal is drawn, at about
+        one bucket per pixel, and it is recomputed for the visible window whenever the x range changes.
+
+        Parameters:
+            select_folder (bool): If True, a file is selected and loaded immediately.
+            lod_method (str): Decimation method, 'minmax' or 'lttb'.
+        """
         if select_folder:
             self.data, self.path = self.get_data()
         else:
             self.data = None
             self.path = None
 
+        self.lod_method = lod_method
+
+        # Full resolution (line, x, y) of the lines drawn on each axes
+        self.lod_lines = {}
+
     def update_data(self):
         self.data, self.path = self.get_data()
 
@@ -34,29 +53,92 @@ class SensorVisualizer:
         if not file_path:
             raise ValueError("No file selected.")
 
-        # Read the data
-        data = pd.read_csv(file_path)
+        # Read every column, the data is saved back after discarding sensors
+        data = load_raw_csv(file_path, columns='all')
 
         return data, file_path
 
+    def decimate(self, ax, x, y, xlim=None):
+        """
+        Decimates a signal for an axes, using about one bucket per pixel of the axes width.
+
+        Parameters:
+            ax (Axes): The axes the signal is drawn on.
+            x (array): The x values, sorted in increasing order.
+            y (array): The y values.
+            xlim (tuple): Visible x range (optional).
+        """
+        n_buckets = max(int(ax.get_window_extent().width), MIN_BUCKETS)
+
+        return decimate_window(x, y, xlim, n_buckets, method=self.lod_method)
+
+    def plot_lod(self, ax, x, y, label):
+        """
+        Draws a decimated line and keeps the full signal so the line can be refined on zoom.
+
+        Parameters:
+            ax (Axes): The axes to draw on.
+            x (array): The x values, sorted in increasing order.
+            y (array): The y values.
+            label (str): Line label.
+        """
+        line, = ax.plot(*self.decimate(ax, x, y), label=label)
+
+        if ax not in self.lod_lines:
+            self.lod_lines[ax] = []
+            ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+        self.lod_lines[ax].append((line, x, y))
+
+        return line
+
+    def on_xlim_changed(self, ax):
+        """
+        Recomputes the decimated lines of an axes for its new visible x range.
+
+        Parameters:
+            ax (Axes): The axes whose x range changed.
+        """
+        for line, x, y in self.lod_lines.get(ax, []):
+            line.set_data(*self.decimate(ax, x, y, ax.get_xlim()))
+
+        ax.figure.canvas.draw_idle()
+
+    def on_close(self, event):
+        """
+        Drops the full signals of the axes of a closed figure.
+
+        Parameters:
+            event (CloseEvent): The close event of the figure.
+        """
+        figure = event.canvas.figure
+
+        for ax in [ax for ax in self.lod_lines if ax.figure is figure]:
+            del self.lod_lines[ax]
+
     def on_click(self, event, ax):
         for a in ax:
             if a == event.inaxes:
                 fig_fullscreen, ax_fullscreen = plt.subplots(figsize=(10, 6))
+                fig_fullscreen.canvas.mpl_connect('close_event', self.on_close)
 
-                for line in a.get_lines():  # Copy lines from the clicked subplot
-                    ax_fullscreen.plot(line.get_xdata(), line.get_ydata(), label=line.get_label())
+                for line, x, y in self.lod_lines.get(a, []):  # Copy the full signals of the clicked subplot
+                    self.plot_lod(ax_fullscreen, x, y, line.get_label())
 
                 ax_fullscreen.set_title(a.get_title())
                 ax_fullscreen.legend()
                 plt.show()
 
     def visualize_sensors(self):
+        # Release the full signals of the previous file
+        self.lod_lines = {}
+
         # Get the columns
         columns = self.data.columns
 
         # Plot all the sensors
         fig, ax = plt.subplots(ncols=4, nrows=2, figsize=(20, 20))
+        fig.canvas.mpl_connect('close_event', self.on_close)
 
         # Flatten the axes array for easier indexing
         ax = ax.flatten()
@@ -64,9 +146,11 @@ class SensorVisualizer:
         # Plot all the sensors
         i = 0
 
+        x = self.data.index.to_numpy()
+
         for column in columns:
             if 'Relay' in column:
-                self.data[column].plot(ax=ax[i], label=column)
+                self.plot_lod(ax[i], x, self.data[column].to_numpy(dtype=float), column)
                 ax[i].set_title(column)
                 i += 1
         